@@ -1,74 +1,332 @@
 # src/ai_processor.py
 import json
+import os
+import time
+import hashlib
+import uuid
 import asyncio # Keep asyncio for consistency with the rest of the async workflow
+from typing import AsyncIterator, Dict, Any, List, Tuple
 
-# --- IMPORTANT: No LLM API key needed for this simulated version ---
-# We are intentionally NOT importing openai or any other LLM library here.
-
-async def ai_spin_chapter(chapter_text: str, current_iteration: int = 1) -> str:
-    """
-    SIMULATED: Applies an AI-driven "spin" to the chapter text.
-    In a real scenario, this would use an LLM. Here, it simply adds a prefix
-    and suffix to simulate "spinning" the content.
-    """
-    print(f"SIMULATED AI Writer: Spinning chapter (Iteration {current_iteration})...")
-    spun_text = f"[[SIMULATED AI Spun Version - Iteration {current_iteration}]]\n" \
-                f"A creatively rephrased passage based on the original content follows:\n\n" \
-                f"{chapter_text}\n\n" \
-                f"[[End of SIMULATED AI Spun Version]]"
-    print("SIMULATED AI Writer: Chapter spun successfully.")
-    await asyncio.sleep(0.5) # Simulate processing time
-    return spun_text
-
-async def ai_review_chapter(original_text: str, spun_text: str, iteration: int = 1) -> dict:
-    """
-    SIMULATED: An AI Reviewer checks the spun chapter.
-    In a real scenario, this would use an LLM. Here, it provides
-    generic feedback and scores to mimic a review.
-    """
-    print(f"SIMULATED AI Reviewer: Reviewing spun chapter (Iteration {iteration})...")
-    # Simulate different review outcomes for varied testing
-    # The 'simulated_review' flag indicates this is not a real LLM output.
-    if "creatively rephrased passage" in spun_text.lower():
-        fidelity_score = 7 + (iteration % 3)
-        readability_score = 8 + (iteration % 2)
-        grammar_score = 9
-        originality_score = 7 + (iteration % 3)
-        feedback = "SIMULATED FEEDBACK: The spun content shows good creative effort and largely retains the core message. Some areas could be more concise."
-        suggestions = "SIMULATED SUGGESTIONS: Consider condensing overly verbose sentences. Ensure all original nuances are preserved."
-    else:
-        fidelity_score = 5
-        readability_score = 6
-        grammar_score = 7
-        originality_score = 4
-        feedback = "SIMULATED FEEDBACK: The spun content deviates slightly from the original or lacks sufficient 'spin'. Basic errors might be present."
-        suggestions = "SIMULATED SUGGESTIONS: Reread the original carefully. Focus on rephrasing more actively and creatively."
-
-    review_data = {
-        "fidelity_score": fidelity_score,
-        "readability_score": readability_score,
-        "grammar_score": grammar_score,
-        "originality_score": originality_score,
-        "feedback": feedback,
-        "suggestions": suggestions,
-        "simulated_review": True # This flag indicates it's a simulated review
-    }
-    print("SIMULATED AI Reviewer: Chapter reviewed successfully.")
-    await asyncio.sleep(0.5) # Simulate processing time
+from llm_backend import get_llm_backend
+from tracing import record_span, increment
+from segments import Segment, split_segments, split_segments_against, join_segments, segment_hash, SEGMENT_SEPARATOR
+from config import LLM_PARTIAL_OUTPUT_DIR, LLM_METRICS_PATH, SEGMENT_MAX_CONCURRENCY, ensure_dir
+
+# --- IMPORTANT: No LLM API key needed for the default simulated backend ---
+# The backend is chosen by LLM_BACKEND in config.py / .env (see llm_backend.py).
+
+SPIN_SYSTEM_PROMPT = (
+    "You are an AI Writer. Rewrite ('spin') the book chapter you are given in fresh, engaging prose. "
+    "Preserve every plot point, character and nuance of the original. Return only the rewritten chapter."
+)
+
+REVIEW_SYSTEM_PROMPT = (
+    "You are an AI Reviewer. Compare a spun chapter with its original and respond with a JSON object "
+    "containing integer scores from 1 to 10 for 'fidelity_score', 'readability_score', 'grammar_score' "
+    "and 'originality_score', plus 'feedback' and 'suggestions' strings."
+)
+
+REVIEW_SCORE_KEYS = ("fidelity_score", "readability_score", "grammar_score", "originality_score")
+
+def build_spin_messages(chapter_text: str, current_iteration: int, feedback: str = None) -> list:
+    instructions = f"Iteration {current_iteration}."
+    if feedback:
+        instructions += f" Human feedback to consider: '{feedback}'."
+    return [
+        {"role": "system", "content": SPIN_SYSTEM_PROMPT},
+        {"role": "user", "content": f"{instructions} Chapter to rewrite:\n\n{chapter_text}"},
+    ]
+
+def build_review_messages(original_text: str, spun_text: str, iteration: int) -> list:
+    return [
+        {"role": "system", "content": REVIEW_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Iteration {iteration}.\n\nORIGINAL CHAPTER:\n{original_text}\n\nSPUN CHAPTER:\n{spun_text}"},
+    ]
+
+def parse_review(review_text: str) -> dict:
+    """
+    Parses a reviewer's JSON reply; scores missing from the reply default to 0.
+    """
+    try:
+        review_data = json.loads(review_text)
+    except json.JSONDecodeError:
+        # Some models wrap the JSON in prose or code fences; keep the outermost object
+        start, end = review_text.find("{"), review_text.rfind("}")
+        try:
+            review_data = json.loads(review_text[start:end + 1]) if start != -1 else {}
+        except json.JSONDecodeError:
+            review_data = {}
+        if not review_data:
+            review_data = {"feedback": review_text.strip(), "suggestions": ""}
+    for score in REVIEW_SCORE_KEYS:
+        try:
+            review_data[score] = int(review_data.get(score, 0))
+        except (TypeError, ValueError):
+            review_data[score] = 0
     return review_data
 
+def _record_stream_metrics(metrics: Dict[str, Any]):
+    """
+    Appends one call's streaming metrics to LLM_METRICS_PATH (JSON lines) and prints a summary.
+    The call is also traced as an "llm.<operation>" span.
+    """
+    record_span(f"llm.{metrics['operation']}", metrics["total_seconds"], output_name=metrics["output_name"],
+                iteration=metrics["iteration"], ttft_seconds=metrics["ttft_seconds"], tokens=metrics["tokens"])
+    increment("llm_calls", operation=metrics["operation"])
+    increment("llm_tokens", metrics["tokens"], operation=metrics["operation"])
+    ensure_dir(os.path.dirname(LLM_METRICS_PATH))
+    with open(LLM_METRICS_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(metrics) + "\n")
+    print(f"LLM {metrics['operation']} (iteration {metrics['iteration']}): "
+          f"first token after {metrics['ttft_seconds']:.3f}s, "
+          f"{metrics['tokens']} tokens at {metrics['tokens_per_second']:.1f} tokens/s")
+
+async def stream_llm_operation(operation: str, messages: list, context: Dict[str, Any], output_name: str) -> AsyncIterator[str]:
+    """
+    Streams an LLM operation through the configured backend, yielding chunks as they arrive.
+    Each chunk is appended to LLM_PARTIAL_OUTPUT_DIR/<output_name>.<call id>.partial as it
+    streams; the file is renamed to <output_name>.txt once the output is complete, so an
+    interrupted call leaves its partial output behind. Time to first token and tokens/sec are recorded per call.
+    """
+    backend = get_llm_backend()
+    partial_path = os.path.join(ensure_dir(LLM_PARTIAL_OUTPUT_DIR), f"{output_name}.{uuid.uuid4().hex[:8]}.partial")
+    started = time.perf_counter()
+    first_token_at = None
+    chars = 0
+    chunk_count = 0
+    with open(partial_path, "w", encoding="utf-8") as partial_file:
+        async for chunk in backend.stream(operation, messages, context):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chars += len(chunk)
+            chunk_count += 1
+            partial_file.write(chunk)
+            partial_file.flush()
+            yield chunk
+    finished = time.perf_counter()
+    os.replace(partial_path, os.path.join(LLM_PARTIAL_OUTPUT_DIR, f"{output_name}.txt"))
+
+    first_token_at = first_token_at or finished
+    tokens = max(1, chars // 4) # Rough chars-per-token estimate; backends report chunks, not tokens
+    # A single-chunk reply has no measurable generation phase, so fall back to the whole call
+    generation_seconds = (finished - first_token_at if chunk_count > 1 else finished - started) or 1e-9
+    _record_stream_metrics({
+        "operation": operation,
+        "output_name": output_name,
+        "iteration": context.get("iteration", 1),
+        "model": backend.model,
+        "ttft_seconds": round(first_token_at - started, 4),
+        "total_seconds": round(finished - started, 4),
+        "tokens": tokens,
+        "tokens_per_second": round(tokens / generation_seconds, 2),
+        "timestamp": time.time(),
+    })
+
+def _default_output_name(operation: str, text: str, iteration: int) -> str:
+    return f"{operation}_{hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]}_iter{iteration}"
+
+def ai_spin_chapter_stream(chapter_text: str, current_iteration: int = 1, output_name: str = None, feedback: str = None) -> AsyncIterator[str]:
+    """
+    Streaming variant of ai_spin_chapter: yields the spun chapter in chunks as they are produced.
+    """
+    return stream_llm_operation(
+        "spin",
+        build_spin_messages(chapter_text, current_iteration, feedback),
+        {"chapter_text": chapter_text, "iteration": current_iteration},
+        output_name or _default_output_name("spin", chapter_text, current_iteration),
+    )
+
+def ai_review_chapter_stream(original_text: str, spun_text: str, iteration: int = 1, output_name: str = None) -> AsyncIterator[str]:
+    """
+    Streaming variant of ai_review_chapter: yields the reviewer's raw JSON reply in chunks.
+    Join the chunks and pass them to parse_review for the review dict.
+    """
+    return stream_llm_operation(
+        "review",
+        build_review_messages(original_text, spun_text, iteration),
+        {"original_text": original_text, "spun_text": spun_text, "iteration": iteration},
+        output_name or _default_output_name("review", spun_text, iteration),
+    )
+
+async def ai_spin_chapter(chapter_text: str, current_iteration: int = 1, output_name: str = None, feedback: str = None) -> str:
+    """
+    Applies an AI-driven "spin" to the chapter text using the configured LLM backend.
+    With the default simulated backend, it simply adds a prefix and suffix to
+    simulate "spinning" the content.
+    """
+    chunks = [chunk async for chunk in ai_spin_chapter_stream(chapter_text, current_iteration, output_name, feedback)]
+    return "".join(chunks)
+
+async def ai_review_chapter(original_text: str, spun_text: str, iteration: int = 1, output_name: str = None) -> dict:
+    """
+    An AI Reviewer checks the spun chapter using the configured LLM backend.
+    Returns the review scores, feedback and suggestions as a dict.
+    With the default simulated backend, it provides generic feedback and scores to mimic a review.
+    """
+    chunks = [chunk async for chunk in ai_review_chapter_stream(original_text, spun_text, iteration, output_name)]
+    return parse_review("".join(chunks))
+
+class SegmentMemo:
+    """
+    Segment-level spin and review results for one chapter, shared across its workflow iterations.
+    - spins: spin key (segment hash, plus any feedback) -> spun segment text
+    - reviews: (original segment hash, spun segment hash) -> review dict
+    - last_source / last_pairs: input and (original segment, spun text) pairs of the most recent incremental spin
+    - kept: spun segments to carry forward unchanged by the next spin (see keep_unchanged)
+    Results that outlive the workflow come from the LLM response cache instead.
+    """
+
+    def __init__(self):
+        self.spins: Dict[str, str] = {}
+        self.reviews: Dict[Tuple[str, str], dict] = {}
+        self.last_source: str = None
+        self.last_pairs: List[Tuple[Segment, str]] = []
+        self.kept: List[str] = []
+        self.stats = {"spun": 0, "spins_reused": 0, "reviewed": 0, "reviews_reused": 0}
+
+    def fork(self) -> "SegmentMemo":
+        """
+        Returns an independent copy, e.g. for speculative work that may be thrown away.
+        """
+        fork = SegmentMemo()
+        fork.spins = dict(self.spins)
+        fork.reviews = dict(self.reviews)
+        fork.last_source = self.last_source
+        fork.last_pairs = list(self.last_pairs)
+        fork.kept = list(self.kept)
+        fork.stats = dict(self.stats)
+        return fork
+
+    @staticmethod
+    def spin_key(seg_hash: str, feedback: str = None) -> str:
+        return segment_hash(f"{seg_hash}\n{feedback}") if feedback else seg_hash
+
+    def keep_unchanged(self, spun_text: str):
+        """
+        Called before a human edits spun_text: on the next spin of the edited chapter, segments
+        the human left untouched are carried forward as they are, and only edited ones are spun.
+        """
+        if self.kept:
+            # Repeated edits before the next spin: keep what is still untouched
+            self.kept = [text for text in self.kept if text in spun_text]
+        elif self.last_pairs and join_segments([spun for _, spun in self.last_pairs]) == spun_text:
+            self.kept = [spun for _, spun in self.last_pairs]
+        else:
+            self.kept = [segment.text for segment in split_segments(spun_text)]
+
+async def ai_spin_chapter_incremental_stream(
+    chapter_text: str,
+    current_iteration: int,
+    memo: SegmentMemo,
+    feedback: str = None,
+    output_name: str = None,
+) -> AsyncIterator[str]:
+    """
+    Spins a chapter segment by segment, sending only segments without a memoized result to
+    the model (concurrently, up to SEGMENT_MAX_CONCURRENCY), and yields the reassembled
+    chapter in document order as each segment becomes available.
+    """
+    if memo.kept and not feedback:
+        segments = split_segments_against(chapter_text, memo.kept)
+    else:
+        segments = [(segment, False) for segment in split_segments(chapter_text)]
+    memo.kept = [] # Carry-forward applies to this spin only
+    semaphore = asyncio.Semaphore(SEGMENT_MAX_CONCURRENCY)
+    name = output_name or _default_output_name("spin", chapter_text, current_iteration)
+
+    async def spin_segment(segment: Segment, unchanged: bool) -> str:
+        if unchanged:
+            memo.stats["spins_reused"] += 1
+            return segment.text
+        key = memo.spin_key(segment.hash, feedback)
+        if key in memo.spins:
+            memo.stats["spins_reused"] += 1
+            return memo.spins[key]
+        async with semaphore:
+            spun = await ai_spin_chapter(segment.text, current_iteration, f"{name}_seg{segment.hash[:12]}", feedback)
+        memo.stats["spun"] += 1
+        memo.spins[key] = spun.strip()
+        return memo.spins[key]
+
+    tasks = [asyncio.ensure_future(spin_segment(segment, unchanged)) for segment, unchanged in segments]
+    try:
+        spun_segments = []
+        for i, task in enumerate(tasks):
+            spun_segments.append(await task)
+            yield (SEGMENT_SEPARATOR if i else "") + spun_segments[-1]
+        memo.last_source = chapter_text
+        memo.last_pairs = [(segment, spun) for (segment, _), spun in zip(segments, spun_segments)]
+    finally:
+        for task in tasks:
+            task.cancel() # No-op for finished tasks; stops the rest if the consumer gives up early
+
+async def ai_spin_chapter_incremental(chapter_text: str, current_iteration: int, memo: SegmentMemo, feedback: str = None, output_name: str = None) -> str:
+    chunks = [chunk async for chunk in ai_spin_chapter_incremental_stream(chapter_text, current_iteration, memo, feedback, output_name)]
+    return "".join(chunks)
+
+def merge_segment_reviews(reviews: List[dict], weights: List[int]) -> dict:
+    """
+    Combines per-segment reviews into one chapter review: scores are averaged weighted by
+    segment length, and distinct feedback and suggestions are kept in document order.
+    """
+    total_weight = sum(weights) or 1
+    merged = {score: round(sum(r[score] * w for r, w in zip(reviews, weights)) / total_weight) for score in REVIEW_SCORE_KEYS}
+    for field in ("feedback", "suggestions"):
+        merged[field] = " ".join(dict.fromkeys(r.get(field, "") for r in reviews if r.get(field)))
+    if any(r.get("simulated_review") for r in reviews):
+        merged["simulated_review"] = True
+    return merged
+
+async def ai_review_chapter_incremental(original_text: str, spun_text: str, iteration: int, memo: SegmentMemo, output_name: str = None) -> dict:
+    """
+    Reviews a chapter produced by ai_spin_chapter_incremental segment by segment, reviewing
+    only (original, spun) segment pairs without a memoized review, concurrently.
+    Falls back to a whole-chapter review if spun_text isn't the memo's last incremental spin
+    of original_text (e.g. it was edited since).
+    """
+    pairs = memo.last_pairs
+    if not pairs or memo.last_source != original_text or join_segments([spun for _, spun in pairs]) != spun_text:
+        return await ai_review_chapter(original_text, spun_text, iteration, output_name)
+
+    semaphore = asyncio.Semaphore(SEGMENT_MAX_CONCURRENCY)
+    name = output_name or _default_output_name("review", spun_text, iteration)
+
+    async def review_pair(original: Segment, spun: str) -> dict:
+        key = (original.hash, segment_hash(spun))
+        if key not in memo.reviews and original.text == spun:
+            # A carried-forward segment: reuse the review it got when it was spun
+            key = next((k for k in memo.reviews if k[1] == key[1]), key)
+        if key in memo.reviews:
+            memo.stats["reviews_reused"] += 1
+            return memo.reviews[key]
+        async with semaphore:
+            review = await ai_review_chapter(original.text, spun, iteration, f"{name}_seg{original.hash[:12]}")
+        memo.stats["reviewed"] += 1
+        memo.reviews[key] = review
+        return review
+
+    reviews = await asyncio.gather(*(review_pair(original, spun) for original, spun in pairs))
+    review = merge_segment_reviews(reviews, [len(spun) for _, spun in pairs])
+    review["segments_total"] = len(pairs)
+    print(f"Incremental spin/review so far: {memo.stats}")
+    return review
+
 # Example usage for testing this module independently
 async def main_ai_test():
     sample_original_text = "The quick brown fox jumps over the lazy dog. This is a classic sentence, often used to display fonts because it contains all letters of the alphabet. It is simple, yet effective."
     sample_spun_text = "A nimble russet canine vaulted over a sluggish hound. This timeless expression serves as an excellent pangram, showcasing every letter of the English alphabet with remarkable brevity and clarity."
 
-    print("\n--- SIMULATED AI Spin Test ---")
+    print("\n--- AI Spin Test ---")
     spun_result = await ai_spin_chapter(sample_original_text)
     print(f"Spun Text: {spun_result}")
 
-    print("\n--- SIMULATED AI Review Test ---")
+    print("\n--- AI Review Test ---")
     review_result = await ai_review_chapter(sample_original_text, spun_result)
     print(f"Review Result: {json.dumps(review_result, indent=2)}")
 
+    print("\n--- AI Spin Streaming Test ---")
+    async for chunk in ai_spin_chapter_stream(sample_original_text, 2):
+        print(f"Chunk: {chunk!r}")
+
 if __name__ == "__main__":
     asyncio.run(main_ai_test())
@@ -0,0 +1,595 @@
+# src/benchmarks.py
+import argparse
+import asyncio
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import math
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from local_fixtures import generate_wikisource_fixtures
+
+# Ad-hoc performance benchmarks. Each benchmark is self-contained, runs offline
+# against local fixtures, and prints its results.
+# Usage: python benchmarks.py <benchmark-name> [options]
+
+async def bench_scraper_pool(num_pages: int = 20, concurrency: int = 4):
+    """
+    Compares pages/sec of the per-call browser launch path against the pooled ScraperService,
+    fetching the same local HTML fixtures at the same concurrency.
+    """
+    from scraper import ScraperService, fetch_content_and_screenshot
+
+    with tempfile.TemporaryDirectory() as fixtures_dir:
+        paths = generate_wikisource_fixtures(fixtures_dir, num_pages)
+        urls = [pathlib.Path(p).as_uri() for p in paths]
+        gate = asyncio.Semaphore(concurrency)
+
+        async def run(fetch):
+            async def one(i, url):
+                async with gate:
+                    return await fetch(url, f"benchmark_chapter_{i}")
+            started = time.perf_counter()
+            results = await asyncio.gather(*(one(i, url) for i, url in enumerate(urls, 1)))
+            elapsed = time.perf_counter() - started
+            failures = sum(1 for r in results if not r)
+            return elapsed, failures
+
+        async def per_call_fetch(url, chapter_name):
+            return await fetch_content_and_screenshot(url, chapter_name, fetch_mode="browser")
+
+        per_call_elapsed, per_call_failures = await run(per_call_fetch)
+
+        async with ScraperService(pool_size=concurrency) as scraper:
+            pooled_elapsed, pooled_failures = await run(scraper.fetch)
+
+    print(f"\n=== Scraper benchmark: {num_pages} local pages, concurrency {concurrency} ===")
+    print(f"Per-call launch: {num_pages / per_call_elapsed:.2f} pages/sec ({per_call_elapsed:.2f}s, {per_call_failures} failures)")
+    print(f"Pooled service:  {num_pages / pooled_elapsed:.2f} pages/sec ({pooled_elapsed:.2f}s, {pooled_failures} failures)")
+    print(f"Speedup: {per_call_elapsed / pooled_elapsed:.2f}x")
+
+def _load_html_corpus(corpus_dir: str = None, fallback_pages: int = 50) -> list:
+    """
+    Loads saved pages from corpus_dir (default: the HTML cache's objects/ directory).
+    If no saved pages exist yet, generated Wikisource-like fixtures are used instead.
+    """
+    from config import HTML_CACHE_DIR
+    corpus_dir = corpus_dir or os.path.join(HTML_CACHE_DIR, "objects")
+    paths = sorted(glob.glob(os.path.join(corpus_dir, "*.html")))
+    if not paths:
+        print(f"No saved pages in {corpus_dir}; using {fallback_pages} generated fixture pages.")
+        with tempfile.TemporaryDirectory() as fixtures_dir:
+            paths = generate_wikisource_fixtures(fixtures_dir, fallback_pages)
+            return [pathlib.Path(p).read_text(encoding="utf-8") for p in paths]
+    return [pathlib.Path(p).read_text(encoding="utf-8") for p in paths]
+
+def bench_extractors(corpus_dir: str = None, repeat: int = 3):
+    """
+    Reports ms/page and peak traced memory for every registered extraction engine
+    over a corpus of saved Wikisource pages, and checks the engines agree on the text.
+    """
+    from extractors import EXTRACTION_ENGINES, DEFAULT_EXTRACTION_RULE, resolve_parser
+
+    pages = _load_html_corpus(corpus_dir)
+    print(f"\n=== Extractor benchmark: {len(pages)} pages x {repeat} runs (parser for 'strained': {resolve_parser()}) ===")
+    outputs = {}
+    for name, engine in EXTRACTION_ENGINES.items():
+        # Timing pass without tracemalloc (it slows allocation-heavy code considerably)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            texts = [engine(html, DEFAULT_EXTRACTION_RULE) for html in pages]
+        ms_per_page = (time.perf_counter() - started) * 1000 / (len(pages) * repeat)
+
+        # Memory pass: peak allocation while extracting a single page, worst case over the corpus
+        peak_bytes = 0
+        for html in pages:
+            tracemalloc.start()
+            engine(html, DEFAULT_EXTRACTION_RULE)
+            peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        outputs[name] = texts
+        print(f"{name:>10}: {ms_per_page:8.2f} ms/page, peak {peak_bytes / 1024:8.1f} KiB/page")
+
+    reference = outputs.get("legacy")
+    if reference is not None:
+        for name, texts in outputs.items():
+            mismatches = sum(1 for a, b in zip(reference, texts) if a != b)
+            print(f"{name:>10}: {mismatches} pages differ from legacy output")
+
+async def _measure_loop_lag(workload, interval: float = 0.01) -> dict:
+    """
+    Runs `workload` (a coroutine) while a ticker task measures how late each of its
+    interval-second sleeps wakes up. Returns max/mean lag in ms and the workload's wall time.
+    """
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, loop.time() - expected))
+
+    ticker_task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await workload
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker_task
+    return {
+        "max_lag_ms": max(lags, default=0.0) * 1000,
+        "mean_lag_ms": (sum(lags) / len(lags) if lags else 0.0) * 1000,
+        "elapsed_s": elapsed,
+    }
+
+async def bench_version_store(num_saves: int = 200, concurrency: int = 20):
+    """
+    Measures event-loop lag during concurrent save_chapter_version calls, comparing the
+    old inline behaviour (ChromaDB add + embedding on the loop thread) with the
+    executor-backed write-behind queue. Uses a temporary ChromaDB and embedding cache.
+    """
+    import uuid
+    import version_manager as vm
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store_dir = os.path.join(tmp_dir, "chromadb")
+            embeddings_dir = os.path.join(tmp_dir, "embeddings")
+
+            def make_content():
+                # Distinct texts so every save pays for a real embedding
+                return f"Benchmark chapter text {uuid.uuid4()} " * 50
+
+            def make_record(i):
+                content = make_content()
+                return {
+                    "id": f"bench-{i}-{uuid.uuid4()}",
+                    "content": content,
+                    "metadata": {"chapter_id": f"bench_{i % 10}", "version_id": str(i), "version_type": "spun",
+                                 "iteration": 1, "timestamp": "", "content_hash": vm.content_hash_for(content)},
+                }
+
+            async def run_saves(save_one):
+                gate = asyncio.Semaphore(concurrency)
+                async def one(i):
+                    async with gate:
+                        await save_one(i)
+                await asyncio.gather(*(one(i) for i in range(num_saves)))
+
+            # Old behaviour: the synchronous store call runs directly inside the coroutine
+            vm.configure_version_store(data_dir=store_dir, collection_name="bench_inline", embedding_cache_dir=embeddings_dir)
+            async def save_inline(i):
+                vm._write_versions([make_record(i)])
+            inline = await _measure_loop_lag(run_saves(save_inline))
+
+            # New behaviour: enqueue, batched writes on the store thread, then flush for durability
+            vm.configure_version_store(data_dir=store_dir, collection_name="bench_queued", embedding_cache_dir=embeddings_dir)
+            async def save_queued(i):
+                await vm.save_chapter_version(f"bench_{i % 10}", str(uuid.uuid4()), make_content(), "spun", 1)
+            async def queued_workload():
+                await run_saves(save_queued)
+                await vm.flush_pending_writes()
+            queued = await _measure_loop_lag(queued_workload())
+            await vm.close_version_store()
+    finally:
+        vm.configure_version_store() # Back to the real store
+
+    print(f"\n=== Version store benchmark: {num_saves} saves, concurrency {concurrency} ===")
+    for label, result in (("Inline (blocking)", inline), ("Write-behind queue", queued)):
+        print(f"{label:>20}: max loop lag {result['max_lag_ms']:8.1f} ms, mean {result['mean_lag_ms']:6.1f} ms, "
+              f"{num_saves / result['elapsed_s']:7.1f} saves/sec")
+
+async def bench_reembed(num_versions: int = 200):
+    """
+    Stores num_versions versions, then re-embeds the store twice against an empty embedding cache:
+    the first pass encodes every text, the second must be served entirely from the cache.
+    Uses a temporary ChromaDB and the hashed embedding, so no model is needed.
+    """
+    import uuid
+    import version_manager as vm
+
+    runs = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store_dir = os.path.join(tmp_dir, "chromadb")
+            vm.configure_version_store(data_dir=store_dir, collection_name="bench_reembed",
+                                       embedding_cache_dir=os.path.join(tmp_dir, "embeddings"), embedding_function=_hashed_embedding)
+            for i in range(num_versions):
+                await vm.save_chapter_version(f"bench_{i % 10}", str(uuid.uuid4()), f"Benchmark chapter text {uuid.uuid4()} " * 50, "spun", 1)
+            await vm.flush_pending_writes()
+            # A fresh cache, as after moving the store to another machine
+            vm.configure_version_store(data_dir=store_dir, collection_name="bench_reembed",
+                                       embedding_cache_dir=os.path.join(tmp_dir, "embeddings_cold"), embedding_function=_hashed_embedding)
+            for _ in range(2):
+                started = time.perf_counter()
+                result = await vm.reembed_collection()
+                runs.append({**result, "elapsed_s": time.perf_counter() - started})
+            await vm.close_version_store()
+    finally:
+        vm.configure_version_store() # Back to the real store
+
+    print(f"\n=== Re-embed benchmark: {num_versions} versions ===")
+    for label, run in zip(("Cold cache", "Warm cache"), runs):
+        print(f"{label:>11}: {run['updated']} updated, {run['cache_hits']} cache hits, {run['cache_misses']} encoded, {run['elapsed_s']:.2f} s")
+    if runs[1]["cache_misses"]:
+        raise SystemExit(f"FAIL: the second re-embed encoded {runs[1]['cache_misses']} texts; it should be served from the cache")
+    print("OK: the second re-embed was served entirely from the embedding cache")
+
+def _time_cold_import(tree_dir: str, module: str, runs: int) -> list:
+    """
+    Imports `module` in a fresh interpreter `runs` times from tree_dir; returns wall times in ms.
+    """
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", f"import {module}"], cwd=tree_dir, capture_output=True, text=True)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if completed.returncode != 0:
+            raise RuntimeError(f"import {module} failed in {tree_dir}:\n{completed.stderr}")
+        timings.append(elapsed_ms)
+    return timings
+
+def bench_import_time(module: str = "main", runs: int = 5, baseline_ref: str = None):
+    """
+    Measures cold-start import time of `module` for the working tree and, optionally,
+    for a git revision (e.g. the commit before lazy initialization) checked out into a
+    temporary directory. Each import runs in its own interpreter with a scratch cwd
+    so data directories created by older code don't touch the real ones.
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    trees = [("working tree", repo_dir)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if baseline_ref:
+            baseline_dir = os.path.join(tmp_dir, "baseline")
+            os.makedirs(baseline_dir)
+            archive = subprocess.run(["git", "archive", baseline_ref], cwd=repo_dir, capture_output=True, check=True)
+            subprocess.run(["tar", "-x", "-C", baseline_dir], input=archive.stdout, check=True)
+            trees.insert(0, (baseline_ref, baseline_dir))
+
+        print(f"\n=== Cold import of '{module}' ({runs} runs each) ===")
+        for label, tree_dir in trees:
+            timings = _time_cold_import(tree_dir, module, runs)
+            print(f"{label:>20}: median {statistics.median(timings):8.1f} ms, min {min(timings):8.1f} ms")
+
+async def bench_llm_load(num_chapters: int = 50, latency: float = 0.2, rps_limit: float = 20, error_rate: float = 0.05,
+                         max_concurrency: int = 8, rate_limit_per_second: float = 15, rate_limit_burst: int = 10):
+    """
+    Load-tests ai_spin_chapter + ai_review_chapter for many chapters at once against the
+    local mock LLM server (emulated latency and 429s), through the OpenAI-compatible backend.
+    """
+    from ai_processor import ai_spin_chapter, ai_review_chapter
+    from llm_backend import OpenAICompatibleBackend, LLMRequestError, set_llm_backend, close_llm_backend
+    from mock_llm_server import start_mock_llm_server
+
+    server, base_url = start_mock_llm_server(latency=latency, rps_limit=rps_limit, error_rate=error_rate)
+    backend = OpenAICompatibleBackend(
+        base_url=base_url, api_key="", model="mock", max_concurrency=max_concurrency,
+        rate_limit_per_second=rate_limit_per_second, rate_limit_burst=rate_limit_burst,
+    )
+    set_llm_backend(backend)
+
+    async def one_chapter(i):
+        chapter_text = f"Chapter {i}.\n\n" + "The tide came in over the reef. " * 200
+        try:
+            spun = await ai_spin_chapter(chapter_text, 1)
+            await ai_review_chapter(chapter_text, spun, 1)
+            return True
+        except LLMRequestError as e:
+            print(f"Chapter {i} failed: {e}")
+            return False
+
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one_chapter(i) for i in range(num_chapters)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await close_llm_backend()
+        server.shutdown()
+
+    print(f"\n=== LLM load test: {num_chapters} chapters (spin + review) against mock server ===")
+    print(f"Mock server: latency {latency}s, rps limit {rps_limit}, random 429 rate {error_rate}")
+    print(f"Client: concurrency {max_concurrency}, token bucket {rate_limit_per_second}/s burst {rate_limit_burst}")
+    print(f"Completed {sum(results)}/{num_chapters} chapters in {elapsed:.2f}s ({sum(results) / elapsed:.2f} chapters/sec)")
+    print(f"Client stats: {backend.stats}")
+    print(f"Server stats: {server.stats}")
+
+class ScriptedReviewDriver:
+    """
+    Answers human review tasks without a person, following the same script for every chapter:
+    approve the first iteration, then give feedback and edit the next one, then finalize.
+    Tasks are answered concurrently, each after `human_delay` seconds of simulated reading.
+    """
+
+    FEEDBACK_SCRIPT = ("approve", "Tighten the opening paragraph.", "finalize")
+    DECISION = "Edit content directly"
+    EDIT_SUFFIX = "\n\nThe editor added one closing line."
+
+    def __init__(self, queue, human_delay: float = 0.0):
+        self.queue = queue
+        self.human_delay = human_delay
+        self.answered = 0
+        self._feedback_counts = {} # chapter_name -> feedback tasks answered so far
+        self._listener = queue.subscribe()
+        self._answering = set()
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            task_id = await self._listener.get()
+            answering = asyncio.ensure_future(self._answer(task_id))
+            self._answering.add(answering)
+            answering.add_done_callback(self._answering.discard)
+
+    async def _answer(self, task_id: str):
+        if self.human_delay:
+            await asyncio.sleep(self.human_delay)
+        task = self.queue.get(task_id)
+        if task is None:
+            return
+        if task["kind"] == "feedback":
+            count = self._feedback_counts.get(task["chapter_name"], 0)
+            self._feedback_counts[task["chapter_name"]] = count + 1
+            answer = self.FEEDBACK_SCRIPT[min(count, len(self.FEEDBACK_SCRIPT) - 1)]
+        elif task["kind"] == "decision":
+            answer = self.DECISION
+        else:
+            answer = task["content"] + self.EDIT_SUFFIX
+        if self.queue.submit(task_id, answer):
+            self.answered += 1
+
+    async def close(self):
+        self._worker.cancel()
+        for answering in list(self._answering):
+            answering.cancel()
+
+def _hashed_embedding(texts: list, dim: int = 384) -> list:
+    """
+    Deterministic bag-of-words embedding (hashed tokens, L2-normalized), so benchmarks can store
+    and search versions without downloading or running the sentence-transformers model.
+    """
+    import numpy as np
+    vectors = []
+    for text in texts:
+        vector = np.zeros(dim, dtype=np.float32)
+        for token in text.lower().split():
+            vector[int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest(), "little") % dim] += 1.0
+        norm = np.linalg.norm(vector)
+        vectors.append((vector / norm if norm else vector).tolist())
+    return vectors
+
+def _percentile(values: list, pct: float) -> float:
+    # Nearest-rank percentile; values must be non-empty
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+def _directory_bytes(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError: # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1) # Bytes on macOS, KiB on Linux
+
+async def _run_pipeline(num_chapters: int, latency: float, max_ai_iterations: int, paragraphs: int,
+                        human_delay: float, speculative: bool, embeddings: str, verbose: bool) -> dict:
+    """
+    One offline end-to-end run of process_book_batch over num_chapters local fixture pages.
+    Must run with a scratch working directory: every data/ path (ChromaDB, caches, checkpoints,
+    traces) is relative, so the whole run stays inside it.
+    """
+    import main as workflow
+    import review_queue
+    import tracing
+    import version_manager as vm
+    import workflow_state
+    from llm_backend import SimulatedBackend, set_llm_backend, close_llm_backend
+    from local_fixtures import start_fixture_server
+    from scraper import close_http_fetcher, configure_fetch_mode
+    from config import CHROMADB_DATA_DIR, EMBEDDING_CACHE_DIR, TRACE_PATH
+
+    site_dir = os.path.abspath("site")
+    paths = generate_wikisource_fixtures(site_dir, num_chapters, num_paragraphs=paragraphs)
+    server, base_url = start_fixture_server(site_dir)
+    manifest = [(f"{base_url}/{os.path.basename(p)}", f"Benchmark Chapter {i}") for i, p in enumerate(paths, 1)]
+
+    # Absolute paths: ChromaDB keeps clients per path string, and every run has its own directory
+    vm.configure_version_store(data_dir=os.path.abspath(CHROMADB_DATA_DIR), embedding_cache_dir=os.path.abspath(EMBEDDING_CACHE_DIR),
+                               embedding_function=_hashed_embedding if embeddings == "hashed" else None)
+    review_queue.configure_review_frontends([])
+    configure_fetch_mode("http") # Static fixture pages; no browser needed
+    set_llm_backend(SimulatedBackend(latency=latency)) # Uncached, so every size pays for its AI calls
+    driver = ScriptedReviewDriver(review_queue.get_review_queue(), human_delay)
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            started = time.perf_counter()
+            summary = await workflow.process_book_batch(manifest, max_ai_iterations=max_ai_iterations, speculative=speculative)
+            await vm.flush_pending_writes() # Versions count once they are durable
+            elapsed = time.perf_counter() - started
+            versions_stored = await vm._run_in_store(lambda: vm.get_collection().count())
+            versions_saved = tracing.get_tracer().counter_values("versions_saved")
+    finally:
+        await driver.close()
+        await review_queue.close_review_queue()
+        await close_http_fetcher()
+        await close_llm_backend()
+        await vm.close_version_store()
+        workflow_state.close_checkpoint_store()
+        tracing.close_tracing()
+        review_queue.configure_review_frontends()
+        configure_fetch_mode()
+        vm.configure_version_store()
+        server.shutdown()
+        server.server_close()
+
+    durations = {}
+    with open(TRACE_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            span = json.loads(line)
+            durations.setdefault(span["name"], []).append(span["duration_ms"])
+    statuses = {}
+    for entry in summary:
+        statuses[entry["status"]] = statuses.get(entry["status"], 0) + 1
+    versions_by_type = {}
+    for labels, count in versions_saved.items():
+        version_type = dict(labels)["version_type"]
+        versions_by_type[version_type] = versions_by_type.get(version_type, 0) + int(count)
+    store_bytes = _directory_bytes(CHROMADB_DATA_DIR)
+    return {
+        "chapters": num_chapters,
+        "elapsed_seconds": round(elapsed, 3),
+        "chapters_per_minute": round(num_chapters / elapsed * 60, 2),
+        "statuses": statuses,
+        "stages": {
+            name: {"count": len(values), "p50_ms": _percentile(values, 50), "p95_ms": _percentile(values, 95)}
+            for name, values in sorted(durations.items())
+        },
+        "peak_rss_mb": _peak_rss_mb(),
+        "versions_stored": versions_stored,
+        "versions_by_type": versions_by_type,
+        "store_bytes": store_bytes,
+        "store_bytes_per_version": round(store_bytes / versions_stored) if versions_stored else None,
+        "human_answers": driver.answered,
+    }
+
+def bench_pipeline(sizes: list = (1, 10, 100, 1000), latency: float = 0.05, max_ai_iterations: int = 3, paragraphs: int = 12,
+                   human_delay: float = 0.0, speculative: bool = False, embeddings: str = "hashed",
+                   in_process: bool = False, verbose: bool = False, output_path: str = None) -> dict:
+    """
+    End-to-end offline benchmark of the whole workflow (scrape, spin, review, human review,
+    versioning) at several book sizes. Chapters are served from generated local HTML, the AI is
+    the simulated backend with the given latency, a scripted driver answers every human review,
+    and each run gets its own temporary ChromaDB and data directory.
+    Reports chapters/min, per-stage p50/p95 latency (from tracing spans), peak RSS and storage
+    bytes per stored version, as JSON (to output_path, or stdout).
+    Each size runs in a fresh interpreter so peak RSS is per size, unless in_process is set.
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            if in_process:
+                previous_dir = os.getcwd()
+                os.chdir(work_dir)
+                try:
+                    result = asyncio.run(_run_pipeline(size, latency, max_ai_iterations, paragraphs, human_delay, speculative, embeddings, verbose))
+                finally:
+                    os.chdir(previous_dir)
+            else:
+                size_output = os.path.join(work_dir, "result.json")
+                command = [
+                    sys.executable, os.path.join(repo_dir, "benchmarks.py"), "pipeline", "--in-process",
+                    "--sizes", str(size), "--latency", str(latency), "--max-ai-iterations", str(max_ai_iterations),
+                    "--paragraphs", str(paragraphs), "--human-delay", str(human_delay), "--embeddings", embeddings,
+                    "--output", size_output,
+                ] + (["--speculative"] if speculative else []) + (["--verbose"] if verbose else [])
+                completed = subprocess.run(command, cwd=work_dir, stdout=None if verbose else subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                if completed.returncode != 0:
+                    raise RuntimeError(f"Pipeline benchmark for {size} chapters failed:\n{completed.stderr}")
+                with open(size_output, "r", encoding="utf-8") as f:
+                    result = json.load(f)["results"][0]
+        results.append(result)
+        print(f"{size:>5} chapters: {result['chapters_per_minute']:9.1f} chapters/min, "
+              f"peak RSS {result['peak_rss_mb']} MB, {result['versions_stored']} versions "
+              f"({result['store_bytes_per_version']} bytes each)", file=sys.stderr)
+
+    report = {
+        "benchmark": "pipeline",
+        "timestamp": time.time(),
+        "config": {"latency": latency, "max_ai_iterations": max_ai_iterations, "paragraphs": paragraphs,
+                   "human_delay": human_delay, "speculative": speculative, "embeddings": embeddings},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    scraper_parser = subparsers.add_parser("scraper-pool", help="Per-call browser launch vs pooled ScraperService.")
+    scraper_parser.add_argument("--pages", type=int, default=20)
+    scraper_parser.add_argument("--concurrency", type=int, default=4)
+
+    extractors_parser = subparsers.add_parser("extractors", help="ms/page and peak memory of the HTML extraction engines.")
+    extractors_parser.add_argument("--corpus", default=None, help="Directory of saved .html pages (default: the HTML cache).")
+    extractors_parser.add_argument("--repeat", type=int, default=3)
+
+    store_parser = subparsers.add_parser("version-store", help="Event-loop lag under concurrent saves: inline vs write-behind queue.")
+    store_parser.add_argument("--saves", type=int, default=200)
+    store_parser.add_argument("--concurrency", type=int, default=20)
+
+    reembed_parser = subparsers.add_parser("reembed", help="Re-embedding the store twice: the second pass must be all cache hits.")
+    reembed_parser.add_argument("--versions", type=int, default=200)
+
+    import_parser = subparsers.add_parser("import-time", help="Cold-start import time of a module, optionally vs a git revision.")
+    import_parser.add_argument("--module", default="main")
+    import_parser.add_argument("--runs", type=int, default=5)
+    import_parser.add_argument("--baseline-ref", default=None, help="Git revision to compare against, e.g. HEAD~1.")
+
+    llm_parser = subparsers.add_parser("llm-load", help="Throughput of the LLM backend against the local mock server.")
+    llm_parser.add_argument("--chapters", type=int, default=50)
+    llm_parser.add_argument("--latency", type=float, default=0.2)
+    llm_parser.add_argument("--rps-limit", type=float, default=20)
+    llm_parser.add_argument("--error-rate", type=float, default=0.05)
+    llm_parser.add_argument("--concurrency", type=int, default=8)
+    llm_parser.add_argument("--rate", type=float, default=15, help="Client token-bucket rate (requests/second).")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="End-to-end offline workflow run at several book sizes, reported as JSON.")
+    pipeline_parser.add_argument("--sizes", default="1,10,100,1000", help="Comma-separated chapter counts.")
+    pipeline_parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per spin/review call.")
+    pipeline_parser.add_argument("--max-ai-iterations", type=int, default=3)
+    pipeline_parser.add_argument("--paragraphs", type=int, default=12, help="Paragraphs per generated chapter.")
+    pipeline_parser.add_argument("--human-delay", type=float, default=0.0, help="Simulated seconds a reviewer takes per answer.")
+    pipeline_parser.add_argument("--speculative", action="store_true")
+    pipeline_parser.add_argument("--embeddings", choices=("hashed", "model"), default="hashed",
+                                 help="'hashed' needs no model download; 'model' uses sentence-transformers.")
+    pipeline_parser.add_argument("--in-process", action="store_true", help="Run every size in this interpreter.")
+    pipeline_parser.add_argument("--verbose", action="store_true", help="Show the workflow's own output.")
+    pipeline_parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout.")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "scraper-pool":
+        asyncio.run(bench_scraper_pool(num_pages=args.pages, concurrency=args.concurrency))
+    elif args.benchmark == "extractors":
+        bench_extractors(corpus_dir=args.corpus, repeat=args.repeat)
+    elif args.benchmark == "version-store":
+        asyncio.run(bench_version_store(num_saves=args.saves, concurrency=args.concurrency))
+    elif args.benchmark == "reembed":
+        asyncio.run(bench_reembed(num_versions=args.versions))
+    elif args.benchmark == "import-time":
+        bench_import_time(module=args.module, runs=args.runs, baseline_ref=args.baseline_ref)
+    elif args.benchmark == "llm-load":
+        asyncio.run(bench_llm_load(num_chapters=args.chapters, latency=args.latency, rps_limit=args.rps_limit,
+                                   error_rate=args.error_rate, max_concurrency=args.concurrency, rate_limit_per_second=args.rate))
+    elif args.benchmark == "pipeline":
+        bench_pipeline(sizes=[int(size) for size in args.sizes.split(",")], latency=args.latency, max_ai_iterations=args.max_ai_iterations,
+                       paragraphs=args.paragraphs, human_delay=args.human_delay, speculative=args.speculative,
+                       embeddings=args.embeddings, in_process=args.in_process, verbose=args.verbose, output_path=args.output)
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,158 @@ RAW_CONTENT_DIR = "data/raw_content"
 PROCESSED_CHAPTERS_DIR = "data/processed_chapters"
 SCREENSHOTS_DIR = "data/screenshots"
 CHROMADB_DATA_DIR = "data/chromadb_data"
+HTML_CACHE_DIR = "data/html_cache" # Content-addressed raw HTML, revalidated with ETag/Last-Modified
 
-    # Ensure directories exist (redundant if mkdir -p was used, but harmless)
-for _dir in [RAW_CONTENT_DIR, PROCESSED_CHAPTERS_DIR, SCREENSHOTS_DIR, CHROMADB_DATA_DIR]:
-        os.makedirs(_dir, exist_ok=True)
-    
\ No newline at end of file
+    # Directories are created on first write (see ensure_dir) rather than at import time,
+    # so importing config stays free of filesystem side effects.
+def ensure_dir(path: str) -> str:
+    """
+    Creates a data directory if it doesn't exist yet and returns its path.
+    """
+    os.makedirs(path, exist_ok=True)
+    return path
+    
+    # Batch processing defaults (see main.process_book_batch)
+    # Each stage of the chapter pipeline gets its own concurrency limit so that,
+    # e.g., many chapters can wait on scraping while only a few hit the AI at once.
+BATCH_MAX_CONCURRENT_CHAPTERS = 8
+BATCH_SCRAPE_CONCURRENCY = 4
+BATCH_AI_CONCURRENCY = 4
+BATCH_SAVE_CONCURRENCY = 2
+
+    # Scraper browser pool (see scraper.ScraperService)
+SCRAPER_POOL_SIZE = 4 # Max pages open at once in the shared Chromium browser
+SCRAPER_PAGE_MAX_USES = 25 # A page is closed and replaced after this many fetches
+
+    # Screenshots of browser fetches (see screenshots.py); HTTP fetches never take one.
+    # "background": captured after the text is returned, "inline": before it is returned, "off": never.
+SCREENSHOT_MODE = os.getenv("SCREENSHOT_MODE", "background")
+SCREENSHOT_FORMAT = "jpeg" # "jpeg", "png" or "webp" (webp needs Pillow; jpeg is used without it)
+SCREENSHOT_QUALITY = 70 # jpeg/webp quality
+SCREENSHOT_FULL_PAGE = False # Viewport only by default; full-page captures of long chapters run to megabytes
+SCREENSHOT_VIEWPORT = (1280, 1600) # Page size (CSS pixels) the capture is taken at
+SCREENSHOT_MAX_WIDTH = 800 # Stored captures are downscaled to this width (needs Pillow)
+SCREENSHOT_HASH_DISTANCE = 4 # Perceptual hashes this close (Hamming distance, of 64 bits) count as unchanged
+
+    # Fetch mode for scraper.fetch_content_and_screenshot:
+    # "browser" renders the page in Chromium (needed for JS-heavy pages and screenshots),
+    # "http" pulls static HTML over pooled HTTP connections, much faster but without screenshots.
+SCRAPER_FETCH_MODE = os.getenv("SCRAPER_FETCH_MODE", "browser")
+HTTP_MAX_CONNECTIONS = 10
+HTTP_TIMEOUT_SECONDS = 30
+HTTP_USER_AGENT = "AutomatedBookWorkflow/1.0 (offline-friendly scraper)"
+
+    # Text extraction (see extractors.py)
+    # Rules are matched on the URL host (a rule for "wikisource.org" also covers "en.wikisource.org").
+    # container_tag/container_attrs locate the element holding the chapter text; strip_selectors
+    # are removed from inside it before the text is extracted.
+EXTRACTION_ENGINE = "strained" # "strained" (parses only the container) or "legacy" (whole document)
+EXTRACTION_PARSER = "lxml" # Falls back to Python's built-in "html.parser" if lxml isn't installed
+DEFAULT_EXTRACTION_RULE = {
+    "container_tag": "div",
+    "container_attrs": {"id": "mw-content-text"},
+    "strip_selectors": ["script", "style", "nav", "sup", "span", "div.printfooter", "table", ".mw-editsection"],
+}
+EXTRACTION_RULES = {
+    "wikisource.org": DEFAULT_EXTRACTION_RULE,
+}
+
+    # Embeddings (see embedding_cache.py)
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = "data/embedding_cache" # One memory-mapped float32 matrix + index per model
+EMBEDDING_CACHE_MAX_ENTRIES = 0 # 0 = unbounded; otherwise least recently used vectors are evicted
+EMBEDDING_BATCH_SIZE = 32 # Cache misses are encoded in micro-batches of this size
+    # Model inference runs in this many worker processes (see embedding_pool.py); 0 encodes on the store thread.
+    # Each worker imports torch and loads the model, so the pool only pays off for large batches: opt in with
+    # this variable or the batch/crawl --embedding-workers flag.
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "0"))
+    # Texts are embedded as overlapping passages (see passages.py); a version's vector is pooled from them.
+EMBEDDING_PASSAGE_WORDS = 160 # Stays within the model's 256-token input limit
+EMBEDDING_PASSAGE_OVERLAP_WORDS = 32
+
+    # Version store write-behind queue (see version_manager.VersionWriteQueue)
+VERSION_WRITE_QUEUE_SIZE = 256 # Max versions waiting to be written before savers block
+VERSION_WRITE_BATCH_SIZE = 32 # Versions written per batched `add`
+VERSION_WRITE_FLUSH_SECONDS = 0.5 # Max time a queued version waits before its batch is written
+
+    # Delta-encoded version chains (see version_deltas.py)
+    # A new chapter text is stored as a compressed delta against the chapter's previous text;
+    # every VERSION_KEYFRAME_INTERVAL-th text in a chain is stored in full to bound reconstruction.
+VERSION_DELTAS_ENABLED = True
+VERSION_KEYFRAME_INTERVAL = 8
+VERSION_TEXT_CACHE_SIZE = 256 # Reconstructed texts kept in memory (least recently used are dropped)
+
+    # LLM backend (see llm_backend.py)
+    # "simulated" needs no API key or network; "openai" talks to any OpenAI-compatible
+    # /chat/completions endpoint (including mock_llm_server.py for offline load tests).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "simulated")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_TEMPERATURE = 0.7
+LLM_MAX_CONCURRENCY = 8 # Requests in flight at once, across all chapters
+LLM_RATE_LIMIT_PER_SECOND = 5.0 # Token-bucket refill rate (requests/second)
+LLM_RATE_LIMIT_BURST = 10 # Token-bucket capacity
+LLM_MAX_RETRIES = 5 # Retries on 429, 5xx and timeouts (jittered exponential backoff)
+LLM_BACKOFF_BASE_SECONDS = 0.5
+LLM_BACKOFF_MAX_SECONDS = 30.0
+LLM_TIMEOUT_SECONDS = 120 # Per-request timeout
+SIMULATED_LLM_LATENCY = 0.5 # Seconds each simulated spin/review takes
+
+    # Streaming LLM output (see ai_processor.stream_llm_operation)
+LLM_PARTIAL_OUTPUT_DIR = "data/partial_output" # Output is appended here chunk by chunk while it streams
+LLM_METRICS_PATH = "data/llm_metrics.jsonl" # One line per call: time to first token, tokens/sec
+
+    # LLM response cache (see llm_cache.py and llm_backend.CachingBackend)
+    # "readwrite" serves repeated calls from the cache and stores new responses, "replay" only
+    # serves from the cache and fails on a miss (no model calls, e.g. in CI), "off" disables it.
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "readwrite")
+LLM_CACHE_PATH = "data/llm_cache.sqlite3"
+LLM_CACHE_MAX_ENTRIES = 10000 # 0 = unbounded; otherwise least recently used responses are evicted
+
+    # Paragraph-level incremental spin/review (see segments.py and ai_processor.SegmentMemo)
+    # Chapters are spun and reviewed segment by segment, and only segments that changed are sent to the model.
+AI_INCREMENTAL_SEGMENTS = True
+SEGMENT_MIN_CHARS = 400 # Short paragraphs are grouped with the following ones up to this size
+SEGMENT_MAX_CONCURRENCY = 8 # Segment spins/reviews in flight at once per chapter
+
+    # Speculative iterations (see speculation.py): while a human reviews, the next AI spin + review
+    # runs in the background and is used if the human approves. Costs wasted AI calls otherwise.
+SPECULATIVE_ITERATIONS = False
+
+    # Human review queue (see review_queue.py)
+    # Comma-separated frontends answering review tasks: "terminal" (input() prompts) and/or "http" (JSON endpoint).
+REVIEW_FRONTENDS = [name.strip() for name in os.getenv("REVIEW_FRONTENDS", "terminal").split(",") if name.strip()]
+REVIEW_HTTP_PORT = int(os.getenv("REVIEW_HTTP_PORT", "8765"))
+
+    # Workflow checkpoints (see workflow_state.py): each chapter's workflow state is saved after every step,
+    # so an interrupted run can be continued with `python main.py resume`.
+WORKFLOW_STATE_PATH = "data/workflow_state.sqlite3"
+
+    # Tracing and metrics (see tracing.py): spans for every workflow stage, written as JSON lines,
+    # plus latency histograms and counters exported in Prometheus text format.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() not in ("0", "false", "no")
+TRACE_PATH = "data/traces.jsonl"
+METRICS_PROMETHEUS_PATH = "data/metrics.prom" # Rewritten when tracing is closed
+METRICS_HTTP_PORT = int(os.getenv("METRICS_HTTP_PORT", "0")) # Serves /metrics on localhost when set
+
+    # Table-of-contents crawler (see crawler.py): discovers a book's chapters from its index page.
+    # Politeness: fetches are bounded overall and per host, and requests to a host are spaced out.
+CRAWL_MAX_CONCURRENT_FETCHES = 4
+CRAWL_PER_HOST_CONCURRENCY = 2
+CRAWL_HOST_DELAY_SECONDS = 0.5 # Minimum time between request starts to the same host
+CRAWL_MAX_DEPTH = 3 # Levels of nested tables of contents followed below the index
+
+    # Book export (see publish.py): every chapter's preferred version is rendered into
+    # PROCESSED_CHAPTERS_DIR as Markdown and HTML, plus a whole-book Markdown file, an HTML
+    # contents page and an EPUB. Chapters whose content hash is unchanged aren't re-rendered.
+BOOK_TITLE = os.getenv("BOOK_TITLE", "The Gates of Morning")
+BOOK_AUTHOR = os.getenv("BOOK_AUTHOR", "Henry De Vere Stacpoole")
+BOOK_LANGUAGE = "en"
+
+    # Version retention (see version_retention.py): what `python main.py compact` keeps for each chapter.
+    # The versions the best-version index points at are always kept, as are chapters still being processed.
+RETENTION_KEEP_VERSION_TYPES = ["final"] # Every version of these types is kept
+RETENTION_KEEP_TOP_REVIEWED = 2 # Highest-scoring reviewed versions kept
+RETENTION_KEEP_LATEST = 3 # Most recent of the remaining versions (raw, spun, human_edited, other reviewed) kept
+RETENTION_DELETE_BATCH_SIZE = 500
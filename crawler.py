@@ -0,0 +1,212 @@
+# src/crawler.py
+import asyncio
+import re
+from typing import AsyncIterator, Dict, List, Tuple
+from urllib.parse import urljoin, urldefrag, urlparse, unquote
+from config import CRAWL_MAX_CONCURRENT_FETCHES, CRAWL_PER_HOST_CONCURRENCY, CRAWL_HOST_DELAY_SECONDS, CRAWL_MAX_DEPTH
+from extractors import get_extraction_rule, resolve_parser
+from http_fetcher import HtmlCache, HttpFetcher
+from tracing import span, increment
+
+# Table-of-contents crawler: discovers every chapter of a book from its index page.
+# Wikisource books are page trees: "Book/Part_1/Chapter_1" is a subpage of "Book/Part_1", which
+# is a subpage of the index "Book". A page that links to subpages of itself is a table of
+# contents and is expanded in place; any other page it links to is a chapter. Navigation,
+# edit links, other works and other hosts are ignored because they aren't subpages.
+# Chapters aren't fetched just to learn they are chapters. A link is known to be a table of
+# contents if the same page also links to its subpages. The other links are grouped by the shape
+# of their last path segment ("Chapter_1" and "Chapter_7" share the shape "Chapter_#"), and only
+# the first page of each group is fetched: if it is a chapter, so are the rest of its group.
+# A crawl therefore costs about one fetch per table of contents, not one per chapter.
+# Chapters are yielded in reading order as soon as everything before them is known, while the
+# rest of the tree is still being fetched, so processing can start before discovery finishes.
+
+_PAGE_SUFFIX = re.compile(r"\.html?$")
+_DIGITS = re.compile(r"\d+")
+
+def _subpage_prefix(url: str) -> str:
+    path = _PAGE_SUFFIX.sub("", urlparse(url).path)
+    return path.rstrip("/") + "/"
+
+def _page_shape(url: str) -> str:
+    # Last path segment with every run of digits replaced, e.g. "Chapter_#"
+    segment = _subpage_prefix(url).rstrip("/").rsplit("/", 1)[-1]
+    return _DIGITS.sub("#", segment)
+
+def extract_toc_links(html: str, page_url: str) -> List[str]:
+    """
+    Returns the absolute URLs of the subpages linked from a page's content, deduplicated,
+    in document order.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+    rule = get_extraction_rule(page_url)
+    strainer = SoupStrainer(rule["container_tag"], attrs=rule["container_attrs"])
+    soup = BeautifulSoup(html, resolve_parser(), parse_only=strainer)
+    if soup.find(rule["container_tag"], attrs=rule["container_attrs"]) is None:
+        soup = BeautifulSoup(html, resolve_parser()) # No content container; consider every link
+    host = urlparse(page_url).netloc
+    prefix = _subpage_prefix(page_url)
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        url = urldefrag(urljoin(page_url, anchor["href"]))[0]
+        parsed = urlparse(url)
+        if parsed.netloc != host or parsed.query or not parsed.path.startswith(prefix) or url in links:
+            continue # Other hosts, edit/history links, pages outside this one's tree, repeats
+        links.append(url)
+    return links
+
+def chapter_name_from_url(url: str, index_url: str) -> str:
+    """
+    Derives a readable chapter name from its URL relative to the book's index,
+    e.g. ".../wiki/The_Gates_of_Morning/Book_1/Chapter_1" -> "The Gates of Morning - Book 1 - Chapter 1".
+    """
+    book_parent = _subpage_prefix(index_url).rstrip("/").rsplit("/", 1)[0] + "/"
+    path = unquote(_PAGE_SUFFIX.sub("", urlparse(url).path))
+    relative = path[len(book_parent):] if path.startswith(book_parent) else path.lstrip("/")
+    return " - ".join(part.replace("_", " ") for part in relative.split("/") if part)
+
+class CrawlFrontier:
+    """
+    The set of pages the crawler has claimed, and the politeness rules for fetching them:
+    at most max_concurrent_fetches requests in flight overall, at most per_host_concurrency
+    per host, and consecutive requests to one host started at least host_delay seconds apart.
+    Pages go through the shared HttpFetcher, so its HTML cache is warm when chapters are scraped.
+    """
+
+    def __init__(self, fetcher: HttpFetcher = None, max_concurrent_fetches: int = CRAWL_MAX_CONCURRENT_FETCHES,
+                 per_host_concurrency: int = CRAWL_PER_HOST_CONCURRENCY, host_delay: float = CRAWL_HOST_DELAY_SECONDS):
+        self.fetcher = fetcher
+        self.per_host_concurrency = per_host_concurrency
+        self.host_delay = host_delay
+        self.fetched = 0
+        self._seen = set()
+        self._fetch_slots = asyncio.Semaphore(max_concurrent_fetches)
+        self._hosts: Dict[str, Dict] = {} # host -> {"slots", "lock", "next_start"}
+
+    def claim(self, url: str) -> bool:
+        """
+        Marks a URL as discovered. Returns False if it already was.
+        """
+        if url in self._seen:
+            return False
+        self._seen.add(url)
+        return True
+
+    async def _wait_for_host(self, host_state: Dict):
+        loop = asyncio.get_running_loop()
+        async with host_state["lock"]:
+            delay = host_state["next_start"] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            host_state["next_start"] = loop.time() + self.host_delay
+
+    async def fetch(self, url: str) -> str | None:
+        """
+        Returns a page's HTML, or None if it couldn't be fetched.
+        """
+        if self.fetcher is None:
+            from scraper import get_http_fetcher
+            self.fetcher = get_http_fetcher()
+        host = urlparse(url).netloc
+        host_state = self._hosts.get(host)
+        if host_state is None:
+            host_state = self._hosts[host] = {
+                "slots": asyncio.Semaphore(self.per_host_concurrency), "lock": asyncio.Lock(), "next_start": 0.0
+            }
+        async with self._fetch_slots, host_state["slots"]:
+            await self._wait_for_host(host_state)
+            with span("crawl.fetch", url=url) as fetch_span:
+                result = await self.fetcher.fetch(url)
+                fetch_span["from_cache"] = bool(result and result["from_cache"])
+        self.fetched += 1
+        increment("crawl_pages_fetched")
+        return result["html"] if result else None
+
+async def _subpage_links(frontier: CrawlFrontier, url: str) -> List[str] | None:
+    html = await frontier.fetch(url)
+    if html is None:
+        return None
+    with span("crawl.parse", url=url):
+        return await asyncio.to_thread(extract_toc_links, html, url) # Parsing is CPU work; keep the loop free
+
+async def _follow_probe(frontier: CrawlFrontier, probe: asyncio.Future, url: str) -> List[str] | None:
+    # Fetches a page only if the first page of its shape group turned out to be a table of contents
+    # (or couldn't be fetched); otherwise it is a chapter like the probe
+    probe_links = await asyncio.shield(probe)
+    if probe_links is not None and not probe_links:
+        increment("crawl_fetches_skipped")
+        return None
+    return await _subpage_links(frontier, url)
+
+def _schedule_fetches(frontier: CrawlFrontier, children: List[str], links: List[str]) -> List[asyncio.Future]:
+    # One future per child resolving to its subpage links (None for a chapter)
+    link_paths = [urlparse(url).path for url in links]
+    probes: Dict[str, asyncio.Future] = {} # shape -> fetch of the group's first page
+    fetches = []
+    for url in children:
+        prefix = _subpage_prefix(url)
+        if any(path.startswith(prefix) for path in link_paths):
+            fetches.append(asyncio.ensure_future(_subpage_links(frontier, url))) # Known table of contents
+            continue
+        shape = _page_shape(url)
+        if shape not in probes:
+            probes[shape] = asyncio.ensure_future(_subpage_links(frontier, url))
+            fetches.append(probes[shape])
+        else:
+            fetches.append(asyncio.ensure_future(_follow_probe(frontier, probes[shape], url)))
+    return fetches
+
+async def _walk(frontier: CrawlFrontier, links: List[str], index_url: str, depth: int, max_depth: int) -> AsyncIterator[Tuple[str, str]]:
+    children = [url for url in links if frontier.claim(url)]
+    # Start every needed fetch up front (the frontier bounds how many run at once), but yield in order
+    fetches = _schedule_fetches(frontier, children, links) if depth < max_depth else [None] * len(children)
+    try:
+        for url, fetch in zip(children, fetches):
+            child_links = await fetch if fetch is not None else None
+            if child_links:
+                async for chapter in _walk(frontier, child_links, index_url, depth + 1, max_depth):
+                    yield chapter # A nested table of contents (e.g. "Book 1"), expanded in place
+            else:
+                increment("crawl_chapters_discovered")
+                yield url, chapter_name_from_url(url, index_url)
+    finally:
+        for fetch in fetches:
+            if fetch is not None:
+                fetch.cancel() # The consumer stopped early
+
+async def crawl_book(index_url: str, frontier: CrawlFrontier = None, max_depth: int = CRAWL_MAX_DEPTH) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Yields (chapter_url, chapter_name) for every chapter reachable from a book's index page,
+    in reading order. max_depth bounds how many levels of nested tables of contents are followed.
+    """
+    frontier = frontier or CrawlFrontier()
+    frontier.claim(index_url)
+    links = await _subpage_links(frontier, index_url)
+    if links is None:
+        print(f"Could not fetch the table of contents at {index_url}")
+        return
+    if not links:
+        print(f"No chapter links found on {index_url}")
+        return
+    async for chapter in _walk(frontier, links, index_url, 1, max_depth):
+        yield chapter
+
+# Example usage for testing this module independently (no network access needed)
+async def main_crawler_test():
+    import tempfile
+    from local_fixtures import generate_wikisource_book, start_fixture_server
+
+    with tempfile.TemporaryDirectory() as site_dir, tempfile.TemporaryDirectory() as cache_dir:
+        index_path, chapter_paths = generate_wikisource_book(site_dir, books=2, chapters_per_book=3)
+        server, base_url = start_fixture_server(site_dir)
+        try:
+            async with HttpFetcher(cache=HtmlCache(cache_dir)) as fetcher:
+                frontier = CrawlFrontier(fetcher, host_delay=0.05)
+                found = [url async for url, name in crawl_book(f"{base_url}/{index_path}", frontier=frontier)]
+                print(f"Discovered {len(found)} chapters with {frontier.fetched} fetches")
+                print(f"Reading order matches the book: {found == [f'{base_url}/{p}' for p in chapter_paths]}")
+        finally:
+            server.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main_crawler_test())
@@ -0,0 +1,147 @@
+# src/embedding_cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+import numpy as np
+from config import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_BATCH_SIZE
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache for one embedding model.
+    Vectors live in a memory-mapped float32 matrix (vectors.f32), one row per cached text,
+    and index.json maps each text's SHA-256 to its row in least-recently-used order.
+    When max_entries is set, the least recently used rows are evicted and reused.
+    """
+
+    _INITIAL_CAPACITY = 1024
+
+    def __init__(self, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir, model_name.replace("/", "_"))
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.max_entries = max_entries # None or 0 means unbounded
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._rows = OrderedDict() # text hash -> row, least recently used first
+        self._free_rows = []
+        self._dim = None
+        self._capacity = 0
+        self._vectors = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self._dim = index["dim"]
+        self._capacity = index["capacity"]
+        self._rows = OrderedDict((h, row) for h, row in index["rows"])
+        used = set(self._rows.values())
+        self._free_rows = [row for row in range(self._capacity) if row not in used]
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self._dim))
+
+    def _grow(self, min_capacity: int):
+        new_capacity = max(self._capacity * 2, self._INITIAL_CAPACITY, min_capacity)
+        if self.max_entries:
+            new_capacity = min(new_capacity, self.max_entries)
+        if new_capacity <= self._capacity:
+            return
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self._dim * 4) # float32 rows; new space reads as zeros
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self._dim))
+        self._free_rows.extend(range(self._capacity, new_capacity))
+        self._capacity = new_capacity
+
+    def _allocate_row(self) -> int:
+        if self.max_entries and len(self._rows) >= self.max_entries:
+            # At max_entries: evict the least recently used vector and reuse its row
+            _, row = self._rows.popitem(last=False)
+            return row
+        if not self._free_rows:
+            self._grow(len(self._rows) + 1)
+        return self._free_rows.pop()
+
+    def get_many(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns {hash: vector} for every hash present in the cache, marking them recently used.
+        """
+        found = {}
+        with self._lock:
+            for h in hashes:
+                row = self._rows.get(h)
+                if row is None:
+                    continue
+                self._rows.move_to_end(h)
+                found[h] = np.array(self._vectors[row]) # Copy out of the memmap
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]):
+        """
+        Stores {hash: vector} and persists the index.
+        """
+        if not vectors:
+            return
+        with self._lock:
+            if self._dim is None:
+                self._dim = len(next(iter(vectors.values())))
+            for h, vector in vectors.items():
+                row = self._rows.get(h)
+                if row is None:
+                    row = self._allocate_row()
+                self._vectors[row] = np.asarray(vector, dtype=np.float32)
+                self._rows[h] = row
+                self._rows.move_to_end(h)
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._vectors.flush()
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self._dim, "capacity": self._capacity, "rows": list(self._rows.items())}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def embed(self, texts: List[str], encode: Callable[[List[str]], List], batch_size: int = EMBEDDING_BATCH_SIZE) -> List[np.ndarray]:
+        """
+        Returns one embedding per text. Cached vectors are reused; the distinct texts that
+        miss are encoded with `encode` in micro-batches of batch_size, then cached.
+        batch_size=0 passes every miss to `encode` at once (for encoders that batch themselves).
+        """
+        hashes = [text_hash(t) for t in texts]
+        vectors = self.get_many(hashes)
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in vectors:
+                missing[h] = t # Deduplicates repeated texts within the call
+        self.hits += len(texts) - sum(1 for h in hashes if h in missing)
+        self.misses += len(missing)
+
+        if missing:
+            missing_hashes = list(missing.keys())
+            encoded = {}
+            step = batch_size or len(missing_hashes)
+            for start in range(0, len(missing_hashes), step):
+                batch_hashes = missing_hashes[start:start + step]
+                batch_vectors = encode([missing[h] for h in batch_hashes])
+                for h, vector in zip(batch_hashes, batch_vectors):
+                    encoded[h] = np.asarray(vector, dtype=np.float32)
+            self.put_many(encoded)
+            vectors.update(encoded)
+
+        return [vectors[h] for h in hashes]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._rows), "capacity": self._capacity, "hits": self.hits, "misses": self.misses}
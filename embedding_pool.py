@@ -0,0 +1,66 @@
+# src/embedding_pool.py
+import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import Callable, List
+from config import EMBEDDING_BATCH_SIZE
+
+# Embedding inference in worker processes, so encoding runs outside the store thread's GIL and
+# scales across cores. Each worker loads the model once (in its initializer) and then encodes
+# the batches it is sent. Workers are started with "spawn": the parent runs ChromaDB and other
+# threads, which a forked child must not inherit. This module is imported by every worker, so it
+# stays free of heavy imports.
+
+_worker_encode: Callable[[List[str]], List] = None
+
+def load_sentence_transformer(model_name: str) -> Callable[[List[str]], List]:
+    """
+    Default encoder factory: loads a sentence-transformers model and returns its encode function,
+    producing the same vectors as chromadb's SentenceTransformerEmbeddingFunction.
+    """
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name)
+    return lambda texts: model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=False)
+
+def _init_worker(model_name: str, encoder_factory: Callable, threads: int):
+    global _worker_encode
+    try:
+        import torch
+        torch.set_num_threads(threads) # Workers share the cores instead of each taking all of them
+    except ImportError:
+        pass
+    _worker_encode = encoder_factory(model_name)
+
+def _encode_batch(texts: List[str]):
+    return _worker_encode(texts)
+
+class EmbeddingProcessPool:
+    """
+    Callable like an embedding function (a list of texts -> a list of vectors): the texts are
+    split into batches of batch_size and encoded by the worker processes in parallel.
+    encoder_factory(model_name) runs once per worker and returns its encode function; it must be
+    importable by name (a module-level function), as workers are spawned fresh.
+    """
+
+    def __init__(self, model_name: str, workers: int, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 encoder_factory: Callable = load_sentence_transformer):
+        self.model_name = model_name
+        self.workers = workers
+        self.batch_size = batch_size
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, encoder_factory, threads),
+        )
+
+    def __call__(self, texts: List[str]) -> List:
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        vectors = []
+        for batch_vectors in self._executor.map(_encode_batch, batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,81 @@
+# src/extractors.py
+import functools
+from urllib.parse import urlparse
+from typing import Dict, Any, Callable
+from config import EXTRACTION_ENGINE, EXTRACTION_PARSER, DEFAULT_EXTRACTION_RULE, EXTRACTION_RULES
+
+# Pluggable chapter-text extraction. Each engine takes (html, rule) and returns the
+# extracted text; engines are registered in EXTRACTION_ENGINES and selected by name.
+
+# bs4 and lxml are imported inside the engines so that importing this module (and the
+# scraper) stays cheap for runs that never parse HTML.
+
+@functools.lru_cache(maxsize=None)
+def resolve_parser(preferred: str = EXTRACTION_PARSER) -> str:
+    """
+    Returns the preferred BeautifulSoup parser if its backend is installed, else 'html.parser'.
+    """
+    if preferred == "lxml":
+        try:
+            import lxml # noqa: F401
+        except ImportError:
+            return "html.parser"
+    return preferred
+
+def get_extraction_rule(url: str = None) -> Dict[str, Any]:
+    """
+    Returns the extraction rule for a URL's host, or DEFAULT_EXTRACTION_RULE if none matches.
+    """
+    host = (urlparse(url).hostname or "") if url else ""
+    for domain, rule in EXTRACTION_RULES.items():
+        if host == domain or host.endswith("." + domain):
+            return rule
+    return DEFAULT_EXTRACTION_RULE
+
+def extract_text_legacy(html: str, rule: Dict[str, Any] = DEFAULT_EXTRACTION_RULE) -> str:
+    """
+    Original extractor: builds a tree of the whole document with html.parser,
+    then locates the content container and strips unwanted tags from it.
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    content_div = soup.find(rule["container_tag"], attrs=rule["container_attrs"])
+    if content_div:
+        for unwanted_tag in content_div.select(", ".join(rule["strip_selectors"])):
+            unwanted_tag.extract() # Remove these elements from the parsed content
+        return content_div.get_text(separator='\n', strip=True)
+
+    # Fallback to getting all visible text if specific div not found
+    print(f"Warning: Content container {rule['container_attrs']} not found. Extracted all visible text.")
+    return soup.get_text(separator='\n', strip=True)
+
+def extract_text_strained(html: str, rule: Dict[str, Any] = DEFAULT_EXTRACTION_RULE) -> str:
+    """
+    Narrow extractor: a SoupStrainer restricts parsing to the content container, so the
+    rest of the page (head, navigation, footer, scripts) never becomes a tree. Unwanted
+    tags are stripped with a single combined selector and decomposed to free them at once.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+    strainer = SoupStrainer(rule["container_tag"], attrs=rule["container_attrs"])
+    soup = BeautifulSoup(html, resolve_parser(), parse_only=strainer)
+    content_div = soup.find(rule["container_tag"], attrs=rule["container_attrs"])
+    if content_div is None:
+        # The container isn't on this page; fall back to the whole-document extractor
+        return extract_text_legacy(html, rule)
+
+    for unwanted_tag in content_div.select(", ".join(rule["strip_selectors"])):
+        if not unwanted_tag.decomposed: # Already destroyed along with a matched ancestor
+            unwanted_tag.decompose()
+    return content_div.get_text(separator='\n', strip=True)
+
+EXTRACTION_ENGINES: Dict[str, Callable[[str, Dict[str, Any]], str]] = {
+    "legacy": extract_text_legacy,
+    "strained": extract_text_strained,
+}
+
+def extract_text(html: str, url: str = None, engine: str = EXTRACTION_ENGINE) -> str:
+    """
+    Extracts the chapter text from a page's HTML using the site rule for `url`
+    and the named extraction engine.
+    """
+    return EXTRACTION_ENGINES[engine](html, get_extraction_rule(url))
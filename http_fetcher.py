@@ -0,0 +1,163 @@
+# src/http_fetcher.py
+import asyncio
+import hashlib
+import json
+import os
+from typing import Dict, Any
+from config import HTML_CACHE_DIR, HTTP_MAX_CONNECTIONS, HTTP_TIMEOUT_SECONDS, HTTP_USER_AGENT
+
+class HtmlCache:
+    """
+    Content-addressed on-disk cache for raw HTML.
+    - objects/<sha256>.html holds each distinct page body exactly once.
+    - objects/<sha256>.txt holds the text extracted from that body, so an unchanged page is never re-parsed.
+    - index.json maps each URL to its current content hash plus the ETag/Last-Modified validators.
+    """
+
+    def __init__(self, cache_dir: str = HTML_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self):
+        # Write to a temp file and swap it in, so a crash never leaves a truncated index
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _object_path(self, content_hash: str, suffix: str) -> str:
+        return os.path.join(self.objects_dir, f"{content_hash}.{suffix}")
+
+    def lookup(self, url: str) -> Dict[str, Any] | None:
+        """
+        Returns the index entry for a URL ({"content_hash", "etag", "last_modified"}),
+        or None if the URL was never cached or its HTML object has gone missing.
+        """
+        entry = self._index.get(url)
+        if entry and os.path.exists(self._object_path(entry["content_hash"], "html")):
+            return entry
+        return None
+
+    def store(self, url: str, html: str, etag: str = None, last_modified: str = None) -> str:
+        """
+        Stores an HTML body (once per distinct content) and points the URL at it.
+        Returns the content hash.
+        """
+        content_hash = hashlib.sha256(html.encode("utf-8")).hexdigest()
+        html_path = self._object_path(content_hash, "html")
+        if not os.path.exists(html_path):
+            with open(html_path, "w", encoding="utf-8") as f:
+                f.write(html)
+        self._index[url] = {"content_hash": content_hash, "etag": etag, "last_modified": last_modified}
+        self._save_index()
+        return content_hash
+
+    def read_html(self, content_hash: str) -> str:
+        with open(self._object_path(content_hash, "html"), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def read_text(self, content_hash: str) -> str | None:
+        """
+        Returns previously extracted text for a content hash, or None if it was never extracted.
+        """
+        try:
+            with open(self._object_path(content_hash, "txt"), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_text(self, content_hash: str, text: str):
+        with open(self._object_path(content_hash, "txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+
+class HttpFetcher:
+    """
+    Fetches static pages over HTTP with a pooled, keep-alive connection client.
+    Cached pages are revalidated with If-None-Match / If-Modified-Since, so an
+    unchanged page costs a single 304 round trip and no body download.
+    """
+
+    def __init__(self, cache: HtmlCache = None, max_connections: int = HTTP_MAX_CONNECTIONS, timeout: float = HTTP_TIMEOUT_SECONDS):
+        import httpx # Deferred so importing the scraper doesn't pay for the HTTP stack
+        self.cache = cache if cache is not None else HtmlCache()
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+            headers={"User-Agent": HTTP_USER_AGENT},
+            follow_redirects=True,
+        )
+
+    async def fetch(self, url: str) -> Dict[str, Any] | None:
+        """
+        Returns {"html", "content_hash", "from_cache"} for a URL, or None if the fetch fails.
+        "from_cache" is True when the server confirmed the cached copy is still current.
+        """
+        import httpx
+        cached = self.cache.lookup(url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        try:
+            response = await self._client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            print(f"HTTP error fetching {url}: {e}")
+            return None
+
+        if response.status_code == 304 and cached:
+            print(f"Not modified since last fetch, using cached HTML: {url}")
+            return {"html": self.cache.read_html(cached["content_hash"]), "content_hash": cached["content_hash"], "from_cache": True}
+
+        if response.status_code != 200:
+            print(f"Unexpected HTTP status {response.status_code} fetching {url}")
+            return None
+
+        html = response.text
+        content_hash = self.cache.store(url, html, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+        # The server may not support validators but still return identical bytes
+        from_cache = bool(cached) and cached["content_hash"] == content_hash
+        return {"html": html, "content_hash": content_hash, "from_cache": from_cache}
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+# Example usage for testing this module independently (no network access needed)
+async def main_http_fetch_test():
+    import tempfile
+    from local_fixtures import generate_wikisource_fixtures, start_fixture_server
+
+    with tempfile.TemporaryDirectory() as site_dir, tempfile.TemporaryDirectory() as cache_dir:
+        generate_wikisource_fixtures(site_dir, 3)
+        server, base_url = start_fixture_server(site_dir)
+        try:
+            async with HttpFetcher(cache=HtmlCache(cache_dir)) as fetcher:
+                url = f"{base_url}/chapter_1.html"
+                first = await fetcher.fetch(url)
+                second = await fetcher.fetch(url)
+                print(f"First fetch from cache: {first['from_cache']} (expected False)")
+                print(f"Second fetch from cache: {second['from_cache']} (expected True)")
+                print(f"Same content hash: {first['content_hash'] == second['content_hash']}")
+        finally:
+            server.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main_http_fetch_test())
@@ -1,17 +1,60 @@
 # src/human_interface.py
-from typing import Dict, Any
+import sys
+from typing import Dict, Any, AsyncIterator, Callable
 
-def get_human_feedback(chapter_name: str, current_content: str, phase: str) -> str:
+# The blocking prompts below are the terminal frontend of the review queue (review_queue.py).
+# Workflows call the async request_* functions, which publish a review task and await its
+# answer without blocking the event loop. The prompts read lines with read_line (input() by
+# default); the review queue passes its own terminal reader.
+
+async def request_human_feedback(chapter_name: str, current_content: str, phase: str) -> str:
+    from review_queue import get_review_queue
+    return await get_review_queue().request("feedback", chapter_name, phase, content=current_content)
+
+async def request_human_decision(chapter_name: str, prompt_message: str, options: list) -> str:
+    from review_queue import get_review_queue
+    return await get_review_queue().request("decision", chapter_name, prompt_message, options=options)
+
+async def request_human_edits(chapter_name: str, original_content: str) -> str:
+    from review_queue import get_review_queue
+    return await get_review_queue().request("edit", chapter_name, "Apply edits", content=original_content)
+
+async def stream_for_review(chapter_name: str, chunks: AsyncIterator[str], phase: str, preview_chars: int = 500) -> str:
+    """
+    Displays streamed content as it arrives, so the reviewer can start reading the first
+    paragraphs while the rest is still being generated. Up to preview_chars characters are
+    echoed live; after that only progress is shown. Returns the full content.
+    """
+    print(f"\n--- Live Preview: {phase} for {chapter_name} ---")
+    received = []
+    shown = 0
+    async for chunk in chunks:
+        received.append(chunk)
+        if shown < preview_chars:
+            sys.stdout.write(chunk[:preview_chars - shown])
+            sys.stdout.flush()
+            shown += len(chunk)
+            if shown >= preview_chars:
+                sys.stdout.write("...\n(still generating)")
+                sys.stdout.flush()
+        else:
+            sys.stdout.write(".") # One dot per further chunk
+            sys.stdout.flush()
+    content = "".join(received)
+    print(f"\n--- Stream complete: {len(content)} characters ---")
+    return content
+
+def get_human_feedback(chapter_name: str, current_content: str, phase: str, read_line: Callable[[str], str] = input) -> str:
     """
     Prompts the human for feedback on the chapter content at a specific phase.
     """
     print(f"\n--- Human-in-the-Loop: {phase} for {chapter_name} ---")
     print(f"Current Content Preview (first 500 characters):\n{current_content[:500]}...")
     print("\nPlease review the content above carefully.")
-    feedback = input("Enter your feedback/edits (or type 'approve' to proceed, 'finalize' to publish, 'stop' to halt workflow): ")
+    feedback = read_line("Enter your feedback/edits (or type 'approve' to proceed, 'finalize' to publish, 'stop' to halt workflow): ")
     return feedback
 
-def get_human_decision(prompt_message: str, options: list) -> str:
+def get_human_decision(prompt_message: str, options: list, read_line: Callable[[str], str] = input) -> str:
     """
     Asks the human to make a decision from a list of numbered options.
     """
@@ -19,7 +62,7 @@ def get_human_decision(prompt_message: str, options: list) -> str:
     for i, option in enumerate(options):
         print(f"{i+1}. {option}")
     while True:
-        choice = input(f"Enter your choice (1-{len(options)}): ")
+        choice = read_line(f"Enter your choice (1-{len(options)}): ")
         try:
             choice_idx = int(choice) - 1
             if 0 <= choice_idx < len(options):
@@ -29,7 +72,7 @@ def get_human_decision(prompt_message: str, options: list) -> str:
         except ValueError:
             print("Invalid input. Please enter a number.")
 
-def apply_human_edits(original_content: str) -> str:
+def apply_human_edits(original_content: str, read_line: Callable[[str], str] = input) -> str:
     """
     Allows the human to directly edit the content in the terminal.
     Instructions are provided for multi-line input.
@@ -44,7 +87,7 @@ def apply_human_edits(original_content: str) -> str:
     edited_content_lines = []
     try:
         while True:
-            line = input()
+            line = read_line("")
             edited_content_lines.append(line)
     except EOFError: # Raised when Ctrl+D or Ctrl+Z is pressed (end of file)
         pass
@@ -0,0 +1,400 @@
+# src/llm_backend.py
+import asyncio
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, AsyncIterator
+from tracing import increment
+from config import (
+    LLM_BACKEND,
+    LLM_BASE_URL,
+    LLM_API_KEY,
+    LLM_MODEL,
+    LLM_TEMPERATURE,
+    LLM_MAX_CONCURRENCY,
+    LLM_RATE_LIMIT_PER_SECOND,
+    LLM_RATE_LIMIT_BURST,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE_SECONDS,
+    LLM_BACKOFF_MAX_SECONDS,
+    LLM_TIMEOUT_SECONDS,
+    SIMULATED_LLM_LATENCY,
+    LLM_CACHE_MODE,
+)
+
+# Pluggable LLM backends for ai_processor.
+# ai_processor builds the chat messages for each operation ("spin" or "review") and calls
+# backend.generate(operation, messages, context), or backend.stream(...) to receive the
+# output in chunks as it is produced; `context` carries the raw inputs (chapter_text,
+# original_text, spun_text, iteration) for backends that don't need a prompt.
+# Review operations must return a JSON object as text.
+# get_llm_backend() wraps the configured backend in a CachingBackend (see LLM_CACHE_MODE).
+
+class LLMBackend:
+    """
+    Base class for LLM backends.
+    """
+    model = "unknown"
+
+    async def generate(self, operation: str, messages: List[Dict[str, str]], context: Dict[str, Any]) -> str:
+        chunks = []
+        async for chunk in self.stream(operation, messages, context):
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    async def stream(self, operation: str, messages: List[Dict[str, str]], context: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Yields the output in chunks as it is produced. Backends without streaming support
+        can rely on this default, which yields the whole generate() result at once.
+        """
+        yield await self.generate(operation, messages, context)
+
+    def cache_params(self) -> Dict[str, Any]:
+        """
+        Generation parameters that change the output, included in response cache keys.
+        """
+        return {}
+
+    async def close(self):
+        pass
+
+class SimulatedBackend(LLMBackend):
+    """
+    No LLM at all: deterministic output derived from the inputs after a fixed delay.
+    """
+    model = "simulated"
+
+    def __init__(self, latency: float = SIMULATED_LLM_LATENCY):
+        self.latency = latency
+
+    async def stream(self, operation: str, messages: List[Dict[str, str]], context: Dict[str, Any]) -> AsyncIterator[str]:
+        # The total latency is spread over the chunks, so the first paragraph arrives early
+        iteration = context.get("iteration", 1)
+        if operation == "spin":
+            print(f"SIMULATED AI Writer: Spinning chapter (Iteration {iteration})...")
+            spun_text = f"[[SIMULATED AI Spun Version - Iteration {iteration}]]\n" \
+                        f"A creatively rephrased passage based on the original content follows:\n\n" \
+                        f"{context['chapter_text']}\n\n" \
+                        f"[[End of SIMULATED AI Spun Version]]"
+            chunks = re.split(r"(?<=\n\n)", spun_text) # Paragraph-sized chunks, separators kept
+            for chunk in chunks:
+                await asyncio.sleep(self.latency / len(chunks)) # Simulate processing time
+                yield chunk
+            print("SIMULATED AI Writer: Chapter spun successfully.")
+            return
+
+        if operation == "review":
+            print(f"SIMULATED AI Reviewer: Reviewing spun chapter (Iteration {iteration})...")
+            review_data = simulated_review(context["spun_text"], iteration)
+            await asyncio.sleep(self.latency) # Simulate processing time
+            yield json.dumps(review_data)
+            print("SIMULATED AI Reviewer: Chapter reviewed successfully.")
+            return
+
+        raise ValueError(f"Unknown LLM operation: {operation}")
+
+def simulated_review(spun_text: str, iteration: int) -> Dict[str, Any]:
+    """
+    Generic feedback and scores that mimic a review.
+    The 'simulated_review' flag indicates this is not a real LLM output.
+    """
+    # Simulate different review outcomes for varied testing
+    if "creatively rephrased passage" in spun_text.lower():
+        fidelity_score = 7 + (iteration % 3)
+        readability_score = 8 + (iteration % 2)
+        grammar_score = 9
+        originality_score = 7 + (iteration % 3)
+        feedback = "SIMULATED FEEDBACK: The spun content shows good creative effort and largely retains the core message. Some areas could be more concise."
+        suggestions = "SIMULATED SUGGESTIONS: Consider condensing overly verbose sentences. Ensure all original nuances are preserved."
+    else:
+        fidelity_score = 5
+        readability_score = 6
+        grammar_score = 7
+        originality_score = 4
+        feedback = "SIMULATED FEEDBACK: The spun content deviates slightly from the original or lacks sufficient 'spin'. Basic errors might be present."
+        suggestions = "SIMULATED SUGGESTIONS: Reread the original carefully. Focus on rephrasing more actively and creatively."
+
+    return {
+        "fidelity_score": fidelity_score,
+        "readability_score": readability_score,
+        "grammar_score": grammar_score,
+        "originality_score": originality_score,
+        "feedback": feedback,
+        "suggestions": suggestions,
+        "simulated_review": True # This flag indicates it's a simulated review
+    }
+
+class TokenBucket:
+    """
+    Async token bucket: acquire() waits until a token is available.
+    Tokens refill continuously at `rate` per second up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock: # Waiters are served in order
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class LLMRequestError(Exception):
+    """
+    Raised when an LLM request fails permanently (non-retryable status or retries exhausted).
+    """
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Client for any OpenAI-compatible /chat/completions endpoint.
+    - One pooled keep-alive HTTP client shared by every call.
+    - A global concurrency limit and a token-bucket rate limit.
+    - Retries on 429, 5xx and timeouts with jittered exponential backoff (honouring Retry-After).
+    - A per-request timeout.
+    """
+
+    _RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        base_url: str = LLM_BASE_URL,
+        api_key: str = LLM_API_KEY,
+        model: str = LLM_MODEL,
+        temperature: float = LLM_TEMPERATURE,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        rate_limit_per_second: float = LLM_RATE_LIMIT_PER_SECOND,
+        rate_limit_burst: int = LLM_RATE_LIMIT_BURST,
+        max_retries: int = LLM_MAX_RETRIES,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+    ):
+        import httpx # Deferred so the simulated backend never pays for it
+        self.model = model
+        self.temperature = temperature
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(rate_limit_per_second, rate_limit_burst)
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        self._client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers=headers,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+    def _backoff_delay(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), LLM_BACKOFF_MAX_SECONDS)
+            except ValueError:
+                pass # HTTP-date form; fall back to our own backoff
+        # "Full jitter": spreads retries out so concurrent chapters don't retry in lockstep
+        return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+    def _check_response(self, status_code: int, text: str, headers) -> tuple:
+        """
+        Classifies a non-200 response. Raises LLMRequestError if it isn't retryable,
+        otherwise returns (error message, Retry-After header value).
+        """
+        error = f"HTTP {status_code}: {text[:200]}"
+        if status_code == 429:
+            self.stats["rate_limited"] += 1
+        if status_code not in self._RETRYABLE_STATUSES:
+            self.stats["failures"] += 1
+            raise LLMRequestError(error)
+        return error, headers.get("Retry-After")
+
+    async def _post_chat(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        import httpx
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            retry_after = None
+            async with self._semaphore:
+                self.stats["requests"] += 1
+                try:
+                    response = await self._client.post("/chat/completions", json=payload)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    error = f"{type(e).__name__}: {e}"
+                else:
+                    if response.status_code == 200:
+                        return response.json()
+                    error, retry_after = self._check_response(response.status_code, response.text, response.headers)
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._backoff_delay(attempt, retry_after)) # Sleep without holding a slot
+        self.stats["failures"] += 1
+        raise LLMRequestError(f"LLM request failed after {self.max_retries + 1} attempts: {error}")
+
+    def cache_params(self) -> Dict[str, Any]:
+        return {"temperature": self.temperature}
+
+    def _payload(self, operation: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        payload = {"model": self.model, "messages": messages, "temperature": self.temperature}
+        if operation == "review":
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    async def generate(self, operation: str, messages: List[Dict[str, str]], context: Dict[str, Any]) -> str:
+        data = await self._post_chat(self._payload(operation, messages))
+        return data["choices"][0]["message"]["content"]
+
+    async def stream(self, operation: str, messages: List[Dict[str, str]], context: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Streams the completion as server-sent events. Failures before the first chunk are
+        retried like generate(); once output has been yielded, a failure is raised instead,
+        since a retry would repeat text the caller has already consumed.
+        """
+        import httpx
+        payload = {**self._payload(operation, messages), "stream": True}
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            retry_after = None
+            yielded = False
+            async with self._semaphore:
+                self.stats["requests"] += 1
+                try:
+                    async with self._client.stream("POST", "/chat/completions", json=payload) as response:
+                        if response.status_code == 200:
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    break
+                                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                                if delta:
+                                    yielded = True
+                                    yield delta
+                            return
+                        body = (await response.aread()).decode("utf-8", errors="replace")
+                        error, retry_after = self._check_response(response.status_code, body, response.headers)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    if yielded:
+                        self.stats["failures"] += 1
+                        raise LLMRequestError(f"LLM stream interrupted: {type(e).__name__}: {e}") from e
+                    error = f"{type(e).__name__}: {e}"
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+        self.stats["failures"] += 1
+        raise LLMRequestError(f"LLM request failed after {self.max_retries + 1} attempts: {error}")
+
+    async def close(self):
+        await self._client.aclose()
+
+class LLMCacheMiss(LLMRequestError):
+    """
+    Raised in replay-only cache mode when a call has no cached response.
+    """
+
+class CachingBackend(LLMBackend):
+    """
+    Serves repeated calls from an LLMResponseCache, keyed on the operation, the wrapped
+    backend's model, the prompt messages, the iteration and its generation parameters.
+    In replay mode the wrapped backend is never called and a miss raises LLMCacheMiss.
+    Cache reads and writes block on SQLite, so they run on a dedicated thread, never on the loop.
+    """
+
+    def __init__(self, backend: LLMBackend, cache=None, replay_only: bool = False):
+        from llm_cache import LLMResponseCache
+        self.backend = backend
+        self.model = backend.model
+        self.cache = cache if cache is not None else LLMResponseCache()
+        self.replay_only = replay_only
+        self._cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache") # One thread keeps SQLite access serialized
+
+    async def _in_cache_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._cache_executor, fn, *args)
+
+    def _key(self, operation: str, messages: List[Dict[str, str]], context: Dict[str, Any]) -> str:
+        from llm_cache import llm_cache_key
+        return llm_cache_key(operation, self.model, messages, context.get("iteration", 1), self.backend.cache_params())
+
+    async def _lookup(self, key: str, operation: str) -> str | None:
+        cached = await self._in_cache_thread(self.cache.get, key)
+        increment("llm_cache_lookups", operation=operation, result="miss" if cached is None else "hit")
+        if cached is None and self.replay_only:
+            raise LLMCacheMiss(f"No cached {operation} response (replay-only mode), key {key[:12]}")
+        return cached
+
+    async def generate(self, operation: str, messages: List[Dict[str, str]], context: Dict[str, Any]) -> str:
+        key = self._key(operation, messages, context)
+        cached = await self._lookup(key, operation)
+        if cached is not None:
+            return cached
+        response = await self.backend.generate(operation, messages, context)
+        await self._in_cache_thread(self.cache.put, key, operation, self.model, response)
+        return response
+
+    async def stream(self, operation: str, messages: List[Dict[str, str]], context: Dict[str, Any]) -> AsyncIterator[str]:
+        key = self._key(operation, messages, context)
+        cached = await self._lookup(key, operation)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        async for chunk in self.backend.stream(operation, messages, context):
+            chunks.append(chunk)
+            yield chunk
+        await self._in_cache_thread(self.cache.put, key, operation, self.model, "".join(chunks)) # Only complete responses are cached
+
+    async def close(self):
+        stats = await self._in_cache_thread(self.cache.stats)
+        if stats["hits"] or stats["misses"]:
+            print(f"LLM response cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+        await self._in_cache_thread(self.cache.close)
+        self._cache_executor.shutdown(wait=False)
+        await self.backend.close()
+
+_backend: LLMBackend = None
+_backend_loop = None
+
+def get_llm_backend() -> LLMBackend:
+    """
+    Returns the configured backend (LLM_BACKEND), created on first use and wrapped in a
+    CachingBackend unless LLM_CACHE_MODE is "off". HTTP-based backends are tied to the
+    event loop they were created on, so each asyncio.run() gets a fresh one.
+    """
+    global _backend, _backend_loop
+    loop = asyncio.get_running_loop()
+    if _backend is None or _backend_loop is not loop:
+        if LLM_CACHE_MODE not in ("readwrite", "replay", "off"):
+            raise ValueError(f"Unknown LLM_CACHE_MODE: {LLM_CACHE_MODE}")
+        if LLM_BACKEND == "openai":
+            _backend = OpenAICompatibleBackend()
+        elif LLM_BACKEND == "simulated":
+            _backend = SimulatedBackend()
+        else:
+            raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND}")
+        if LLM_CACHE_MODE != "off":
+            _backend = CachingBackend(_backend, replay_only=LLM_CACHE_MODE == "replay")
+        _backend_loop = loop
+    return _backend
+
+def set_llm_backend(backend: LLMBackend):
+    """
+    Installs a specific backend instance (e.g. one pointed at the mock server) for this event loop.
+    """
+    global _backend, _backend_loop
+    _backend = backend
+    _backend_loop = asyncio.get_running_loop()
+
+async def close_llm_backend():
+    global _backend, _backend_loop
+    if _backend is not None and _backend_loop is asyncio.get_running_loop():
+        await _backend.close()
+    _backend = None
+    _backend_loop = None
@@ -0,0 +1,108 @@
+# src/llm_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List
+from config import LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, ensure_dir
+
+_TOUCH_BATCH_SIZE = 64 # Hits whose last-used times are written together
+
+def llm_cache_key(operation: str, model: str, messages: List[Dict[str, str]], iteration: int, params: Dict[str, Any]) -> str:
+    """
+    SHA-256 of everything that determines a response: operation, model, the full prompt,
+    the iteration and the generation parameters (e.g. temperature).
+    """
+    payload = json.dumps(
+        {"operation": operation, "model": model, "messages": messages, "iteration": iteration, "params": params},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    """
+    Persistent LLM response cache in a single SQLite file.
+    Each row holds one response under its llm_cache_key, plus a last-used timestamp;
+    when max_entries is set, the least recently used responses are evicted.
+    A hit doesn't write: last-used times are collected and written in one statement with the
+    next put (before any eviction), every _TOUCH_BATCH_SIZE hits, or on close. The methods block
+    on SQLite, so async callers run them off the event loop (see llm_backend.CachingBackend).
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries # None or 0 means unbounded
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {} # key -> last-used time not yet written
+        ensure_dir(os.path.dirname(path) or ".")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # With WAL, commits don't fsync; a crash can lose only recent responses
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, operation TEXT, model TEXT, response TEXT,"
+            " created REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    def get(self, key: str) -> str | None:
+        """
+        Returns the cached response for a key (marking it recently used), or None.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= _TOUCH_BATCH_SIZE:
+                self._write_touches()
+                self._conn.commit()
+            return row[0]
+
+    def _write_touches(self):
+        # Caller holds the lock and commits
+        if self._touched:
+            self._conn.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                                   [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def put(self, key: str, operation: str, model: str, response: str):
+        with self._lock:
+            now = time.time()
+            self._write_touches() # So eviction sees every hit
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, operation, model, response, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, operation, model, response, now, now),
+            )
+            if self.max_entries:
+                # Keep only the max_entries most recently used responses
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._write_touches()
+            self._conn.commit()
+            self._conn.close()
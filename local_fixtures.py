@@ -0,0 +1,167 @@
+# src/local_fixtures.py
+import functools
+import http.server
+import os
+import random
+import threading
+from typing import List, Tuple
+
+# Offline stand-ins for Wikisource chapter pages, used by the benchmarks and the
+# module-level *_test functions so they can run without network access.
+
+_WORDS = (
+    "the gates of morning sea island canoe reef lagoon dick katafa sun wind palm shore "
+    "tide wave sail storm night star moon fire spear drum voice silence distance water"
+).split()
+
+_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<title>{title} - Wikisource, the free online library</title>
+<style>body {{ font-family: serif; }}</style>
+<script>var wgPageName = "{title}";</script>
+</head>
+<body>
+<div id="mw-navigation"><nav><ul><li><a href="/wiki/Main_Page">Main Page</a></li></ul></nav></div>
+<div id="content" class="mw-body">
+<h1 id="firstHeading">{title}</h1>
+<div id="bodyContent">
+<div id="mw-content-text" class="mw-body-content">
+<div class="mw-parser-output">
+<table class="headertemplate"><tr><td>{title}</td>{navigation}</tr></table>
+{paragraphs}
+<div class="printfooter">Retrieved from "https://en.wikisource.org/wiki/{title}"</div>
+</div>
+</div>
+</div>
+</div>
+<div id="footer"><ul><li>This page was last edited on 1 January 2024.</li></ul></div>
+<script>console.log("analytics");</script>
+</body>
+</html>
+"""
+
+def _make_paragraph(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(40, 120))]
+    words[0] = words[0].capitalize()
+    text = " ".join(words)
+    # Sprinkle in the kinds of inline noise the scraper strips out
+    return f"<p>{text}.<sup class=\"reference\">[{rng.randint(1, 9)}]</sup> <span class=\"pagenum\">{rng.randint(1, 300)}</span></p>"
+
+def _render_links(links: List[Tuple[str, str]]) -> str:
+    return "".join(f'<td><a href="{href}">{text}</a></td>' for href, text in links)
+
+def render_chapter_page(title: str, num_paragraphs: int = 40, seed: int = 0, navigation: List[Tuple[str, str]] = ()) -> str:
+    """
+    Renders a deterministic Wikisource-like chapter page (same title and seed -> same HTML).
+    `navigation` adds (href, text) links to the header, like Wikisource's previous/next links.
+    """
+    rng = random.Random(f"{title}-{seed}")
+    paragraphs = "\n".join(_make_paragraph(rng) for _ in range(num_paragraphs))
+    return _PAGE_TEMPLATE.format(title=title, paragraphs=paragraphs, navigation=_render_links(navigation))
+
+def render_contents_page(title: str, entries: List[Tuple[str, str]], navigation: List[Tuple[str, str]] = ()) -> str:
+    """
+    Renders a Wikisource-like table of contents listing (href, text) entries, plus the noise a
+    real index page has around them: an edit link, a link to the author and an external link.
+    """
+    items = "\n".join(f'<li><a href="{href}">{text}</a></li>' for href, text in entries)
+    body = (
+        f'<p><a href="/w/index.php?title={title}&amp;action=edit">edit</a> by <a href="/wiki/Author:Fixture_Author">Fixture Author</a></p>\n'
+        f'<ul>\n{items}\n</ul>\n'
+        f'<p>Also available from <a href="https://www.gutenberg.org/">Project Gutenberg</a>.</p>'
+    )
+    return _PAGE_TEMPLATE.format(title=title, paragraphs=body, navigation=_render_links(navigation))
+
+def generate_wikisource_fixtures(directory: str, count: int, num_paragraphs: int = 40) -> List[str]:
+    """
+    Writes `count` chapter pages into `directory` and returns their file paths in chapter order.
+    Existing files are overwritten so repeated runs produce identical fixtures.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(1, count + 1):
+        title = f"Fixture_Book/Chapter_{i}"
+        path = os.path.join(directory, f"chapter_{i}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render_chapter_page(title, num_paragraphs=num_paragraphs))
+        paths.append(path)
+    return paths
+
+def _write_page(directory: str, relative_path: str, html: str) -> str:
+    path = os.path.join(directory, *relative_path.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return path
+
+def generate_wikisource_book(directory: str, books: int = 2, chapters_per_book: int = 3, num_paragraphs: int = 40) -> Tuple[str, List[str]]:
+    """
+    Writes a Wikisource-like book into `directory`: an index page (Fixture_Book.html) listing
+    one contents page per book (Fixture_Book/Book_N.html), each listing its chapters
+    (Fixture_Book/Book_N/Chapter_M.html) with previous/next links between them.
+    Returns (index path, chapter paths in reading order), both relative to `directory` with "/".
+    """
+    chapters = [(b, c) for b in range(1, books + 1) for c in range(1, chapters_per_book + 1)]
+    chapter_paths = [f"Fixture_Book/Book_{b}/Chapter_{c}.html" for b, c in chapters]
+    for i, ((b, c), path) in enumerate(zip(chapters, chapter_paths)):
+        navigation = [("/Fixture_Book.html", "Contents")]
+        if i > 0:
+            navigation.append(("/" + chapter_paths[i - 1], "Previous"))
+        if i + 1 < len(chapter_paths):
+            navigation.append(("/" + chapter_paths[i + 1], "Next"))
+        title = f"Fixture_Book/Book_{b}/Chapter_{c}"
+        _write_page(directory, path, render_chapter_page(title, num_paragraphs=num_paragraphs, navigation=navigation))
+    for b in range(1, books + 1):
+        entries = [(f"Book_{b}/Chapter_{c}.html", f"Chapter {c}") for c in range(1, chapters_per_book + 1)]
+        _write_page(directory, f"Fixture_Book/Book_{b}.html", render_contents_page(f"Fixture_Book/Book_{b}", entries, [("/Fixture_Book.html", "Contents")]))
+    # Books are listed twice, as on many index pages (a summary line and the full contents)
+    entries = [(f"Fixture_Book/Book_{b}.html#top", f"Book {b}") for b in range(1, books + 1)]
+    entries += [(f"Fixture_Book/Book_{b}.html", f"Book {b}") for b in range(1, books + 1)]
+    _write_page(directory, "Fixture_Book.html", render_contents_page("Fixture_Book", entries))
+    return "Fixture_Book.html", chapter_paths
+
+class _FixtureRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Static file handler that behaves like a real wiki server for caching purposes:
+    it sends an ETag (derived from size and mtime) and answers If-None-Match with 304.
+    Last-Modified / If-Modified-Since are already handled by SimpleHTTPRequestHandler.
+    """
+
+    def _etag_for(self, path: str) -> str | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    def send_head(self):
+        etag = self._etag_for(self.translate_path(self.path))
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+        self._current_etag = etag
+        return super().send_head()
+
+    def end_headers(self):
+        etag = getattr(self, "_current_etag", None)
+        if etag:
+            self.send_header("ETag", etag)
+            self._current_etag = None
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark and test output readable
+
+def start_fixture_server(directory: str, port: int = 0) -> Tuple[http.server.ThreadingHTTPServer, str]:
+    """
+    Serves `directory` over HTTP on localhost in a background thread (port 0 picks a free port).
+    Returns (server, base_url); call server.shutdown() when done.
+    """
+    handler = functools.partial(_FixtureRequestHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
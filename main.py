@@ -1,186 +1,669 @@
 # src/main.py
+import argparse
 import asyncio
+import contextlib
+import csv
+import json
 import os
+import time
 import uuid
-from scraper import fetch_content_and_screenshot
-from ai_processor import ai_spin_chapter, ai_review_chapter # This will now be the SIMULATED version
-from version_manager import save_chapter_version, retrieve_consistent_content_rl_search, get_chapter_versions
-from human_interface import get_human_feedback, get_human_decision, apply_human_edits
-from config import RAW_CONTENT_DIR, PROCESSED_CHAPTERS_DIR, SCREENSHOTS_DIR # Imported for context, not directly used here
+from typing import AsyncIterable, Dict, List, Tuple, Any
+from scraper import fetch_content_and_screenshot, ScraperService, close_http_fetcher, configure_fetch_mode
+from screenshots import flush_screenshots
+from ai_processor import ai_spin_chapter_stream, ai_review_chapter # Backend (simulated by default) is chosen in config.py
+from ai_processor import SegmentMemo, ai_spin_chapter_incremental, ai_spin_chapter_incremental_stream, ai_review_chapter_incremental
+from ai_processor import ai_spin_chapter
+from speculation import SpeculativeIteration, print_speculation_summary
+from llm_backend import close_llm_backend
+from version_manager import save_chapter_version, retrieve_consistent_content_rl_search, get_chapter_versions, close_version_store, flush_pending_writes
+from version_manager import rebuild_best_version_index, reembed_collection, search_chapter_versions, search_passages, configure_embedding_workers
+from human_interface import request_human_feedback, request_human_decision, request_human_edits, stream_for_review
+from review_queue import close_review_queue
+from workflow_state import get_checkpoint_store, close_checkpoint_store, TERMINAL_STEPS
+from tracing import span, close_tracing
+from crawler import crawl_book, CrawlFrontier
+from publish import publish_book
+from version_retention import compact_version_store
+from config import PROCESSED_CHAPTERS_DIR
+from config import RAW_CONTENT_DIR, SCREENSHOTS_DIR # Imported for context, not directly used here
+from config import (
+    BATCH_MAX_CONCURRENT_CHAPTERS,
+    BATCH_SCRAPE_CONCURRENCY,
+    BATCH_AI_CONCURRENCY,
+    BATCH_SAVE_CONCURRENCY,
+    AI_INCREMENTAL_SEGMENTS,
+    SPECULATIVE_ITERATIONS,
+    CRAWL_MAX_CONCURRENT_FETCHES,
+    CRAWL_HOST_DELAY_SECONDS,
+    CRAWL_MAX_DEPTH,
+    RETENTION_KEEP_VERSION_TYPES,
+    RETENTION_KEEP_TOP_REVIEWED,
+    RETENTION_KEEP_LATEST,
+    EMBEDDING_WORKERS,
+    SCRAPER_FETCH_MODE,
+)
+
+def _stage(stage_limits: Dict[str, asyncio.Semaphore], stage: str):
+    """
+    Returns the concurrency limiter for a pipeline stage ("scrape", "ai" or "save").
+    When no limits are configured (single-chapter runs), a no-op context is returned.
+    """
+    if stage_limits and stage in stage_limits:
+        return stage_limits[stage]
+    return contextlib.nullcontext()
+
+async def _spin_and_review(
+    chapter_id: str,
+    content: str,
+    iteration: int,
+    segment_memo: SegmentMemo = None,
+    stage_limits: Dict[str, asyncio.Semaphore] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Spins `content` and reviews the result against it, without live display.
+    Used to run the next iteration speculatively while the human is still reviewing.
+    """
+    async with _stage(stage_limits, "ai"):
+        if segment_memo is not None:
+            spun = await ai_spin_chapter_incremental(content, iteration, segment_memo, output_name=f"{chapter_id}_spin_iter{iteration}")
+        else:
+            spun = await ai_spin_chapter(content, iteration, output_name=f"{chapter_id}_spin_iter{iteration}")
+    async with _stage(stage_limits, "ai"):
+        if segment_memo is not None:
+            review = await ai_review_chapter_incremental(content, spun, iteration, segment_memo, output_name=f"{chapter_id}_review_iter{iteration}")
+        else:
+            review = await ai_review_chapter(content, spun, iteration, output_name=f"{chapter_id}_review_iter{iteration}")
+    return spun, review
+
+def chapter_id_for(chapter_name: str) -> str:
+    """
+    Returns the URL-safe id a chapter's versions and checkpoints are stored under.
+    """
+    return chapter_name.replace(" ", "_").lower().replace("/", "_").replace(":", "")
 
 async def workflow_chapter_processing(
     chapter_url: str,
     chapter_name: str,
     max_ai_iterations: int = 3, # Maximum times AI will attempt to spin/review a chapter
-    max_human_sub_iterations: int = 2 # Maximum times human can provide feedback/edit within one AI iteration
-):
+    max_human_sub_iterations: int = 2, # Maximum times human can provide feedback/edit within one AI iteration
+    stage_limits: Dict[str, asyncio.Semaphore] = None, # Optional per-stage semaphores shared across chapters (batch mode)
+    scraper_service: ScraperService = None, # Optional shared browser pool; a browser is launched per call otherwise
+    speculative: bool = SPECULATIVE_ITERATIONS, # Pre-compute the next AI iteration while the human reviews
+    resume: bool = False # Continue from the chapter's last checkpoint instead of starting over
+) -> str:
     """
     Orchestrates the entire automated book publication workflow for a single chapter.
     This includes scraping, AI processing (simulated), human review, and version management.
+    The workflow runs as a state machine (see workflow_state.py) and checkpoints its state after
+    every step, so with resume=True it continues from the last completed step.
+    Returns the final workflow status: "finalized", "stopped", "auto_finished" or "scrape_failed".
     """
-    print(f"\n--- Starting Workflow for Chapter: {chapter_name} ---")
-
     # Create a unique, URL-safe ID for the chapter for ChromaDB storage
-    chapter_id = chapter_name.replace(" ", "_").lower().replace("/", "_").replace(":", "")
+    chapter_id = chapter_id_for(chapter_name)
 
-    # --- 1. Scraping & Screenshots ---
-    print("\n[STEP 1/5] Scraping content and taking screenshot...")
-    raw_content = await fetch_content_and_screenshot(chapter_url, chapter_name)
-    if not raw_content:
-        print(f"Failed to scrape content from {chapter_url}. Aborting workflow for this chapter.")
-        return
+    checkpoints = get_checkpoint_store()
+    state = checkpoints.load(chapter_id) if resume else None
+    if state is None:
+        print(f"\n--- Starting Workflow for Chapter: {chapter_name} ---")
+        state = {
+            "step": "scrape",
+            "iteration": 0,
+            "current_content": None, # The content being worked on
+            "previous_content_for_review": None, # What the AI reviewer will compare against
+            "spin_feedback": None, # Human feedback for the next spin (incremental mode)
+            "human_sub_iterations_count": 0,
+        }
+    else:
+        print(f"\n--- Resuming Workflow for Chapter: {chapter_name} at step '{state['step']}' (iteration {state['iteration']}) ---")
+    # Paragraph-level results, so only segments changed by edits or feedback go back to the AI
+    segment_memo = SegmentMemo() if AI_INCREMENTAL_SEGMENTS else None
+    speculation = None # Next iteration's spin + review, started while the human reviews (speculative mode)
+    speculated_review = None # Review that came with a committed speculative spin
+
+    def checkpoint(next_step: str):
+        from_step = state["step"]
+        state["step"] = next_step
+        checkpoints.save(chapter_id, chapter_name, chapter_url, state, from_step)
+
+    with span("workflow.chapter", chapter=chapter_id, resume=resume):
+        while state["step"] not in TERMINAL_STEPS:
+            step = state["step"]
+            iteration = state["iteration"]
+
+            with span(f"workflow.{step}", iteration=iteration):
+                if step == "scrape":
+                    # --- 1. Scraping & Screenshots ---
+                    print("\n[STEP 1/5] Scraping content and taking screenshot...")
+                    async with _stage(stage_limits, "scrape"):
+                        raw_content = await fetch_content_and_screenshot(chapter_url, chapter_name, scraper_service=scraper_service)
+                    if not raw_content:
+                        print(f"Failed to scrape content from {chapter_url}. Aborting workflow for this chapter.")
+                        checkpoint("scrape") # Stays unfinished, so `resume` retries it
+                        return "scrape_failed"
+
+                    # Save the initial raw version to ChromaDB
+                    initial_version_id = str(uuid.uuid4())
+                    async with _stage(stage_limits, "save"):
+                        await save_chapter_version(chapter_id, initial_version_id, raw_content, "raw", 0)
+                        await flush_pending_writes(chapter_id) # Stored before the checkpoint moves past it; resume won't save it again
+                    state["current_content"] = raw_content
+                    state["previous_content_for_review"] = raw_content
+                    checkpoint("spin")
+
+                elif step == "spin":
+                    iteration += 1
+                    print(f"\n--- Starting ITERATION {iteration} ---")
+
+                    speculated = None
+                    if speculation is not None:
+                        if speculation.matches(state["current_content"], iteration) and state["spin_feedback"] is None:
+                            speculated = await speculation.commit()
+                            segment_memo = speculation.state # The memo the speculative work updated
+                        else:
+                            await speculation.discard("content changed before the next iteration")
+                        speculation = None
+
+                    # --- 2. AI Writing (Spin) ---
+                    print(f"\n[STEP 2/5] AI Writer is spinning chapter (Iteration {iteration})...")
+                    if speculated:
+                        spun_content, speculated_review = speculated
+                        print(f"Spin for iteration {iteration} was computed speculatively during the last human review.")
+                    else:
+                        async with _stage(stage_limits, "ai"):
+                            # Streamed, so the first paragraphs are on screen while the rest is generated
+                            if segment_memo is not None:
+                                spin_stream = ai_spin_chapter_incremental_stream(state["current_content"], iteration, segment_memo,
+                                                                                 feedback=state["spin_feedback"],
+                                                                                 output_name=f"{chapter_id}_spin_iter{iteration}")
+                            else:
+                                spin_stream = ai_spin_chapter_stream(state["current_content"], iteration, output_name=f"{chapter_id}_spin_iter{iteration}")
+                            spun_content = await stream_for_review(chapter_name, spin_stream, f"Iteration {iteration} - AI Spin")
+                    spun_version_id = str(uuid.uuid4())
+                    async with _stage(stage_limits, "save"):
+                        await save_chapter_version(chapter_id, spun_version_id, spun_content, "spun", iteration)
+                        await flush_pending_writes(chapter_id)
+                    state["iteration"] = iteration
+                    state["spin_feedback"] = None
+                    state["current_content"] = spun_content # The AI's spun output becomes the new current content
+                    checkpoint("review")
+
+                elif step == "review":
+                    # --- 3. AI Review ---
+                    print(f"\n[STEP 3/5] AI Reviewer is analyzing spun chapter (Iteration {iteration})...")
+                    if speculated_review is not None:
+                        review_result, speculated_review = speculated_review, None
+                    else:
+                        async with _stage(stage_limits, "ai"):
+                            if segment_memo is not None:
+                                review_result = await ai_review_chapter_incremental(state["previous_content_for_review"], state["current_content"],
+                                                                                    iteration, segment_memo, output_name=f"{chapter_id}_review_iter{iteration}")
+                            else:
+                                review_result = await ai_review_chapter(state["previous_content_for_review"], state["current_content"], iteration,
+                                                                        output_name=f"{chapter_id}_review_iter{iteration}")
+                    reviewed_version_id = str(uuid.uuid4())
+                    # Store review results as metadata; useful for the conceptual "RL Search"
+                    async with _stage(stage_limits, "save"):
+                        await save_chapter_version(chapter_id, reviewed_version_id, state["current_content"], "reviewed", iteration, metadata=review_result)
+                        await flush_pending_writes(chapter_id)
+                    print(f"AI Review Feedback: {review_result.get('feedback', 'No feedback provided.')}")
+                    print(f"AI Review Suggestions: {review_result.get('suggestions', 'No suggestions provided.')}")
+                    state["human_sub_iterations_count"] = 0
+                    checkpoint("human_review")
+
+                elif step == "human_review":
+                    if speculative and iteration < max_ai_iterations and speculation is None:
+                        # Assume the human will approve: current_content is then both the next spin's input and
+                        # what its review compares against. Works on a fork of the memo in case it's discarded.
+                        speculative_memo = segment_memo.fork() if segment_memo is not None else None
+                        speculation = SpeculativeIteration(
+                            state["current_content"], iteration + 1,
+                            _spin_and_review(chapter_id, state["current_content"], iteration + 1, speculative_memo, stage_limits),
+                            state=speculative_memo,
+                        )
+
+                    # --- 4. Human-in-the-Loop ---
+                    print(f"\n[STEP 4/5] Human-in-the-Loop phase (Iteration {iteration})...")
+                    human_decision = "" # Stores the human's choice for the current iteration
+
+                    # Loop for human feedback/edits within the current AI iteration
+                    while state["human_sub_iterations_count"] < max_human_sub_iterations and human_decision not in ["approve", "finalize", "stop", "re_spin_by_ai"]:
+                        current_content = state["current_content"]
+                        # Awaited through the review queue, so other chapters keep working while this one waits
+                        human_feedback = await request_human_feedback(chapter_name, current_content, f"Iteration {iteration} - Human Review ({state['human_sub_iterations_count'] + 1})")
+
+                        # Check for direct human commands
+                        if human_feedback.lower() == 'approve':
+                            human_decision = "approve"
+                            print("Human approved the current version.")
+                            break # Exit inner human loop
+                        elif human_feedback.lower() == 'finalize':
+                            human_decision = "finalize"
+                            print("Human finalized the current version. Marking as final.")
+                            break # Exit inner human loop
+                        elif human_feedback.lower() == 'stop':
+                            human_decision = "stop"
+                            print("Human requested to stop the workflow.")
+                            break # Exit inner human loop
+                        else:
+                            # Human provided specific feedback; prompt for action
+                            decision_options = [
+                                "Edit content directly",
+                                "Send back to AI for re-spin (based on this feedback)",
+                                "Approve and proceed to next AI iteration",
+                                "Finalize and publish this version",
+                                "Stop workflow entirely"
+                            ]
+                            action_choice = await request_human_decision(chapter_name, "What action would you like to take?", decision_options)
+
+                            if action_choice == "Edit content directly":
+                                if speculation is not None:
+                                    await speculation.discard("human edited the content")
+                                    speculation = None
+                                if segment_memo is not None:
+                                    segment_memo.keep_unchanged(current_content) # Only edited segments get re-spun next time
+                                state["current_content"] = await request_human_edits(chapter_name, current_content)
+                                edited_version_id = str(uuid.uuid4())
+                                # Save human edits as a distinct version
+                                async with _stage(stage_limits, "save"):
+                                    await save_chapter_version(chapter_id, edited_version_id, state["current_content"], "human_edited", iteration)
+                                    await flush_pending_writes(chapter_id)
+                                print("Human edits applied. Please review the edited content.")
+                                checkpoint("human_review") # Keep the edit even if the workflow is interrupted now
+                                # After editing, loop back to allow human to review edited content or make another decision
+                                continue # Continue inner human loop to prompt for feedback again
+
+                            elif action_choice == "Send back to AI for re-spin (based on this feedback)":
+                                # This decision signals to restart the AI spin for the *current* iteration
+                                # We can prepend the human feedback to the content for the AI to "consider"
+                                if segment_memo is not None:
+                                    # The feedback goes into every segment's prompt rather than becoming a segment itself
+                                    state["spin_feedback"] = human_feedback
+                                    state["current_content"] = state["previous_content_for_review"]
+                                else:
+                                    state["current_content"] = f"HUMAN FEEDBACK TO CONSIDER FOR RE-SPIN: '{human_feedback}'\n\nOriginal content to re-spin:\n{state['previous_content_for_review']}"
+                                human_decision = "re_spin_by_ai"
+                                print("Preparing to send feedback back to AI for the next spin.")
+                                break # Break out of inner human loop to let main loop handle re-spinning
+
+                            elif action_choice == "Approve and proceed to next AI iteration":
+                                human_decision = "approve"
+                                print("Human approved the current version. Proceeding to next AI iteration.")
+                                break # Exit inner human loop
+
+                            elif action_choice == "Finalize and publish this version":
+                                human_decision = "finalize"
+                                print("Human finalized the current version. Marking as final.")
+                                break # Exit inner human loop
+
+                            elif action_choice == "Stop workflow entirely":
+                                human_decision = "stop"
+                                print("Human requested to stop the workflow.")
+                                break # Exit inner human loop
+
+                        state["human_sub_iterations_count"] += 1
+                        checkpoint("human_review")
+                        if state["human_sub_iterations_count"] >= max_human_sub_iterations and human_decision not in ["approve", "finalize", "stop", "re_spin_by_ai"]:
+                            print(f"Max human sub-iterations reached ({max_human_sub_iterations}) for this AI iteration. Auto-proceeding to next AI iteration or finalizing if no more AI iterations.")
+                            human_decision = "auto_proceed" # Indicates no explicit human action, just move on
+
+                    if speculation is not None and human_decision not in ("approve", "auto_proceed"):
+                        await speculation.discard(f"human chose '{human_decision}'")
+                        speculation = None
+
+                    # Handle decisions made in the human-in-the-loop phase
+                    if human_decision == "finalize":
+                        checkpoint("finalize")
+                    elif human_decision == "stop":
+                        print(f"Workflow stopped by human for chapter '{chapter_name}'.")
+                        await flush_pending_writes(chapter_id)
+                        checkpoint("stopped")
+                    else:
+                        if human_decision == "re_spin_by_ai":
+                            # Re-run the spin with the new 'current_content', keeping previous_content_for_review
+                            print("Re-spinning with AI based on human feedback...")
+                        else:
+                            # If human approved or auto_proceeded, prepare for the next full AI iteration
+                            # The content that was just approved/processed becomes the new "original" for the next AI review
+                            state["previous_content_for_review"] = state["current_content"]
+                        checkpoint("spin" if iteration < max_ai_iterations else "auto_finish")
+
+                elif step == "finalize":
+                    final_version_id = str(uuid.uuid4())
+                    async with _stage(stage_limits, "save"):
+                        await save_chapter_version(chapter_id, final_version_id, state["current_content"], "final", iteration)
+                        await flush_pending_writes(chapter_id) # Finished only once its versions are stored; raises otherwise
+                    print(f"Chapter '{chapter_name}' finalized and saved as final version.")
+                    checkpoint("finalized")
+
+                elif step == "auto_finish":
+                    # --- Workflow Completion / Finalization ---
+                    print(f"\nMax AI iterations ({max_ai_iterations}) reached for chapter {chapter_name}. Workflow ending without explicit finalization.")
+                    # If workflow completed all AI iterations without explicit human finalization, save the last state
+                    last_version_id = str(uuid.uuid4())
+                    async with _stage(stage_limits, "save"):
+                        await save_chapter_version(chapter_id, last_version_id, state["current_content"], "auto_finished", iteration)
+                        await flush_pending_writes(chapter_id)
+                    print("Last version saved as 'auto_finished'. Consider reviewing it manually for finalization.")
+                    checkpoint("auto_finished")
+
+                else:
+                    raise ValueError(f"Unknown workflow step: {step}")
+
+        if speculation is not None: # Every path to a terminal step resolves it already; never leave the task running
+            await speculation.discard("workflow ended")
+        workflow_status = state["step"]
+
+        # --- 5. Versioning & Consistency (Post-Workflow Retrieval Example) ---
+        print(f"\n[STEP 5/5] Attempting to retrieve consistent content for '{chapter_name}' using RL search (conceptual)...")
+        async with _stage(stage_limits, "save"):
+            with span("workflow.retrieve"):
+                final_retrieved_content = await retrieve_consistent_content_rl_search(chapter_id)
+        if final_retrieved_content:
+            print(f"\n--- Retrieved Final/Best Version for '{chapter_name}' ---")
+            print(f"Version ID: {final_retrieved_content['id']}")
+            print(f"Version Type: {final_retrieved_content['metadata'].get('version_type', 'N/A')}")
+            print(f"Iteration: {final_retrieved_content['metadata'].get('iteration', 'N/A')}")
+            print(f"Content Sample:\n{final_retrieved_content['content'][:500]}...") # Display first 500 characters
+        else:
+            print(f"Could not retrieve a consistent final version for '{chapter_name}'.")
 
-    # Save the initial raw version to ChromaDB
-    initial_version_id = str(uuid.uuid4())
-    await save_chapter_version(chapter_id, initial_version_id, raw_content, "raw", 0)
-    current_content = raw_content # The content being worked on
-    previous_content_for_review = raw_content # What the AI reviewer will compare against
-
-    iteration = 0
-    workflow_status = "ongoing" # Controls the main loop (AI iterations)
-
-    while workflow_status == "ongoing" and iteration < max_ai_iterations:
-        iteration += 1
-        print(f"\n--- Starting ITERATION {iteration} ---")
-
-        # --- 2. AI Writing (Spin) ---
-        print(f"\n[STEP 2/5] AI Writer is spinning chapter (Iteration {iteration})...")
-        spun_content = await ai_spin_chapter(current_content, iteration)
-        spun_version_id = str(uuid.uuid4())
-        await save_chapter_version(chapter_id, spun_version_id, spun_content, "spun", iteration)
-        current_content = spun_content # The AI's spun output becomes the new current content
-
-        # --- 3. AI Review ---
-        print(f"\n[STEP 3/5] AI Reviewer is analyzing spun chapter (Iteration {iteration})...")
-        review_result = await ai_review_chapter(previous_content_for_review, spun_content, iteration)
-        reviewed_version_id = str(uuid.uuid4())
-        # Store review results as metadata; useful for the conceptual "RL Search"
-        await save_chapter_version(chapter_id, reviewed_version_id, spun_content, "reviewed", iteration, metadata=review_result)
-        print(f"AI Review Feedback: {review_result.get('feedback', 'No feedback provided.')}")
-        print(f"AI Review Suggestions: {review_result.get('suggestions', 'No suggestions provided.')}")
-
-        # --- 4. Human-in-the-Loop ---
-        print(f"\n[STEP 4/5] Human-in-the-Loop phase (Iteration {iteration})...")
-        human_sub_iterations_count = 0
-        human_decision = "" # Stores the human's choice for the current iteration
-
-        # Loop for human feedback/edits within the current AI iteration
-        while human_sub_iterations_count < max_human_sub_iterations and human_decision not in ["approve", "finalize", "stop", "re_spin_by_ai"]:
-            human_feedback = get_human_feedback(chapter_name, current_content, f"Iteration {iteration} - Human Review ({human_sub_iterations_count + 1})")
-
-            # Check for direct human commands
-            if human_feedback.lower() == 'approve':
-                human_decision = "approve"
-                print("Human approved the current version.")
-                break # Exit inner human loop
-            elif human_feedback.lower() == 'finalize':
-                human_decision = "finalize"
-                print("Human finalized the current version. Marking as final.")
-                break # Exit inner human loop
-            elif human_feedback.lower() == 'stop':
-                human_decision = "stop"
-                workflow_status = "stopped" # Signals to exit main workflow loop
-                print("Human requested to stop the workflow.")
-                break # Exit inner human loop
+        print(f"\n--- Workflow for Chapter: {chapter_name} Completed ---")
+        return workflow_status
+
+def load_chapter_manifest(manifest_path: str) -> List[Tuple[str, str]]:
+    """
+    Loads a book manifest of (url, chapter_name) pairs.
+    Supported formats:
+    - JSON: a list of {"url": ..., "chapter_name": ...} objects or [url, chapter_name] pairs.
+    - CSV: two columns per row, url then chapter_name (a header row "url,chapter_name" is skipped).
+    """
+    manifest = []
+    if manifest_path.lower().endswith(".json"):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            if isinstance(entry, dict):
+                manifest.append((entry["url"], entry["chapter_name"]))
             else:
-                # Human provided specific feedback; prompt for action
-                decision_options = [
-                    "Edit content directly",
-                    "Send back to AI for re-spin (based on this feedback)",
-                    "Approve and proceed to next AI iteration",
-                    "Finalize and publish this version",
-                    "Stop workflow entirely"
-                ]
-                action_choice = get_human_decision("What action would you like to take?", decision_options)
-
-                if action_choice == "Edit content directly":
-                    current_content = apply_human_edits(current_content)
-                    edited_version_id = str(uuid.uuid4())
-                    # Save human edits as a distinct version
-                    await save_chapter_version(chapter_id, edited_version_id, current_content, "human_edited", iteration)
-                    print("Human edits applied. Please review the edited content.")
-                    # After editing, loop back to allow human to review edited content or make another decision
-                    continue # Continue inner human loop to prompt for feedback again
-
-                elif action_choice == "Send back to AI for re-spin (based on this feedback)":
-                    # This decision signals to restart the AI spin for the *current* iteration
-                    # We can prepend the human feedback to the content for the AI to "consider"
-                    current_content = f"HUMAN FEEDBACK TO CONSIDER FOR RE-SPIN: '{human_feedback}'\n\nOriginal content to re-spin:\n{previous_content_for_review}"
-                    human_decision = "re_spin_by_ai"
-                    print("Preparing to send feedback back to AI for the next spin.")
-                    break # Break out of inner human loop to let main loop handle re-spinning
-
-                elif action_choice == "Approve and proceed to next AI iteration":
-                    human_decision = "approve"
-                    print("Human approved the current version. Proceeding to next AI iteration.")
-                    break # Exit inner human loop
-
-                elif action_choice == "Finalize and publish this version":
-                    human_decision = "finalize"
-                    print("Human finalized the current version. Marking as final.")
-                    break # Exit inner human loop
-
-                elif action_choice == "Stop workflow entirely":
-                    human_decision = "stop"
-                    workflow_status = "stopped"
-                    print("Human requested to stop the workflow.")
-                    break # Exit inner human loop
-            
-            human_sub_iterations_count += 1
-            if human_sub_iterations_count >= max_human_sub_iterations and human_decision not in ["approve", "finalize", "stop", "re_spin_by_ai"]:
-                print(f"Max human sub-iterations reached ({max_human_sub_iterations}) for this AI iteration. Auto-proceeding to next AI iteration or finalizing if no more AI iterations.")
-                human_decision = "auto_proceed" # Indicates no explicit human action, just move on
-
-        # Handle decisions made in the human-in-the-loop phase
-        if human_decision == "finalize":
-            final_version_id = str(uuid.uuid4())
-            await save_chapter_version(chapter_id, final_version_id, current_content, "final", iteration)
-            print(f"Chapter '{chapter_name}' finalized and saved as final version.")
-            workflow_status = "finalized" # Signal to exit main loop
-            break # Exit main workflow loop
-
-        if workflow_status == "stopped":
-            print(f"Workflow stopped by human for chapter '{chapter_name}'.")
-            break # Exit main workflow loop
-
-        if human_decision == "re_spin_by_ai":
-            # This 'continue' will make the outer 'while workflow_status == "ongoing"' loop
-            # effectively re-run the current AI iteration (spinning with new 'current_content').
-            print("Re-spinning with AI based on human feedback...")
-            continue # Skip updating previous_content_for_review and go to next outer loop iteration
-
-        # If human approved or auto_proceeded, prepare for the next full AI iteration
-        # The content that was just approved/processed becomes the new "original" for the next AI review
-        previous_content_for_review = current_content 
-
-    # --- Workflow Completion / Finalization ---
-    if workflow_status == "ongoing":
-        print(f"\nMax AI iterations ({max_ai_iterations}) reached for chapter {chapter_name}. Workflow ending without explicit finalization.")
-        # If workflow completed all AI iterations without explicit human finalization, save the last state
-        last_version_id = str(uuid.uuid4())
-        await save_chapter_version(chapter_id, last_version_id, current_content, "auto_finished", iteration)
-        print("Last version saved as 'auto_finished'. Consider reviewing it manually for finalization.")
-
-    # --- 5. Versioning & Consistency (Post-Workflow Retrieval Example) ---
-    print(f"\n[STEP 5/5] Attempting to retrieve consistent content for '{chapter_name}' using RL search (conceptual)...")
-    final_retrieved_content = await retrieve_consistent_content_rl_search(chapter_id)
-    if final_retrieved_content:
-        print(f"\n--- Retrieved Final/Best Version for '{chapter_name}' ---")
-        print(f"Version ID: {final_retrieved_content['id']}")
-        print(f"Version Type: {final_retrieved_content['metadata'].get('version_type', 'N/A')}")
-        print(f"Iteration: {final_retrieved_content['metadata'].get('iteration', 'N/A')}")
-        print(f"Content Sample:\n{final_retrieved_content['content'][:500]}...") # Display first 500 characters
+                manifest.append((entry[0], entry[1]))
     else:
-        print(f"Could not retrieve a consistent final version for '{chapter_name}'.")
+        with open(manifest_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.reader(f):
+                if not row or row[0].strip().lower() == "url":
+                    continue # Skip blank lines and the header row
+                manifest.append((row[0].strip(), row[1].strip()))
+    return manifest
+
+async def process_book_batch(
+    manifest: List[Tuple[str, str]] | AsyncIterable[Tuple[str, str]],
+    max_concurrent_chapters: int = BATCH_MAX_CONCURRENT_CHAPTERS,
+    scrape_concurrency: int = BATCH_SCRAPE_CONCURRENCY,
+    ai_concurrency: int = BATCH_AI_CONCURRENCY,
+    save_concurrency: int = BATCH_SAVE_CONCURRENCY,
+    **workflow_kwargs
+) -> List[Dict[str, Any]]:
+    """
+    Runs workflow_chapter_processing for every (url, chapter_name) pair in the manifest concurrently.
+    A chapter-level semaphore bounds how many pipelines are in flight, and per-stage semaphores
+    (scrape, AI spin/review, version save) are shared across all chapters so no single stage
+    gets flooded. Chapters that need the browser share one pooled ScraperService sized to the
+    scrape limit; the browser is only launched if a chapter actually needs it.
+    A failure in one chapter never aborts the others.
+    The manifest may also be an async iterable (e.g. crawler.crawl_book), in which case each
+    chapter starts as soon as it is discovered rather than after the whole list is known.
+    Returns one status entry per chapter, in manifest order.
+    """
+    chapter_slots = asyncio.Semaphore(max_concurrent_chapters)
+    stage_limits = {
+        "scrape": asyncio.Semaphore(scrape_concurrency),
+        "ai": asyncio.Semaphore(ai_concurrency),
+        "save": asyncio.Semaphore(save_concurrency),
+    }
+
+    async def run_one(url: str, chapter_name: str) -> Dict[str, Any]:
+        async with chapter_slots:
+            started = time.perf_counter()
+            try:
+                status = await workflow_chapter_processing(
+                    url, chapter_name, stage_limits=stage_limits, scraper_service=scraper_service, **workflow_kwargs
+                )
+                error = None
+            except Exception as e:
+                status = "error"
+                error = str(e)
+                print(f"Error while processing chapter '{chapter_name}': {e}")
+            return {
+                "chapter_name": chapter_name,
+                "url": url,
+                "status": status,
+                "elapsed_seconds": round(time.perf_counter() - started, 2),
+                "error": error,
+            }
+
+    batch_started = time.perf_counter()
+    scraper_service = ScraperService(pool_size=scrape_concurrency)
+    try:
+        if isinstance(manifest, AsyncIterable):
+            chapters = []
+            async for url, name in manifest:
+                chapters.append(asyncio.ensure_future(run_one(url, name)))
+            summary = await asyncio.gather(*chapters)
+        else:
+            summary = await asyncio.gather(*(run_one(url, name) for url, name in manifest))
+    finally:
+        await scraper_service.close()
+    print_batch_summary(summary, time.perf_counter() - batch_started)
+    return summary
 
-    print(f"\n--- Workflow for Chapter: {chapter_name} Completed ---")
+def print_batch_summary(summary: List[Dict[str, Any]], total_seconds: float):
+    """
+    Prints a per-chapter status table for a finished batch run.
+    """
+    print(f"\n=== Batch Summary: {len(summary)} chapters in {total_seconds:.1f}s ===")
+    for entry in summary:
+        line = f"- {entry['chapter_name']}: {entry['status']} ({entry['elapsed_seconds']}s)"
+        if entry["error"]:
+            line += f" - {entry['error']}"
+        print(line)
+    counts = {}
+    for entry in summary:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    print("Totals: " + ", ".join(f"{status}={count}" for status, count in sorted(counts.items())))
 
 async def main():
+    parser = argparse.ArgumentParser(description="Automated book publication workflow.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch_parser = subparsers.add_parser("batch", help="Process every chapter listed in a manifest concurrently.")
+    batch_parser.add_argument("manifest", help="Path to a JSON or CSV manifest of (url, chapter_name) pairs.")
+    batch_parser.add_argument("--max-chapters", type=int, default=BATCH_MAX_CONCURRENT_CHAPTERS, help="Chapters processed at the same time.")
+    batch_parser.add_argument("--scrape-concurrency", type=int, default=BATCH_SCRAPE_CONCURRENCY)
+    batch_parser.add_argument("--ai-concurrency", type=int, default=BATCH_AI_CONCURRENCY)
+    batch_parser.add_argument("--save-concurrency", type=int, default=BATCH_SAVE_CONCURRENCY)
+    batch_parser.add_argument("--fetch-mode", choices=("browser", "http"), default=SCRAPER_FETCH_MODE,
+                              help="'browser' renders pages and takes screenshots; 'http' fetches static HTML, faster, without screenshots.")
+    batch_parser.add_argument("--embedding-workers", type=int, default=EMBEDDING_WORKERS,
+                              help="Worker processes for embedding inference (0 = in this process); worth it for large batches.")
+    batch_parser.add_argument("--speculative", action="store_true", default=SPECULATIVE_ITERATIONS,
+                              help="Pre-compute each chapter's next AI iteration while it awaits human review.")
+    batch_parser.add_argument("--publish", action="store_true", help="Publish the whole book, every stored chapter (see publish.py), when the batch finishes.")
+
+    resume_parser = subparsers.add_parser("resume", help="Continue every chapter workflow that didn't reach a terminal step.")
+    resume_parser.add_argument("--max-chapters", type=int, default=BATCH_MAX_CONCURRENT_CHAPTERS, help="Chapters processed at the same time.")
+    resume_parser.add_argument("--scrape-concurrency", type=int, default=BATCH_SCRAPE_CONCURRENCY)
+    resume_parser.add_argument("--ai-concurrency", type=int, default=BATCH_AI_CONCURRENCY)
+    resume_parser.add_argument("--save-concurrency", type=int, default=BATCH_SAVE_CONCURRENCY)
+    resume_parser.add_argument("--fetch-mode", choices=("browser", "http"), default=SCRAPER_FETCH_MODE,
+                               help="'browser' renders pages and takes screenshots; 'http' fetches static HTML, faster, without screenshots.")
+    resume_parser.add_argument("--embedding-workers", type=int, default=EMBEDDING_WORKERS,
+                               help="Worker processes for embedding inference (0 = in this process); worth it for large batches.")
+    resume_parser.add_argument("--speculative", action="store_true", default=SPECULATIVE_ITERATIONS,
+                               help="Pre-compute each chapter's next AI iteration while it awaits human review.")
+    resume_parser.add_argument("--publish", action="store_true", help="Publish the whole book, every stored chapter (see publish.py), when the batch finishes.")
+
+    crawl_parser = subparsers.add_parser("crawl", help="Discover every chapter from a book's table of contents and process them as they are found.")
+    crawl_parser.add_argument("index_url", help="URL of the book's index page, e.g. https://en.wikisource.org/wiki/The_Gates_of_Morning")
+    crawl_parser.add_argument("--list-only", action="store_true", help="Print the discovered chapters without processing them.")
+    crawl_parser.add_argument("--max-depth", type=int, default=CRAWL_MAX_DEPTH, help="Levels of nested tables of contents to follow.")
+    crawl_parser.add_argument("--crawl-concurrency", type=int, default=CRAWL_MAX_CONCURRENT_FETCHES, help="Index and contents pages fetched at the same time.")
+    crawl_parser.add_argument("--host-delay", type=float, default=CRAWL_HOST_DELAY_SECONDS, help="Minimum seconds between crawl requests to one host.")
+    crawl_parser.add_argument("--max-chapters", type=int, default=BATCH_MAX_CONCURRENT_CHAPTERS, help="Chapters processed at the same time.")
+    crawl_parser.add_argument("--scrape-concurrency", type=int, default=BATCH_SCRAPE_CONCURRENCY)
+    crawl_parser.add_argument("--ai-concurrency", type=int, default=BATCH_AI_CONCURRENCY)
+    crawl_parser.add_argument("--save-concurrency", type=int, default=BATCH_SAVE_CONCURRENCY)
+    crawl_parser.add_argument("--fetch-mode", choices=("browser", "http"), default=SCRAPER_FETCH_MODE,
+                              help="'browser' renders pages and takes screenshots; 'http' fetches static HTML, faster, without screenshots.")
+    crawl_parser.add_argument("--embedding-workers", type=int, default=EMBEDDING_WORKERS,
+                              help="Worker processes for embedding inference (0 = in this process); worth it for large batches.")
+    crawl_parser.add_argument("--speculative", action="store_true", default=SPECULATIVE_ITERATIONS,
+                              help="Pre-compute each chapter's next AI iteration while it awaits human review.")
+    crawl_parser.add_argument("--publish", action="store_true", help="Publish the whole book, every stored chapter (see publish.py), when the batch finishes.")
+
+    publish_parser = subparsers.add_parser("publish", help="Render every chapter's preferred version into Markdown, HTML and an EPUB.")
+    publish_parser.add_argument("--manifest", default=None, help="JSON or CSV manifest giving the chapters' reading order (default: all stored chapters).")
+    publish_parser.add_argument("--output-dir", default=PROCESSED_CHAPTERS_DIR)
+
+    compact_parser = subparsers.add_parser("compact", help="Delete versions the retention rules don't keep, then rebuild and vacuum the store.")
+    compact_parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted.")
+    compact_parser.add_argument("--no-rebuild", action="store_true", help="Delete without rebuilding the collections afterwards.")
+    compact_parser.add_argument("--keep-types", default=",".join(RETENTION_KEEP_VERSION_TYPES), help="Comma-separated version types always kept.")
+    compact_parser.add_argument("--keep-top-reviewed", type=int, default=RETENTION_KEEP_TOP_REVIEWED, help="Best reviewed versions kept per chapter.")
+    compact_parser.add_argument("--keep-latest", type=int, default=RETENTION_KEEP_LATEST, help="Most recent other versions kept per chapter.")
+
+    subparsers.add_parser("rebuild-index", help="Rebuild the best-version index from the versions already stored.")
+
+    reembed_parser = subparsers.add_parser("reembed", help="Recompute every stored embedding; texts already in the embedding cache cost no model time.")
+    reembed_parser.add_argument("--batch-size", type=int, default=256, help="Versions read and rewritten per page.")
+
+    search_parser = subparsers.add_parser("search", help="Find the stored versions closest in meaning to a query.")
+    search_parser.add_argument("query", help="Text to search for, e.g. a phrase the version mentioned.")
+    search_parser.add_argument("--chapter", default=None, help="Restrict to one chapter_id.")
+    search_parser.add_argument("--type", dest="version_type", default=None, help="Restrict to one version type (e.g. final, reviewed).")
+    search_parser.add_argument("-k", type=int, default=10, help="Results per page.")
+    search_parser.add_argument("--offset", type=int, default=0, help="Skip this many results (pagination).")
+    search_parser.add_argument("--ids-only", action="store_true", help="Return ids and distances only, without content.")
+    search_parser.add_argument("--passages", action="store_true", help="Search passages, to find matches anywhere in long chapters.")
+
+    args = parser.parse_args()
+    try:
+        await _run_command(args)
+    finally:
+        await flush_screenshots() # Background captures still running
+        await close_review_queue()
+        await close_http_fetcher()
+        await close_llm_backend()
+        try:
+            await close_version_store() # Flush versions still in the write-behind queue
+        finally:
+            close_checkpoint_store()
+            close_tracing() # Writes the remaining spans and the Prometheus metrics file
+
+async def _run_command(args: argparse.Namespace):
+    if args.command == "rebuild-index":
+        await rebuild_best_version_index()
+        return
+
+    if args.command == "reembed":
+        await reembed_collection(batch_size=args.batch_size)
+        return
+
+    if args.command == "compact":
+        await compact_version_store(
+            dry_run=args.dry_run, rebuild=not args.no_rebuild,
+            keep_types=[name.strip() for name in args.keep_types.split(",") if name.strip()],
+            keep_top_reviewed=args.keep_top_reviewed, keep_latest=args.keep_latest,
+        )
+        return
+
+    if args.command == "publish":
+        chapters = None
+        if args.manifest:
+            chapters = [(chapter_id_for(name), name) for _, name in load_chapter_manifest(args.manifest)]
+        await publish_book(chapters, output_dir=args.output_dir)
+        return
+
+    if args.command == "search" and args.passages:
+        hits = await search_passages(args.query, k=args.k, chapter_id=args.chapter, version_type=args.version_type)
+        for rank, hit in enumerate(hits, 1):
+            meta = hit["metadata"]
+            print(f"{rank}. {meta['parent_id']} passage {meta['passage']} (chars {meta['start']}-{meta['end']}, Distance: {hit['distance']:.4f})")
+            print(f"   {hit['text'][:200]}...")
+        return
+
+    if args.command == "search":
+        hits = await search_chapter_versions(
+            args.query, k=args.k, chapter_id=args.chapter, version_type=args.version_type,
+            include_content=not args.ids_only, offset=args.offset
+        )
+        for rank, hit in enumerate(hits, args.offset + 1):
+            meta = hit["metadata"]
+            print(f"{rank}. {hit['id']} (Type: {meta.get('version_type')}, Iteration: {meta.get('iteration')}, Distance: {hit['distance']:.4f})")
+            if "content" in hit:
+                print(f"   {(hit['content'] or '')[:200]}...")
+        return
+
+    if args.command in ("batch", "resume", "crawl"):
+        configure_fetch_mode(args.fetch_mode)
+        configure_embedding_workers(args.embedding_workers)
+
+    if args.command == "crawl":
+        frontier = CrawlFrontier(max_concurrent_fetches=args.crawl_concurrency, host_delay=args.host_delay)
+        chapters = crawl_book(args.index_url, frontier=frontier, max_depth=args.max_depth)
+        if args.list_only:
+            count = 0
+            async for url, name in chapters:
+                count += 1
+                print(f"{count}. {name}: {url}")
+            print(f"Discovered {count} chapters ({frontier.fetched} pages fetched).")
+            return
+        summary = await process_book_batch(
+            chapters,
+            max_concurrent_chapters=args.max_chapters,
+            scrape_concurrency=args.scrape_concurrency,
+            ai_concurrency=args.ai_concurrency,
+            save_concurrency=args.save_concurrency,
+            speculative=args.speculative,
+        )
+        if args.speculative:
+            print_speculation_summary()
+        if args.publish:
+            await publish_book() # The whole book: the store may hold chapters from earlier runs
+        return
+
+    if args.command in ("batch", "resume"):
+        if args.command == "resume":
+            unfinished = get_checkpoint_store().unfinished()
+            if not unfinished:
+                print("No unfinished chapter workflows to resume.")
+                return
+            print(f"Resuming {len(unfinished)} chapter workflow(s): " + ", ".join(f"{c['chapter_name']} ({c['step']})" for c in unfinished))
+            manifest = [(c["chapter_url"], c["chapter_name"]) for c in unfinished]
+        else:
+            manifest = load_chapter_manifest(args.manifest)
+        summary = await process_book_batch(
+            manifest,
+            max_concurrent_chapters=args.max_chapters,
+            scrape_concurrency=args.scrape_concurrency,
+            ai_concurrency=args.ai_concurrency,
+            save_concurrency=args.save_concurrency,
+            speculative=args.speculative,
+            resume=args.command == "resume",
+        )
+        if args.speculative:
+            print_speculation_summary()
+        if args.publish:
+            # A batch or resumed run covers only some of the stored chapters; publish the whole book.
+            # Passing just this run's chapters would remove every other chapter from the output.
+            await publish_book()
+        return
+
     # Define the chapter URL and a recognizable name for it
     chapter_to_process_url = "https://en.wikisource.org/wiki/The_Gates_of_Morning/Book_1/Chapter_1"
     chapter_to_process_name = "The Gates of Morning - Book 1 Chapter 1"
 
     await workflow_chapter_processing(chapter_to_process_url, chapter_to_process_name)
+    if SPECULATIVE_ITERATIONS:
+        print_speculation_summary()
 
 if __name__ == "__main__":
     asyncio.run(main())
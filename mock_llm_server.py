@@ -0,0 +1,169 @@
+# src/mock_llm_server.py
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+# Local stand-in for an OpenAI-compatible /chat/completions endpoint, so the LLM backend
+# can be load-tested without network access. It emulates response latency (a fixed part
+# plus a per-output-token part) and rate limiting (429 with Retry-After), both when a
+# requests-per-second limit is exceeded and at a configurable random rate. Requests with
+# "stream": true are answered as server-sent events, one chunk per paragraph, with the fixed
+# latency before the first chunk and the per-token latency spread over the rest.
+# Usage: python mock_llm_server.py --port 8000 --latency 0.5 --rps-limit 20 --error-rate 0.05
+# then set LLM_BACKEND=openai and LLM_BASE_URL=http://127.0.0.1:8000/v1
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.5, per_token_latency: float = 0.0, rps_limit: float = 0, error_rate: float = 0.0):
+        super().__init__(address, _MockLLMHandler)
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.rps_limit = rps_limit # 0 disables the requests-per-second limit
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "completed": 0, "rate_limited": 0}
+        self._recent = collections.deque() # Arrival times within the last second
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        """
+        Records a request and returns False if it should be rejected with 429.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            over_limit = self.rps_limit and len(self._recent) >= self.rps_limit
+            if over_limit or random.random() < self.error_rate:
+                self.stats["rate_limited"] += 1
+                return False
+            self._recent.append(now)
+            return True
+
+    def record_completed(self):
+        with self._lock:
+            self.stats["completed"] += 1
+
+def mock_completion_text(messages: list) -> str:
+    """
+    Produces a plausible reply: a JSON review for reviewer prompts, otherwise a "spun" echo.
+    """
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    if "Reviewer" in system:
+        return json.dumps({
+            "fidelity_score": random.randint(6, 10),
+            "readability_score": random.randint(6, 10),
+            "grammar_score": random.randint(7, 10),
+            "originality_score": random.randint(5, 10),
+            "feedback": "MOCK FEEDBACK: Faithful to the original with a livelier voice.",
+            "suggestions": "MOCK SUGGESTIONS: Tighten the longer descriptive passages.",
+        })
+    body = user.split("\n\n", 1)[1] if "\n\n" in user else user
+    return f"[[MOCK LLM Spun Version]]\n{body}\n[[End of MOCK LLM Spun Version]]"
+
+class _MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like a real API
+
+    def _send_json(self, status: int, payload: dict, extra_headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        if not self.server.admit():
+            self._send_json(429, {"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit_error"}}, {"Retry-After": "1"})
+            return
+
+        text = mock_completion_text(request.get("messages", []))
+        if request.get("stream"):
+            self._send_stream(request, text)
+            self.server.record_completed()
+            return
+        completion_tokens = max(1, len(text) // 4) # Rough chars-per-token estimate
+        time.sleep(self.server.latency + self.server.per_token_latency * completion_tokens)
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": completion_tokens, "total_tokens": completion_tokens},
+        })
+        self.server.record_completed()
+
+    def _send_stream(self, request: dict, text: str):
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close") # No Content-Length: the body ends when the connection closes
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(self.server.latency)
+        for chunk in re.split(r"(?<=\n\n)", text):
+            time.sleep(self.server.per_token_latency * max(1, len(chunk) // 4))
+            event = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass # Keep load-test output readable
+
+def start_mock_llm_server(port: int = 0, **options) -> Tuple[MockLLMServer, str]:
+    """
+    Starts the mock server on localhost in a background thread (port 0 picks a free port).
+    Returns (server, base_url) where base_url ends in /v1; call server.shutdown() when done.
+    """
+    server = MockLLMServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server for offline load tests.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fixed seconds per response.")
+    parser.add_argument("--per-token-latency", type=float, default=0.0, help="Extra seconds per output token.")
+    parser.add_argument("--rps-limit", type=float, default=0, help="Requests/second before answering 429 (0 = unlimited).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests randomly answered with 429.")
+    args = parser.parse_args()
+
+    server = MockLLMServer(("127.0.0.1", args.port), latency=args.latency, per_token_latency=args.per_token_latency,
+                           rps_limit=args.rps_limit, error_rate=args.error_rate)
+    print(f"Mock LLM server listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served: {server.stats}")
+
+if __name__ == "__main__":
+    main()
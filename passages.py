@@ -0,0 +1,82 @@
+# src/passages.py
+import re
+import zlib
+from typing import List, Tuple
+from config import EMBEDDING_PASSAGE_WORDS, EMBEDDING_PASSAGE_OVERLAP_WORDS
+
+# Passage splitting for embeddings. The embedding model only reads the first few hundred tokens
+# of its input, so a chapter is embedded as overlapping passages of at most EMBEDDING_PASSAGE_WORDS
+# words, and its version vector is pooled from theirs. Passages follow paragraph boundaries
+# where they can (paragraphs longer than a passage are split by words), and where a passage ends
+# is decided by the content of its last paragraph rather than by counting from the start of the
+# chapter, so an edit changes only the passages around it and the rest are served from the
+# embedding cache.
+
+_PARAGRAPH = re.compile(r"[^\n]+")
+_WORD = re.compile(r"\S+")
+_CUT_EVERY = 3 # About one paragraph in three is a cut point
+
+def _units(text: str, max_words: int, overlap_words: int) -> List[Tuple[int, int, int]]:
+    # (start, end, words) spans no longer than max_words: paragraphs, or windows of a long one
+    units = []
+    for paragraph in _PARAGRAPH.finditer(text):
+        words = list(_WORD.finditer(paragraph.group()))
+        if not words:
+            continue
+        if len(words) <= max_words:
+            units.append((paragraph.start() + words[0].start(), paragraph.start() + words[-1].end(), len(words)))
+            continue
+        step = max(1, max_words - overlap_words)
+        for first in range(0, len(words), step):
+            window = words[first:first + max_words]
+            units.append((paragraph.start() + window[0].start(), paragraph.start() + window[-1].end(), len(window)))
+            if first + max_words >= len(words):
+                break
+    return units
+
+def split_passages(text: str, max_words: int = EMBEDDING_PASSAGE_WORDS,
+                   overlap_words: int = EMBEDDING_PASSAGE_OVERLAP_WORDS) -> List[Tuple[int, int]]:
+    """
+    Returns the (start, end) character spans of the passages covering `text`, in order.
+    Consecutive passages share up to overlap_words words of whole paragraphs.
+    A text of at most max_words words is a single passage.
+    """
+    units = _units(text, max_words, overlap_words)
+    if not units:
+        return [(0, len(text))]
+    # Once a passage is a quarter full, it may end after any paragraph whose hash picks it as a cut point
+    cut_points = [zlib.crc32(text[start:end].encode("utf-8")) % _CUT_EVERY == 0 for start, end, _ in units]
+    passages = []
+    first = 0
+    while first < len(units):
+        last, words = first, units[first][2]
+        while last + 1 < len(units) and words + units[last + 1][2] <= max_words:
+            if words >= max_words // 4 and cut_points[last]:
+                break
+            last += 1
+            words += units[last][2]
+        passages.append((units[first][0], units[last][1]))
+        if last + 1 >= len(units):
+            break
+        # The next passage starts with the trailing paragraphs of this one that fit in the overlap
+        next_first, carried = last + 1, 0
+        while next_first - 1 > first and carried + units[next_first - 1][2] <= overlap_words:
+            next_first -= 1
+            carried += units[next_first][2]
+        first = next_first
+    return passages
+
+def pool_vectors(vectors: List, weights: List[float]) -> "np.ndarray":
+    """
+    Weighted mean of passage vectors, rescaled to their average length so a pooled vector is
+    comparable with single-passage vectors (and equal to the vector of a single passage).
+    """
+    import numpy as np # Deferred: this module is imported by version_manager, which main imports
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if len(matrix) == 1:
+        return matrix[0]
+    pooled = np.average(matrix, axis=0, weights=weights)
+    norm = np.linalg.norm(pooled)
+    if norm > 0:
+        pooled *= np.linalg.norm(matrix, axis=1).mean() / norm
+    return pooled.astype(np.float32)
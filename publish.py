@@ -0,0 +1,276 @@
+# src/publish.py
+import datetime
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import uuid
+import zipfile
+from typing import Dict, Any, Iterator, List, Tuple
+from config import PROCESSED_CHAPTERS_DIR, BOOK_TITLE, BOOK_AUTHOR, BOOK_LANGUAGE, ensure_dir
+from tracing import span, increment
+from version_manager import get_preferred_versions, load_versions
+from workflow_state import get_checkpoint_store
+
+# Incremental book export into PROCESSED_CHAPTERS_DIR:
+#   chapters/<chapter>.md, chapters/<chapter>.xhtml   one pair per chapter
+#   book.md, index.html, book.epub                    the whole book, assembled from the chapter files
+#   publish_manifest.json                             what every file was rendered from
+# Each chapter is rendered from its preferred version (the one retrieve_consistent_content_rl_search
+# returns). The manifest records the content hash and title each chapter was rendered with, so a
+# run only reads and re-renders the chapters that changed; the book files are re-assembled by
+# streaming the chapter files, and skipped entirely when no chapter or the order changed.
+
+MANIFEST_NAME = "publish_manifest.json"
+_MARKDOWN_SPECIAL = re.compile(r"^(#|>|[-*+] |\d+[.)] |=+$|-+$)")
+
+def _file_stem(chapter_id: str) -> str:
+    return re.sub(r"[^\w.-]", "_", chapter_id)
+
+def _natural_key(title: str) -> List:
+    # "Chapter 2" sorts before "Chapter 10"
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", title)]
+
+def _paragraphs(text: str) -> Iterator[str]:
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            yield line
+
+def render_markdown(title: str, text: str) -> Iterator[str]:
+    yield f"# {title}\n"
+    for paragraph in _paragraphs(text):
+        if _MARKDOWN_SPECIAL.match(paragraph):
+            paragraph = "\\" + paragraph # Keep prose from turning into headings or lists
+        yield f"\n{paragraph}\n"
+
+def render_xhtml(title: str, text: str) -> Iterator[str]:
+    """
+    Renders a chapter as XHTML, which browsers open as a page and EPUB uses as is.
+    """
+    title = html.escape(title)
+    yield (
+        '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{BOOK_LANGUAGE}" xml:lang="{BOOK_LANGUAGE}">\n'
+        f'<head>\n<meta charset="utf-8"/>\n<title>{title}</title>\n</head>\n<body>\n<section epub:type="chapter">\n<h1>{title}</h1>\n'
+    )
+    for paragraph in _paragraphs(text):
+        yield f"<p>{html.escape(paragraph)}</p>\n"
+    yield "</section>\n</body>\n</html>\n"
+
+def _write_stream(path: str, chunks: Iterator[str]) -> str:
+    """
+    Writes the chunks to a temp file and swaps it in; returns the sha256 of what was written.
+    """
+    digest = hashlib.sha256()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            digest.update(chunk.encode("utf-8"))
+    os.replace(tmp_path, path)
+    return digest.hexdigest()
+
+class BookPublisher:
+    """
+    Renders chapters into an output directory and assembles the book files from them,
+    using the publish manifest to skip everything that is already up to date.
+    """
+
+    def __init__(self, output_dir: str = PROCESSED_CHAPTERS_DIR, title: str = BOOK_TITLE, author: str = BOOK_AUTHOR):
+        self.output_dir = output_dir
+        self.chapters_dir = os.path.join(output_dir, "chapters")
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        self.title = title
+        self.author = author
+        self.manifest = {"chapters": {}, "book": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def _chapter_path(self, chapter_id: str, extension: str) -> str:
+        return os.path.join(self.chapters_dir, f"{_file_stem(chapter_id)}.{extension}")
+
+    def is_current(self, chapter_id: str, title: str, content_hash: str) -> bool:
+        entry = self.manifest["chapters"].get(chapter_id)
+        return (
+            entry is not None and entry["content_hash"] == content_hash and entry["title"] == title
+            and all(os.path.exists(self._chapter_path(chapter_id, ext)) for ext in ("md", "xhtml"))
+        )
+
+    def render_chapter(self, chapter_id: str, title: str, version_id: str, content_hash: str, text: str):
+        ensure_dir(self.chapters_dir)
+        self.manifest["chapters"][chapter_id] = {
+            "title": title,
+            "version_id": version_id,
+            "content_hash": content_hash,
+            "markdown_sha256": _write_stream(self._chapter_path(chapter_id, "md"), render_markdown(title, text)),
+            "xhtml_sha256": _write_stream(self._chapter_path(chapter_id, "xhtml"), render_xhtml(title, text)),
+        }
+
+    def remove_chapter(self, chapter_id: str):
+        self.manifest["chapters"].pop(chapter_id, None)
+        for ext in ("md", "xhtml"):
+            try:
+                os.remove(self._chapter_path(chapter_id, ext))
+            except FileNotFoundError:
+                pass
+
+    def book_hash(self, order: List[str]) -> str:
+        digest = hashlib.sha256(json.dumps([self.title, self.author]).encode("utf-8"))
+        for chapter_id in order:
+            entry = self.manifest["chapters"][chapter_id]
+            digest.update(f"\0{chapter_id}\0{entry['title']}\0{entry['markdown_sha256']}\0{entry['xhtml_sha256']}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def assemble(self, order: List[str]) -> bool:
+        """
+        Rebuilds book.md, index.html and book.epub for the chapters in `order`, unless they were
+        already built from exactly these chapter files. Returns whether anything was rebuilt.
+        """
+        book_hash = self.book_hash(order)
+        outputs = [os.path.join(self.output_dir, name) for name in ("book.md", "index.html", "book.epub")]
+        if self.manifest["book"].get("hash") == book_hash and all(os.path.exists(path) for path in outputs):
+            return False
+        self._write_book_markdown(order, outputs[0])
+        _write_stream(outputs[1], self._render_index(order))
+        self._write_epub(order, outputs[2])
+        self.manifest["book"] = {"hash": book_hash, "chapters": len(order), "published": datetime.datetime.now().isoformat()}
+        return True
+
+    def _write_book_markdown(self, order: List[str], path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(f"# {self.title}\n\n_{self.author}_\n".encode("utf-8"))
+            for chapter_id in order:
+                out.write(b"\n")
+                with open(self._chapter_path(chapter_id, "md"), "rb") as chapter:
+                    out.write(b"#") # Chapter headings one level below the book title
+                    shutil.copyfileobj(chapter, out)
+        os.replace(tmp_path, path)
+
+    def _render_index(self, order: List[str]) -> Iterator[str]:
+        title = html.escape(self.title)
+        yield f'<!DOCTYPE html>\n<html lang="{BOOK_LANGUAGE}">\n<head>\n<meta charset="utf-8"/>\n<title>{title}</title>\n</head>\n<body>\n'
+        yield f"<h1>{title}</h1>\n<p>{html.escape(self.author)}</p>\n<ol>\n"
+        for chapter_id in order:
+            href = f"chapters/{_file_stem(chapter_id)}.xhtml"
+            yield f'<li><a href="{href}">{html.escape(self.manifest["chapters"][chapter_id]["title"])}</a></li>\n'
+        yield "</ol>\n</body>\n</html>\n"
+
+    def _epub_package(self, order: List[str]) -> str:
+        identifier = uuid.uuid5(uuid.NAMESPACE_URL, f"book:{self.title}:{self.author}")
+        modified = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        items = "\n".join(
+            f'<item id="c{i}" href="chapters/{_file_stem(chapter_id)}.xhtml" media-type="application/xhtml+xml"/>'
+            for i, chapter_id in enumerate(order, 1)
+        )
+        spine = "\n".join(f'<itemref idref="c{i}"/>' for i in range(1, len(order) + 1))
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'<dc:identifier id="book-id">urn:uuid:{identifier}</dc:identifier>\n'
+            f"<dc:title>{html.escape(self.title)}</dc:title>\n<dc:creator>{html.escape(self.author)}</dc:creator>\n"
+            f'<dc:language>{BOOK_LANGUAGE}</dc:language>\n<meta property="dcterms:modified">{modified}</meta>\n'
+            "</metadata>\n<manifest>\n"
+            '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+            f"{items}\n</manifest>\n<spine>\n{spine}\n</spine>\n</package>\n"
+        )
+
+    def _epub_nav(self, order: List[str]) -> str:
+        entries = "\n".join(
+            f'<li><a href="chapters/{_file_stem(chapter_id)}.xhtml">{html.escape(self.manifest["chapters"][chapter_id]["title"])}</a></li>'
+            for chapter_id in order
+        )
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            f"<head><title>{html.escape(self.title)}</title></head>\n<body>\n"
+            f'<nav epub:type="toc" id="toc"><h1>Contents</h1>\n<ol>\n{entries}\n</ol></nav>\n</body>\n</html>\n'
+        )
+
+    def _write_epub(self, order: List[str], path: str):
+        tmp_path = path + ".tmp"
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as epub:
+            # The mimetype entry must come first and be stored uncompressed
+            epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+            epub.writestr("META-INF/container.xml", (
+                '<?xml version="1.0" encoding="utf-8"?>\n'
+                '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+                '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>\n'
+                "</container>\n"
+            ))
+            epub.writestr("OEBPS/content.opf", self._epub_package(order))
+            epub.writestr("OEBPS/nav.xhtml", self._epub_nav(order))
+            for chapter_id in order:
+                name = f"OEBPS/chapters/{_file_stem(chapter_id)}.xhtml"
+                with open(self._chapter_path(chapter_id, "xhtml"), "rb") as chapter, epub.open(name, "w") as entry:
+                    shutil.copyfileobj(chapter, entry)
+        os.replace(tmp_path, path)
+
+    def save_manifest(self):
+        ensure_dir(self.output_dir)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+async def publish_book(chapters: List[Tuple[str, str]] = None, output_dir: str = PROCESSED_CHAPTERS_DIR,
+                       title: str = BOOK_TITLE, author: str = BOOK_AUTHOR) -> Dict[str, Any]:
+    """
+    Publishes the book into output_dir. `chapters` is the (chapter_id, title) reading order;
+    by default every chapter in the version store is published, titled with its chapter name
+    from the workflow checkpoints and sorted naturally by title.
+    Returns {"chapters", "rendered", "unchanged", "removed", "missing", "book_rebuilt", "output_dir"}.
+    """
+    publisher = BookPublisher(output_dir, title, author)
+    with span("publish.select") as select_span:
+        versions = await get_preferred_versions([chapter_id for chapter_id, _ in chapters] if chapters is not None else None)
+        if chapters is None:
+            names = get_checkpoint_store().chapter_names()
+            chapters = sorted(((chapter_id, names.get(chapter_id) or chapter_id) for chapter_id in versions), key=lambda c: _natural_key(c[1]))
+        select_span["chapters"] = len(chapters)
+
+    order, changed, missing = [], [], []
+    for chapter_id, chapter_title in chapters:
+        handle = versions.get(chapter_id)
+        if handle is None:
+            missing.append(chapter_id)
+            continue
+        order.append(chapter_id)
+        content_hash = handle.metadata.get("content_hash") or handle.id # Versions stored before content hashes existed
+        if not publisher.is_current(chapter_id, chapter_title, content_hash):
+            changed.append((chapter_id, chapter_title, handle, content_hash))
+    if missing:
+        print(f"No stored versions for {len(missing)} chapter(s), left out: {', '.join(missing)}")
+
+    with span("publish.render", chapters=len(changed)):
+        await load_versions([handle for _, _, handle, _ in changed]) # One batched read for every changed chapter
+        for chapter_id, chapter_title, handle, content_hash in changed:
+            publisher.render_chapter(chapter_id, chapter_title, handle.id, content_hash, handle.content or "")
+    increment("publish_chapters_rendered", len(changed))
+
+    published = set(order)
+    removed = [chapter_id for chapter_id in publisher.manifest["chapters"] if chapter_id not in published]
+    for chapter_id in removed:
+        publisher.remove_chapter(chapter_id)
+
+    with span("publish.assemble", chapters=len(order)) as assemble_span:
+        rebuilt = publisher.assemble(order) if order else False
+        assemble_span["rebuilt"] = rebuilt
+    publisher.save_manifest()
+
+    print(f"Published {len(order)} chapters to {output_dir}: {len(changed)} rendered, {len(order) - len(changed)} unchanged, "
+          f"{len(removed)} removed; book files {'rebuilt' if rebuilt else 'already up to date'}.")
+    return {
+        "chapters": len(order),
+        "rendered": len(changed),
+        "unchanged": len(order) - len(changed),
+        "removed": len(removed),
+        "missing": missing,
+        "book_rebuilt": rebuilt,
+        "output_dir": output_dir,
+    }
@@ -0,0 +1,386 @@
+# src/review_queue.py
+import asyncio
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+from config import REVIEW_FRONTENDS, REVIEW_HTTP_PORT
+from tracing import span
+
+# Asynchronous human review queue.
+# A workflow publishes a review task (feedback on content, a choice between options, or an
+# edit of content) and awaits its answer, so the event loop keeps scraping, spinning and
+# saving other chapters while tasks wait for a person. Frontends answer tasks:
+# - terminal: the original prompts, run on a daemon thread one task at a time
+# - http: a local JSON endpoint (GET /reviews, GET /reviews/<id>, POST /reviews/<id> {"answer": ...})
+
+REVIEW_KINDS = ("feedback", "decision", "edit")
+
+class ReviewQueue:
+    """
+    Pending review tasks and the futures their workflows are awaiting.
+    submit() may be called from any thread (e.g. the HTTP frontend's).
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, Dict[str, Any]] = {} # Pending tasks, oldest first
+        self._futures: Dict[str, asyncio.Future] = {} # Tasks not yet claimed by an answer
+        self._outcomes: Dict[str, asyncio.Future] = {} # Every task until its workflow has its answer
+        self._listeners: List[asyncio.Queue] = [] # One per frontend that wants to be told about new tasks
+        self.stats = {"published": 0, "answered": 0}
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Returns a queue that receives the id of every task published from now on.
+        """
+        listener = asyncio.Queue()
+        self._listeners.append(listener)
+        return listener
+
+    async def request(self, kind: str, chapter_name: str, prompt: str, content: str = None, options: List[str] = None) -> str:
+        """
+        Publishes a review task and waits for its answer.
+        """
+        if kind not in REVIEW_KINDS:
+            raise ValueError(f"Unknown review kind: {kind}")
+        task = {
+            "id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "chapter_name": chapter_name,
+            "prompt": prompt,
+            "content": content,
+            "options": options or [],
+            "created": time.time(),
+        }
+        future = self._loop.create_future()
+        with self._lock:
+            self._tasks[task["id"]] = task
+            self._futures[task["id"]] = future
+            self._outcomes[task["id"]] = future
+        self.stats["published"] += 1
+        for listener in self._listeners:
+            listener.put_nowait(task["id"])
+        try:
+            with span("human.wait", kind=kind):
+                return await future
+        finally:
+            with self._lock:
+                self._tasks.pop(task["id"], None)
+                self._futures.pop(task["id"], None)
+                self._outcomes.pop(task["id"], None)
+
+    def pending(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [task for task_id, task in self._tasks.items() if task_id in self._futures]
+
+    def get(self, task_id: str) -> Dict[str, Any] | None:
+        """
+        Returns a task that is still waiting for an answer, or None.
+        """
+        with self._lock:
+            return self._tasks.get(task_id) if task_id in self._futures else None
+
+    def resolved(self, task_id: str) -> asyncio.Future:
+        """
+        Returns a future that completes once a task has been answered, failed or cancelled
+        (immediately if it no longer exists). Call from the queue's event loop.
+        """
+        waiter = self._loop.create_future()
+        with self._lock:
+            future = self._outcomes.get(task_id)
+        if future is None or future.done():
+            waiter.set_result(None)
+        else:
+            future.add_done_callback(lambda _: _set_result_if_pending(waiter, None))
+        return waiter
+
+    def submit(self, task_id: str, answer: str) -> bool:
+        """
+        Answers a pending task. For decisions, the answer may be an option or its 1-based number.
+        Returns False if the task doesn't exist or was already answered; raises ValueError
+        for an answer that isn't one of a decision's options.
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            future = self._futures.get(task_id)
+            if task is None or future is None:
+                return False
+            if task["kind"] == "decision":
+                answer = _resolve_option(answer, task["options"])
+            # Claim the task under the lock so two frontends can't both answer it
+            del self._futures[task_id]
+        self.stats["answered"] += 1
+        self._loop.call_soon_threadsafe(_set_result_if_pending, future, answer)
+        return True
+
+    def fail(self, task_id: str, error: BaseException) -> bool:
+        """
+        Makes the workflow awaiting a task raise `error` (e.g. the terminal's input was closed).
+        """
+        with self._lock:
+            future = self._futures.pop(task_id, None)
+        if future is None:
+            return False
+        self._loop.call_soon_threadsafe(_set_exception_if_pending, future, error)
+        return True
+
+    def cancel_all(self):
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future in futures:
+            self._loop.call_soon_threadsafe(future.cancel)
+
+def _set_result_if_pending(future: asyncio.Future, result: str):
+    if not future.done():
+        future.set_result(result)
+
+def _set_exception_if_pending(future: asyncio.Future, error: BaseException):
+    if not future.done():
+        future.set_exception(error)
+
+def _resolve_option(answer: str, options: List[str]) -> str:
+    answer = str(answer).strip()
+    if answer in options:
+        return answer
+    if answer.isdigit() and 1 <= int(answer) <= len(options):
+        return options[int(answer) - 1]
+    raise ValueError(f"Answer must be one of {options} or 1-{len(options)}")
+
+class _TerminalPrompter:
+    """
+    The one thread that reads the terminal. It's a daemon thread rather than the event loop's
+    default executor, so exiting never waits for a prompt nobody will answer, and it outlives
+    event loops, so a prompt left blocked by one run can't race a later run for stdin.
+    Lines are read from stdin's file descriptor rather than through sys.stdin: a daemon thread
+    blocked inside sys.stdin's buffer at exit makes the interpreter abort.
+    """
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._pending = b"" # Read from stdin but not yet returned as a line
+        self.current: str = None # Id of the task being prompted for
+        threading.Thread(target=self._run, name="terminal-review", daemon=True).start()
+
+    def prompt(self, review_queue: ReviewQueue, task_id: str) -> asyncio.Future:
+        """
+        Queues a prompt for a task; the returned future gets the typed answer, or None if the task
+        was resolved elsewhere before its prompt started or while it was being typed.
+        """
+        answer = review_queue._loop.create_future()
+        self._jobs.put((review_queue, task_id, answer))
+        return answer
+
+    def read_line(self, prompt: str = "") -> str:
+        """
+        input() without the trailing newline; raises EOFError at the end of input.
+        """
+        try:
+            fd = sys.stdin.fileno()
+        except (AttributeError, ValueError, io.UnsupportedOperation):
+            return input(prompt) # Not backed by a file descriptor (e.g. replaced in a test)
+        if prompt:
+            sys.stdout.write(prompt)
+            sys.stdout.flush()
+        while b"\n" not in self._pending:
+            data = os.read(fd, 4096)
+            if not data:
+                if not self._pending:
+                    raise EOFError
+                break # A last line without a newline
+            self._pending += data
+        line, _, self._pending = self._pending.partition(b"\n")
+        return line.decode(sys.stdin.encoding or "utf-8", errors="replace").rstrip("\r")
+
+    def _run(self):
+        while True:
+            review_queue, task_id, answer = self._jobs.get()
+            task = review_queue.get(task_id)
+            result, error = None, None
+            if task is not None:
+                self.current = task_id
+                try:
+                    result = _prompt_in_terminal(task, self.read_line)
+                except Exception as e: # e.g. EOFError once stdin is closed
+                    error = e
+                self.current = None
+                if review_queue.get(task_id) is None:
+                    result, error = None, None # Stale: resolved elsewhere meanwhile, never applied to another task
+            try:
+                if error is not None:
+                    review_queue._loop.call_soon_threadsafe(_set_exception_if_pending, answer, error)
+                else:
+                    review_queue._loop.call_soon_threadsafe(_set_result_if_pending, answer, result)
+            except RuntimeError:
+                pass # That run's event loop is closed
+
+_terminal_prompter: _TerminalPrompter = None
+
+def _get_terminal_prompter() -> _TerminalPrompter:
+    global _terminal_prompter
+    if _terminal_prompter is None:
+        _terminal_prompter = _TerminalPrompter()
+    return _terminal_prompter
+
+class TerminalReviewFrontend:
+    """
+    Answers review tasks with the original terminal prompts from human_interface, one task at a
+    time in publication order. The blocking prompts run on a daemon thread. If a task is
+    answered from another frontend while its prompt is open, a notice says so, what is typed
+    there is discarded, and the next pending task is prompted for.
+    """
+
+    def __init__(self, queue: ReviewQueue):
+        self.queue = queue
+        self._prompter = _get_terminal_prompter()
+        self._listener = queue.subscribe()
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            task_id = await self._listener.get()
+            task = self.queue.get(task_id)
+            if task is None:
+                continue # Already answered elsewhere
+            answer = self._prompter.prompt(self.queue, task_id)
+            await asyncio.wait({answer, self.queue.resolved(task_id)}, return_when=asyncio.FIRST_COMPLETED)
+            if not answer.done():
+                if self._prompter.current == task_id:
+                    end = "Ctrl+D" if task["kind"] == "edit" else "Enter"
+                    print(f"\n(The review of {task['chapter_name']} was answered from another frontend; "
+                          f"press {end} to continue with the next review.)")
+                answer.add_done_callback(_consume_result)
+                continue
+            try:
+                result = answer.result()
+            except Exception as e: # The chapter's workflow sees it
+                self.queue.fail(task_id, e)
+                continue
+            if result is not None and not self.queue.submit(task_id, result):
+                print("(This review was already answered from another frontend.)")
+
+    async def close(self):
+        self._worker.cancel()
+
+def _consume_result(future: asyncio.Future):
+    if not future.cancelled():
+        future.exception() # Mark it retrieved; a stale prompt's outcome is discarded
+
+def _prompt_in_terminal(task: Dict[str, Any], read_line) -> str:
+    from human_interface import get_human_feedback, get_human_decision, apply_human_edits
+    if task["kind"] == "feedback":
+        return get_human_feedback(task["chapter_name"], task["content"], task["prompt"], read_line)
+    if task["kind"] == "decision":
+        return get_human_decision(f"[{task['chapter_name']}] {task['prompt']}", task["options"], read_line)
+    print(f"\n[{task['chapter_name']}] {task['prompt']}")
+    return apply_human_edits(task["content"], read_line)
+
+class _ReviewRequestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status: int, payload: Any):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _task_id(self) -> str | None:
+        parts = self.path.strip("/").split("/")
+        return parts[1] if len(parts) == 2 and parts[0] == "reviews" else None
+
+    def do_GET(self):
+        queue = self.server.review_queue
+        if self.path.rstrip("/") == "/reviews":
+            # The listing leaves out content, which can be a whole chapter
+            self._send_json(200, [{k: v for k, v in task.items() if k != "content"} for task in queue.pending()])
+            return
+        task = queue.get(self._task_id() or "")
+        if task is None:
+            self._send_json(404, {"error": "No such pending review"})
+            return
+        self._send_json(200, task)
+
+    def do_POST(self):
+        task_id = self._task_id()
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            answer = json.loads(self.rfile.read(length) or b"{}")["answer"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            self._send_json(400, {"error": 'Expected a JSON body like {"answer": "..."}'})
+            return
+        try:
+            accepted = self.server.review_queue.submit(task_id or "", answer)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        if not accepted:
+            self._send_json(404, {"error": "No such pending review"})
+            return
+        self._send_json(200, {"id": task_id, "status": "answered"})
+
+    def log_message(self, format, *args):
+        pass # Keep workflow output readable
+
+class HttpReviewFrontend:
+    """
+    Serves the review queue as JSON on localhost in a background thread (port 0 picks a free port).
+    """
+
+    def __init__(self, queue: ReviewQueue, port: int = REVIEW_HTTP_PORT):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _ReviewRequestHandler)
+        self.server.daemon_threads = True
+        self.server.review_queue = queue
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/reviews"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Review queue available at {self.url}")
+
+    async def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+_review_queue: ReviewQueue = None
+_frontends: list = []
+_frontend_names: List[str] = REVIEW_FRONTENDS
+
+def configure_review_frontends(names: List[str] = REVIEW_FRONTENDS):
+    """
+    Chooses the frontends started with the next review queue; an empty list starts none (e.g. for
+    a scripted driver that answers tasks itself). Calling it with no arguments restores REVIEW_FRONTENDS.
+    """
+    global _frontend_names
+    _frontend_names = list(names)
+
+def get_review_queue() -> ReviewQueue:
+    """
+    Returns the review queue for the running event loop, starting the configured frontends
+    (REVIEW_FRONTENDS, or see configure_review_frontends) on first use.
+    """
+    global _review_queue, _frontends
+    if _review_queue is None or _review_queue._loop is not asyncio.get_running_loop():
+        _review_queue = ReviewQueue()
+        _frontends = []
+        for name in _frontend_names:
+            if name == "terminal":
+                _frontends.append(TerminalReviewFrontend(_review_queue))
+            elif name == "http":
+                _frontends.append(HttpReviewFrontend(_review_queue))
+            else:
+                raise ValueError(f"Unknown review frontend: {name}")
+    return _review_queue
+
+async def close_review_queue():
+    global _review_queue, _frontends
+    if _review_queue is not None and _review_queue._loop is asyncio.get_running_loop():
+        _review_queue.cancel_all()
+        for frontend in _frontends:
+            await frontend.close()
+    _review_queue = None
+    _frontends = []
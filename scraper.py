@@ -1,65 +1,325 @@
 # src/scraper.py
 import asyncio
 import os
-from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
-from config import RAW_CONTENT_DIR, SCREENSHOTS_DIR
+from config import RAW_CONTENT_DIR, ensure_dir, SCRAPER_POOL_SIZE, SCRAPER_PAGE_MAX_USES, SCRAPER_FETCH_MODE
+from config import SCREENSHOT_MODE, SCREENSHOT_VIEWPORT
+from http_fetcher import HttpFetcher
+from extractors import extract_text
+from screenshots import capture_screenshot, schedule_capture, flush_screenshots
+from tracing import span
 
-async def fetch_content_and_screenshot(url: str, chapter_name: str) -> str | None:
+_VIEWPORT = {"width": SCREENSHOT_VIEWPORT[0], "height": SCREENSHOT_VIEWPORT[1]}
+
+def _save_raw_content(chapter_name: str, text_content: str):
+    # Save raw content to a file
+    raw_content_path = os.path.join(ensure_dir(RAW_CONTENT_DIR), f"{chapter_name}.txt")
+    with open(raw_content_path, "w", encoding="utf-8") as f:
+        f.write(text_content)
+    print(f"Raw content saved to: {raw_content_path}")
+
+async def _scrape_page(page, url: str, chapter_name: str) -> str:
     """
-    Fetches content from a URL and saves a screenshot.
-    Returns the extracted text content, or None if scraping fails.
+    Loads a URL in an already-open Playwright page and saves the extracted text.
+    Returns the extracted text content. Exceptions are left to the caller.
+    The page stays loaded, so a screenshot can be captured from it afterwards (see screenshots.py).
     """
-    print(f"Fetching content and screenshot for: {url}")
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch()
-            page = await browser.new_page()
-            await page.goto(url, wait_until="domcontentloaded") # Wait until DOM is loaded
-
-            # Save screenshot
-            screenshot_path = os.path.join(SCREENSHOTS_DIR, f"{chapter_name}.png")
-            await page.screenshot(path=screenshot_path, full_page=True)
-            print(f"Screenshot saved to: {screenshot_path}")
-
-            # Extract text content
-            content_html = await page.content()
-            soup = BeautifulSoup(content_html, 'html.parser')
-
-            # --- IMPORTANT: Adjust the selector based on the actual website structure ---
-            # For en.wikisource.org, the main content is typically within a div with id 'mw-content-text'.
-            # If the structure changes or you target a different site, inspect the page (F12 in browser)
-            # to find the most appropriate container for the chapter text.
-            content_div = soup.find('div', id='mw-content-text')
-            if content_div:
-                # Correct way to find and remove multiple elements:
-                # Use .select() with a CSS selector string to target tags to remove.
-                for unwanted_tag in content_div.select('script, style, nav, sup, span, div.printfooter, table, .mw-editsection'):
-                    unwanted_tag.extract() # Remove these elements from the parsed content
-
-                text_content = content_div.get_text(separator='\n', strip=True)
+    with span("scrape.page_load", url=url):
+        await page.goto(url, wait_until="domcontentloaded") # Wait until DOM is loaded
+
+    # Extract text content
+    content_html = await page.content()
+    with span("scrape.parse", html_bytes=len(content_html)):
+        text_content = extract_text(content_html, url)
+    _save_raw_content(chapter_name, text_content)
+    return text_content
+
+class ScraperService:
+    """
+    Long-lived scraper that keeps one Chromium browser open and reuses a bounded pool of pages
+    across many URLs, instead of launching a new browser for every chapter.
+    A page is recycled (closed and replaced) after max_page_uses fetches or after it crashes,
+    and the browser itself is relaunched if it disconnects.
+
+    Usage:
+        async with ScraperService() as scraper:
+            text = await scraper.fetch(url, chapter_name)
+    """
+
+    def __init__(self, pool_size: int = SCRAPER_POOL_SIZE, max_page_uses: int = SCRAPER_PAGE_MAX_USES):
+        self.pool_size = pool_size
+        self.max_page_uses = max_page_uses
+        self._playwright = None
+        self._browser = None
+        self._idle_pages = [] # Open pages ready for reuse
+        self._page_uses = {} # id(page) -> number of fetches served by that page
+        self._crashed_pages = set() # id(page) of pages that emitted a 'crash' event
+        self._slots = asyncio.Semaphore(pool_size) # Bounds the number of pages in use at once
+        self._browser_lock = asyncio.Lock()
+        self._closed = False
+
+    async def start(self):
+        """
+        Starts Playwright and launches the shared browser. Called lazily by fetch() if needed.
+        """
+        async with self._browser_lock:
+            if self._closed:
+                raise RuntimeError("ScraperService has been closed.")
+            if self._playwright is None:
+                from playwright.async_api import async_playwright # Deferred: only browser-mode scrapes need it
+                self._playwright = await async_playwright().start()
+            if self._browser is None or not self._browser.is_connected():
+                # Pages belonging to a dead browser can't be reused
+                self._idle_pages.clear()
+                self._page_uses.clear()
+                self._crashed_pages.clear()
+                self._browser = await self._playwright.chromium.launch()
+                print("ScraperService: Chromium browser launched.")
+
+    async def _acquire_page(self):
+        await self._slots.acquire()
+        try:
+            if self._browser is None or not self._browser.is_connected():
+                await self.start()
+            while self._idle_pages:
+                page = self._idle_pages.pop()
+                if not page.is_closed():
+                    return page
+            page = await self._browser.new_page(viewport=_VIEWPORT)
+            self._page_uses[id(page)] = 0
+            page.on("crash", lambda crashed_page: self._crashed_pages.add(id(crashed_page)))
+            return page
+        except Exception:
+            self._slots.release()
+            raise
+
+    async def _release_page(self, page, failed: bool = False):
+        try:
+            page_key = id(page)
+            self._page_uses[page_key] = self._page_uses.get(page_key, 0) + 1
+            recycle = (
+                failed
+                or page_key in self._crashed_pages
+                or self._page_uses[page_key] >= self.max_page_uses
+                or page.is_closed()
+            )
+            if recycle or self._closed:
+                self._page_uses.pop(page_key, None)
+                self._crashed_pages.discard(page_key)
+                try:
+                    await page.close()
+                except Exception:
+                    pass # The page (or its browser) may already be gone
             else:
-                # Fallback to getting all visible text if specific div not found
-                text_content = soup.get_text(separator='\n', strip=True)
-                print("Warning: Specific content div (id='mw-content-text') not found. Extracted all visible text.")
+                self._idle_pages.append(page)
+        finally:
+            self._slots.release()
 
-            # Save raw content to a file
-            raw_content_path = os.path.join(RAW_CONTENT_DIR, f"{chapter_name}.txt")
-            with open(raw_content_path, "w", encoding="utf-8") as f:
-                f.write(text_content)
-            print(f"Raw content saved to: {raw_content_path}")
+    async def fetch(self, url: str, chapter_name: str, screenshot_mode: str = SCREENSHOT_MODE) -> str | None:
+        """
+        Fetches content and a screenshot for a URL using a pooled page.
+        Returns the extracted text content, or None if scraping fails.
+        In "background" screenshot mode the text is returned right away and the page is
+        returned to the pool once its screenshot has been captured.
+        """
+        print(f"Fetching content and screenshot for: {url}")
+        try:
+            page = await self._acquire_page()
+        except Exception as e:
+            print(f"Error during scraping from {url}: {e}")
+            return None
+        failed = False
+        released_by_capture = False
+        try:
+            text_content = await _scrape_page(page, url, chapter_name)
+            if screenshot_mode == "inline":
+                await capture_screenshot(page, chapter_name)
+            elif screenshot_mode == "background":
+                schedule_capture(self._capture_and_release(page, chapter_name))
+                released_by_capture = True
+            return text_content
+        except Exception as e:
+            failed = True # Don't hand a page in an unknown state to the next caller
+            print(f"Error during scraping from {url}: {e}")
+            return None
+        finally:
+            if not released_by_capture:
+                await self._release_page(page, failed=failed)
 
-            await browser.close()
+    async def _capture_and_release(self, page, chapter_name: str):
+        path = None
+        try:
+            path = await capture_screenshot(page, chapter_name)
+        finally:
+            await self._release_page(page, failed=path is None)
+
+    async def close(self):
+        """
+        Closes every pooled page, the browser and Playwright. Safe to call more than once.
+        Background screenshots still being captured are finished first.
+        """
+        await flush_screenshots()
+        self._closed = True
+        async with self._browser_lock:
+            for page in self._idle_pages:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+            self._idle_pages.clear()
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception:
+                    pass
+                self._browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+_fetch_mode = SCRAPER_FETCH_MODE
+_warned_no_screenshots = False
+
+def configure_fetch_mode(mode: str = SCRAPER_FETCH_MODE):
+    """
+    Sets the default fetch mode ("browser" or "http") of fetch_content_and_screenshot.
+    Calling it with no arguments restores SCRAPER_FETCH_MODE.
+    """
+    global _fetch_mode
+    if mode not in ("browser", "http"):
+        raise ValueError(f"Unknown fetch mode: {mode}")
+    _fetch_mode = mode
+
+_default_http_fetcher = None
+
+def get_http_fetcher() -> HttpFetcher:
+    """
+    Returns the process-wide HttpFetcher, creating it on first use so that every
+    HTTP-mode scrape shares one connection pool and one HTML cache.
+    """
+    global _default_http_fetcher
+    if _default_http_fetcher is None:
+        _default_http_fetcher = HttpFetcher()
+    return _default_http_fetcher
+
+async def close_http_fetcher():
+    global _default_http_fetcher
+    if _default_http_fetcher is not None:
+        await _default_http_fetcher.close()
+        _default_http_fetcher = None
+
+async def fetch_content_http(url: str, chapter_name: str, http_fetcher: HttpFetcher = None) -> str | None:
+    """
+    Fetches a static page over HTTP (no browser, no screenshot) and extracts its text.
+    If the server reports the page unchanged, the text extracted on a previous run is
+    reused without downloading or re-parsing anything.
+    Returns the extracted text content, or None if the fetch fails.
+    """
+    fetcher = http_fetcher if http_fetcher is not None else get_http_fetcher()
+    print(f"Fetching content over HTTP for: {url}")
+    with span("scrape.http_fetch", url=url) as fetch_span:
+        result = await fetcher.fetch(url)
+        fetch_span["from_cache"] = bool(result and result["from_cache"])
+    if result is None:
+        return None
+
+    text_content = fetcher.cache.read_text(result["content_hash"]) if result["from_cache"] else None
+    if text_content is None:
+        with span("scrape.parse", html_bytes=len(result["html"] or "")):
+            text_content = extract_text(result["html"], url)
+        fetcher.cache.write_text(result["content_hash"], text_content)
+    else:
+        print("Reusing previously extracted text for unchanged page.")
+
+    _save_raw_content(chapter_name, text_content)
+    return text_content
+
+async def fetch_content_and_screenshot(
+    url: str,
+    chapter_name: str,
+    scraper_service: ScraperService = None,
+    fetch_mode: str = None,
+    http_fetcher: HttpFetcher = None,
+    screenshot_mode: str = SCREENSHOT_MODE
+) -> str | None:
+    """
+    Fetches content from a URL and saves a screenshot.
+    Returns the extracted text content, or None if scraping fails.
+    - screenshot_mode (browser fetches only): "background" captures the screenshot after the
+      text is returned, "inline" before, "off" skips it. See screenshots.py for the format,
+      size and change detection.
+    - fetch_mode="http": plain HTTP with an on-disk cache and no screenshot. If the HTTP
+      fetch fails, the browser path is used instead.
+    - fetch_mode="browser": renders the page in Chromium (for JS pages and screenshots).
+      This is the default unless SCRAPER_FETCH_MODE or configure_fetch_mode says otherwise.
+      If a ScraperService is given, its pooled browser is reused; otherwise a browser is
+      launched for this call only.
+    """
+    global _warned_no_screenshots
+    fetch_mode = fetch_mode or _fetch_mode
+    if fetch_mode == "http":
+        if screenshot_mode != "off" and not _warned_no_screenshots:
+            _warned_no_screenshots = True
+            print(f"Note: fetch mode 'http' takes no screenshots (SCREENSHOT_MODE={screenshot_mode} applies to browser "
+                  "fetches only); use SCRAPER_FETCH_MODE=browser or --fetch-mode browser to capture them.")
+        text_content = await fetch_content_http(url, chapter_name, http_fetcher=http_fetcher)
+        if text_content is not None:
             return text_content
+        print(f"HTTP fetch failed for {url}. Falling back to the browser.")
+
+    if scraper_service is not None:
+        return await scraper_service.fetch(url, chapter_name, screenshot_mode=screenshot_mode)
+
+    print(f"Fetching content and screenshot for: {url}")
+    playwright = browser = None
+    try:
+        from playwright.async_api import async_playwright # Deferred: only browser-mode scrapes need it
+        playwright = await async_playwright().start()
+        browser = await playwright.chromium.launch()
+        page = await browser.new_page(viewport=_VIEWPORT)
+        text_content = await _scrape_page(page, url, chapter_name)
     except Exception as e:
         print(f"Error during scraping from {url}: {e}")
+        await _close_browser(playwright, browser)
         return None
 
+    async def capture_and_close():
+        try:
+            await capture_screenshot(page, chapter_name)
+        finally:
+            await _close_browser(playwright, browser)
+
+    if screenshot_mode == "background":
+        schedule_capture(capture_and_close()) # The browser stays open until the capture is done
+    elif screenshot_mode == "inline":
+        await capture_and_close()
+    else:
+        await _close_browser(playwright, browser)
+    return text_content
+
+async def _close_browser(playwright, browser):
+    # Closes a per-call browser and its Playwright instance, either of which may be None
+    try:
+        if browser is not None:
+            await browser.close()
+    except Exception:
+        pass # The browser may already be gone
+    finally:
+        if playwright is not None:
+            await playwright.stop()
+
 # Example usage for testing this module independently
 async def main_scraper_test():
     url = "https://en.wikisource.org/wiki/The_Gates_of_Morning/Book_1/Chapter_1"
     chapter_name = "The_Gates_of_Morning_Book_1_Chapter_1"
     content = await fetch_content_and_screenshot(url, chapter_name)
+    await flush_screenshots()
     if content:
         print("\n--- Extracted Content Sample (First 500 chars) ---")
         print(content[:500])
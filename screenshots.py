@@ -0,0 +1,185 @@
+# src/screenshots.py
+import asyncio
+import datetime
+import hashlib
+import io
+import json
+import os
+import threading
+from typing import Dict, Any, Awaitable, Tuple
+from config import (
+    SCREENSHOTS_DIR,
+    SCREENSHOT_FORMAT,
+    SCREENSHOT_QUALITY,
+    SCREENSHOT_FULL_PAGE,
+    SCREENSHOT_MAX_WIDTH,
+    SCREENSHOT_HASH_DISTANCE,
+    ensure_dir,
+)
+from tracing import span
+
+# Change-aware chapter screenshots.
+# Captures are taken in a compressed format at a bounded size, optionally downscaled and
+# re-encoded with Pillow, and compared against the chapter's previous capture: a perceptual
+# hash (dHash) within SCREENSHOT_HASH_DISTANCE, or identical bytes when Pillow isn't installed,
+# means the page looks the same and the previous file is kept instead of storing a new one.
+# Captures usually run in the background (see scraper.py); flush_screenshots() waits for them.
+
+_PLAYWRIGHT_TYPES = {"jpeg": "jpeg", "png": "png", "webp": "jpeg"} # Playwright can't encode webp itself
+_EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp"}
+
+def _load_pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+def perceptual_hash(image_bytes: bytes) -> str | None:
+    """
+    Returns the 64-bit difference hash of an image as 16 hex digits, or None without Pillow.
+    Small rendering differences (anti-aliasing, compression) change only a few bits.
+    """
+    Image = _load_pillow()
+    if Image is None:
+        return None
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        pixels = list(image.convert("L").resize((9, 8)).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+def hash_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def encode_screenshot(image_bytes: bytes, fmt: str = SCREENSHOT_FORMAT, quality: int = SCREENSHOT_QUALITY,
+                      max_width: int = SCREENSHOT_MAX_WIDTH) -> Tuple[bytes, str]:
+    """
+    Downscales a capture to max_width and encodes it as fmt. Returns (bytes, format stored).
+    Without Pillow the capture is kept as Playwright encoded it.
+    """
+    Image = _load_pillow()
+    if Image is None:
+        return image_bytes, _PLAYWRIGHT_TYPES[fmt]
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        if max_width and image.width > max_width:
+            image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        if fmt in ("jpeg", "webp"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format=fmt.upper(), quality=quality, optimize=True)
+    return out.getvalue(), fmt
+
+class ScreenshotStore:
+    """
+    Screenshot files plus an index (index.json in the same directory) of each chapter's current
+    capture: {chapter_name: {"file", "phash", "sha256", "bytes", "captured", "checked"}}.
+    """
+
+    def __init__(self, directory: str = SCREENSHOTS_DIR, hash_distance_threshold: int = SCREENSHOT_HASH_DISTANCE):
+        self.directory = directory
+        self.hash_distance_threshold = hash_distance_threshold
+        self.index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+
+    def _unchanged(self, previous: Dict[str, Any], phash: str | None, digest: str) -> bool:
+        if not previous or not os.path.exists(os.path.join(self.directory, previous["file"])):
+            return False
+        if phash and previous.get("phash"):
+            return hash_distance(phash, previous["phash"]) <= self.hash_distance_threshold
+        return previous.get("sha256") == digest
+
+    def save(self, chapter_name: str, image_bytes: bytes) -> Tuple[str, bool]:
+        """
+        Stores a new capture of a chapter unless it matches the previous one.
+        Returns (path of the chapter's current screenshot, whether a new file was written).
+        """
+        phash = perceptual_hash(image_bytes)
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        now = datetime.datetime.now().isoformat()
+        with self._lock:
+            previous = self._index.get(chapter_name)
+            if self._unchanged(previous, phash, digest):
+                previous["checked"] = now
+                self._save_index_locked()
+                return os.path.join(self.directory, previous["file"]), False
+
+            data, fmt = encode_screenshot(image_bytes)
+            file_name = f"{chapter_name}.{_EXTENSIONS[fmt]}"
+            ensure_dir(self.directory)
+            tmp_path = os.path.join(self.directory, file_name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.directory, file_name))
+            if previous and previous["file"] != file_name:
+                try:
+                    os.remove(os.path.join(self.directory, previous["file"])) # Format changed since the last capture
+                except FileNotFoundError:
+                    pass
+            self._index[chapter_name] = {"file": file_name, "phash": phash, "sha256": digest, "bytes": len(data), "captured": now, "checked": now}
+            self._save_index_locked()
+            return os.path.join(self.directory, file_name), True
+
+    def _save_index_locked(self):
+        ensure_dir(self.directory)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+_screenshot_store: ScreenshotStore = None
+_pending_captures: set = set()
+
+def get_screenshot_store() -> ScreenshotStore:
+    global _screenshot_store
+    if _screenshot_store is None:
+        _screenshot_store = ScreenshotStore()
+    return _screenshot_store
+
+async def capture_screenshot(page, chapter_name: str) -> str | None:
+    """
+    Captures the page already loaded in `page` and stores it if it changed.
+    Returns the path of the chapter's current screenshot, or None if the capture failed.
+    """
+    try:
+        with span("scrape.screenshot", full_page=SCREENSHOT_FULL_PAGE):
+            options = {"type": _PLAYWRIGHT_TYPES[SCREENSHOT_FORMAT], "full_page": SCREENSHOT_FULL_PAGE, "scale": "css"}
+            if options["type"] == "jpeg":
+                options["quality"] = SCREENSHOT_QUALITY
+            image_bytes = await page.screenshot(**options)
+        with span("screenshot.store") as store_span:
+            # Hashing and re-encoding are CPU work; keep them off the event loop
+            path, written = await asyncio.to_thread(get_screenshot_store().save, chapter_name, image_bytes)
+            store_span["written"] = written
+    except Exception as e:
+        print(f"Error capturing screenshot for '{chapter_name}': {e}")
+        return None
+    if written:
+        print(f"Screenshot saved to: {path}")
+    else:
+        print(f"Screenshot unchanged since the last capture; kept {path}")
+    return path
+
+def schedule_capture(work: Awaitable) -> asyncio.Future:
+    """
+    Runs a capture (and whatever cleanup the caller attached to it) in the background.
+    """
+    task = asyncio.ensure_future(work)
+    _pending_captures.add(task)
+    task.add_done_callback(_pending_captures.discard)
+    return task
+
+async def flush_screenshots():
+    """
+    Waits for every background capture started on the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    pending = [task for task in _pending_captures if task.get_loop() is loop]
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
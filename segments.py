@@ -0,0 +1,82 @@
+# src/segments.py
+import hashlib
+import zlib
+from typing import List, NamedTuple, Tuple
+from config import SEGMENT_MIN_CHARS
+
+# Splits chapters into stable paragraph segments for incremental spin/review.
+# Where a segment ends is decided by the content of its last paragraph, not by counting from
+# the start of the chapter: once a segment holds min_chars characters it ends after the first
+# paragraph whose hash picks it as a cut point. An edit therefore changes the segment it falls
+# in (and at most the one after it, if it creates or removes a cut point); boundaries further on
+# are found again and those segments keep their hashes.
+
+SEGMENT_SEPARATOR = "\n\n"
+_CUT_EVERY = 3 # About one paragraph in three is a cut point
+_MAX_SEGMENT_FACTOR = 4 # A segment is cut regardless once it reaches this many times min_chars
+
+class Segment(NamedTuple):
+    text: str
+    hash: str
+
+def segment_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def paragraph_separator(text: str) -> str:
+    """
+    Blank lines separate paragraphs, or single newlines in text without any
+    (scraped text is extracted one block per line).
+    """
+    return SEGMENT_SEPARATOR if SEGMENT_SEPARATOR in text else "\n"
+
+def split_paragraphs(text: str) -> List[str]:
+    """
+    Splits text into paragraphs, dropping surrounding whitespace and empty paragraphs.
+    """
+    return [p.strip() for p in text.split(paragraph_separator(text)) if p.strip()]
+
+def split_segments(text: str, min_chars: int = SEGMENT_MIN_CHARS) -> List[Segment]:
+    """
+    Groups paragraphs into segments of at least min_chars characters (the last may be shorter),
+    so headings and one-line paragraphs don't each become a separate model call.
+    Segments end at content-defined cut points (see above), or at _MAX_SEGMENT_FACTOR * min_chars.
+    Paragraphs within a segment keep the text's own separator.
+    """
+    separator = paragraph_separator(text)
+    segments = []
+    pending = []
+    pending_chars = 0
+    for paragraph in split_paragraphs(text):
+        pending.append(paragraph)
+        pending_chars += len(paragraph)
+        cut_point = zlib.crc32(paragraph.encode("utf-8")) % _CUT_EVERY == 0
+        if pending_chars >= min_chars and (cut_point or pending_chars >= min_chars * _MAX_SEGMENT_FACTOR):
+            segment_text = separator.join(pending)
+            segments.append(Segment(segment_text, segment_hash(segment_text)))
+            pending, pending_chars = [], 0
+    if pending:
+        segment_text = separator.join(pending)
+        segments.append(Segment(segment_text, segment_hash(segment_text)))
+    return segments
+
+def join_segments(texts: List[str]) -> str:
+    return SEGMENT_SEPARATOR.join(t.strip() for t in texts)
+
+def split_segments_against(text: str, previous: List[str]) -> List[Tuple[Segment, bool]]:
+    """
+    Splits text that was derived from previously produced segments (e.g. a human-edited copy
+    of join_segments(previous)). Each previous segment that still appears verbatim, in order,
+    becomes a segment again; the edited text between them is split with split_segments.
+    Returns (segment, unchanged) pairs in document order.
+    """
+    result = []
+    position = 0
+    for previous_text in previous:
+        found = text.find(previous_text, position)
+        if found == -1:
+            continue # Edited or deleted; whatever replaced it lands in the next gap
+        result.extend((segment, False) for segment in split_segments(text[position:found]))
+        result.append((Segment(previous_text, segment_hash(previous_text)), True))
+        position = found + len(previous_text)
+    result.extend((segment, False) for segment in split_segments(text[position:]))
+    return result
@@ -0,0 +1,76 @@
+# src/speculation.py
+import asyncio
+import contextlib
+import time
+from typing import Any, Awaitable, Dict
+
+# Speculative execution of the next AI iteration (see main.workflow_chapter_processing).
+# While a human reviews a chapter, its next spin + review runs in the background on the
+# assumption that the current content will be approved. The result is committed if it is
+# (the reviewer doesn't wait for the AI again) and discarded otherwise.
+
+speculation_stats: Dict[str, Any] = {
+    "started": 0,
+    "committed": 0,
+    "discarded": 0,
+    "latency_saved_seconds": 0.0, # AI time the reviewer didn't have to wait for after approving
+    "compute_wasted_seconds": 0.0, # AI time spent on speculations that were discarded
+}
+
+class SpeculativeIteration:
+    """
+    One speculatively started AI iteration for `content` at `iteration`.
+    `work` is the awaitable doing the spin and review; `state` is anything the caller needs
+    back on commit (e.g. the forked segment memo the work updates).
+    """
+
+    def __init__(self, content: str, iteration: int, work: Awaitable, state: Any = None):
+        self.content = content
+        self.iteration = iteration
+        self.state = state
+        self.started = time.perf_counter()
+        self.finished = None
+        self._task = asyncio.ensure_future(work)
+        self._task.add_done_callback(self._mark_finished)
+        speculation_stats["started"] += 1
+
+    def _mark_finished(self, _task):
+        self.finished = time.perf_counter()
+
+    def matches(self, content: str, iteration: int) -> bool:
+        return self.content == content and self.iteration == iteration
+
+    async def commit(self) -> Any:
+        """
+        Returns the speculative result, waiting for whatever part of it is still running.
+        The latency saved is the AI time that had already elapsed when the result was needed.
+        """
+        needed_at = time.perf_counter()
+        result = await self._task
+        finished = self.finished or time.perf_counter()
+        saved = min(needed_at, finished) - self.started
+        speculation_stats["committed"] += 1
+        speculation_stats["latency_saved_seconds"] += saved
+        print(f"Using speculative iteration {self.iteration}: {saved:.2f}s of AI time was already done "
+              f"({max(0.0, finished - needed_at):.2f}s left to wait).")
+        return result
+
+    async def discard(self, reason: str):
+        """
+        Cancels the speculation (if still running) and counts the AI time it used as wasted.
+        """
+        discarded_at = time.perf_counter()
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await self._task
+        wasted = min(self.finished or discarded_at, discarded_at) - self.started
+        speculation_stats["discarded"] += 1
+        speculation_stats["compute_wasted_seconds"] += wasted
+        print(f"Discarded speculative iteration {self.iteration} ({reason}); {wasted:.2f}s of AI time wasted.")
+
+def print_speculation_summary():
+    stats = speculation_stats
+    print("\n=== Speculative Iterations ===")
+    print(f"Started: {stats['started']}, committed: {stats['committed']}, discarded: {stats['discarded']}")
+    print(f"Human-facing latency saved: {stats['latency_saved_seconds']:.2f}s")
+    print(f"Compute wasted on discarded speculations: {stats['compute_wasted_seconds']:.2f}s")
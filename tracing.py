@@ -0,0 +1,260 @@
+# src/tracing.py
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Tuple
+from config import TRACING_ENABLED, TRACE_PATH, METRICS_PROMETHEUS_PATH, METRICS_HTTP_PORT, ensure_dir
+
+# Lightweight tracing and metrics for the workflow.
+# span() times a block of work (a workflow step, a scrape, an LLM call, a store write, a human
+# wait, ...). Spans nest through a context variable, so work started inside a chapter's span
+# (including asyncio tasks and threads it spawns) is attributed to that chapter.
+# Finished spans are buffered and appended to TRACE_PATH as JSON lines, and their durations feed
+# per-span latency histograms. Histograms and counters are exported in Prometheus text format,
+# to METRICS_PROMETHEUS_PATH on close and on /metrics when METRICS_HTTP_PORT is set.
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+METRIC_PREFIX = "book_workflow"
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+
+class Tracer:
+    """
+    Collects finished spans and aggregates them into latency histograms and counters.
+    Thread-safe: spans finish on the event loop, in worker threads and on the store thread.
+    """
+
+    def __init__(self, trace_path: str = TRACE_PATH, enabled: bool = TRACING_ENABLED, buffer_size: int = 256):
+        self.trace_path = trace_path
+        self.enabled = enabled
+        self.buffer_size = buffer_size # Spans are written in batches, not one write per span
+        self._lock = threading.Lock()
+        self._buffer: List[str] = []
+        self._histograms: Dict[str, List] = {} # span name -> [bucket counts..., +Inf count, sum]
+        self._counters: Dict[Tuple[str, Tuple], float] = {} # (name, sorted label pairs) -> value
+
+    def record(self, span: Dict[str, Any]):
+        line = json.dumps(span, default=str)
+        with self._lock:
+            histogram = self._histograms.get(span["name"])
+            if histogram is None:
+                histogram = self._histograms[span["name"]] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            seconds = span["duration_ms"] / 1000
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(LATENCY_BUCKETS)] += 1
+            histogram[-1] += seconds
+            if span["status"] == "error":
+                key = ("span_errors", (("span", span["name"]),))
+                self._counters[key] = self._counters.get(key, 0) + 1
+            self._buffer.append(line)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush_locked()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def counter_values(self, name: str) -> Dict[Tuple, float]:
+        """
+        Returns {sorted label pairs: value} for one counter.
+        """
+        with self._lock:
+            return {labels: value for (counter, labels), value in self._counters.items() if counter == name}
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        ensure_dir(os.path.dirname(self.trace_path) or ".")
+        with open(self.trace_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._buffer) + "\n")
+        self._buffer = []
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def prometheus_text(self) -> str:
+        """
+        Renders the histograms and counters in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = {name: list(values) for name, values in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = [
+            f"# HELP {METRIC_PREFIX}_span_duration_seconds Duration of traced workflow spans.",
+            f"# TYPE {METRIC_PREFIX}_span_duration_seconds histogram",
+        ]
+        for name in sorted(histograms):
+            values = histograms[name]
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, values):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            cumulative += values[len(LATENCY_BUCKETS)]
+            lines.append(f'{METRIC_PREFIX}_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}_span_duration_seconds_sum{{span="{name}"}} {values[-1]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_span_duration_seconds_count{{span="{name}"}} {cumulative}')
+        for counter_name in sorted({name for name, _ in counters}):
+            metric = f"{METRIC_PREFIX}_{counter_name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == counter_name:
+                    label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+                    lines.append(f"{metric}{{{label_text}}} {value:g}" if label_text else f"{metric} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str = METRICS_PROMETHEUS_PATH):
+        ensure_dir(os.path.dirname(path) or ".")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    Times the enclosed block as a span called `name`. Attributes are recorded with the span;
+    "chapter" is inherited from the enclosing span when not given. Yields the span's attribute
+    dict, so results known only at the end (sizes, cache hits, ...) can be added to it.
+    """
+    tracer = get_tracer()
+    if not tracer.enabled:
+        yield attrs
+        return
+    parent = _current_span.get()
+    if parent is not None and "chapter" in parent["attrs"]:
+        attrs.setdefault("chapter", parent["attrs"]["chapter"])
+    current = {"id": next(_ids), "trace": parent["trace"] if parent else None, "attrs": attrs}
+    current["trace"] = current["trace"] or current["id"]
+    token = _current_span.set(current)
+    started_at = time.time()
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException as e:
+        status = "error"
+        attrs.setdefault("error", f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _current_span.reset(token)
+        tracer.record({
+            "name": name,
+            "trace_id": current["trace"],
+            "span_id": current["id"],
+            "parent_id": parent["id"] if parent else None,
+            "start": round(started_at, 6),
+            "duration_ms": round(duration * 1000, 3),
+            "status": status,
+            **attrs,
+        })
+
+def record_span(name: str, duration_seconds: float, **attrs):
+    """
+    Records an already-timed piece of work as a child of the current span (for work whose
+    start and end don't sit in one block, like a streamed LLM call).
+    """
+    tracer = get_tracer()
+    if not tracer.enabled:
+        return
+    parent = _current_span.get()
+    if parent is not None and "chapter" in parent["attrs"]:
+        attrs.setdefault("chapter", parent["attrs"]["chapter"])
+    span_id = next(_ids)
+    tracer.record({
+        "name": name,
+        "trace_id": parent["trace"] if parent else span_id,
+        "span_id": span_id,
+        "parent_id": parent["id"] if parent else None,
+        "start": round(time.time() - duration_seconds, 6),
+        "duration_ms": round(duration_seconds * 1000, 3),
+        "status": "ok",
+        **attrs,
+    })
+
+def increment(name: str, value: float = 1, **labels):
+    """
+    Adds to a counter, exported as book_workflow_<name>_total{labels}.
+    """
+    get_tracer().increment(name, value, **labels)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = get_tracer().prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep workflow output readable
+
+class MetricsServer:
+    """
+    Serves the current metrics at http://127.0.0.1:<port>/metrics from a background thread.
+    """
+
+    def __init__(self, port: int = METRICS_HTTP_PORT):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/metrics"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Metrics available at {self.url}")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+_tracer: Tracer = None
+_metrics_server: MetricsServer = None
+_tracer_lock = threading.Lock()
+
+def get_tracer() -> Tracer:
+    """
+    Returns the process-wide tracer, starting the metrics endpoint (METRICS_HTTP_PORT) on first use.
+    """
+    global _tracer, _metrics_server
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                tracer = Tracer()
+                if tracer.enabled and METRICS_HTTP_PORT:
+                    _metrics_server = MetricsServer(METRICS_HTTP_PORT)
+                _tracer = tracer
+    return _tracer
+
+def close_tracing():
+    """
+    Writes buffered spans and the Prometheus metrics file, and stops the metrics endpoint.
+    """
+    global _tracer, _metrics_server
+    with _tracer_lock:
+        if _tracer is not None and _tracer.enabled:
+            _tracer.flush()
+            _tracer.write_prometheus()
+        if _metrics_server is not None:
+            _metrics_server.close()
+        _tracer = None
+        _metrics_server = None
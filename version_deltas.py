@@ -0,0 +1,76 @@
+# src/version_deltas.py
+import base64
+import difflib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List
+from config import VERSION_TEXT_CACHE_SIZE
+
+# Line-based deltas between versions of a chapter, used by version_manager to store a new text
+# as the changes against the chapter's previous text. A delta is a list of operations, each either
+# [start, end] (copy the parent's lines start:end) or a string (inserted text), serialized as
+# JSON, zlib-compressed and base64-encoded so it can be stored as a ChromaDB document.
+
+def encode_delta(parent_text: str, text: str) -> str:
+    parent_lines = parent_text.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, parent_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1: # "replace" and "insert"; a "delete" just copies nothing
+            ops.append("".join(lines[j1:j2]))
+    payload = json.dumps(ops, separators=(",", ":")).encode("utf-8")
+    return base64.b64encode(zlib.compress(payload, 9)).decode("ascii")
+
+def apply_delta(parent_text: str, delta: str) -> str:
+    ops = json.loads(zlib.decompress(base64.b64decode(delta)))
+    parent_lines = parent_text.splitlines(keepends=True)
+    return "".join("".join(parent_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+class TextCache:
+    """
+    Thread-safe LRU cache of reconstructed version texts, keyed by the id of the record that
+    stores them, so hot chapters don't replay their delta chains on every read.
+    """
+
+    def __init__(self, max_entries: int = VERSION_TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._texts: OrderedDict = OrderedDict()
+
+    def get_many(self, doc_ids: List[str]) -> Dict[str, str]:
+        found = {}
+        with self._lock:
+            for doc_id in doc_ids:
+                text = self._texts.get(doc_id)
+                if text is None:
+                    self.misses += 1
+                    continue
+                self._texts.move_to_end(doc_id)
+                found[doc_id] = text
+                self.hits += 1
+        return found
+
+    def put(self, doc_id: str, text: str):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._texts[doc_id] = text
+            self._texts.move_to_end(doc_id)
+            while len(self._texts) > self.max_entries:
+                self._texts.popitem(last=False)
+
+    def discard(self, doc_ids: List[str]):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._texts.pop(doc_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._texts.clear()
@@ -1,28 +1,613 @@
 # src/version_manager.py
-import chromadb
-from chromadb.utils import embedding_functions
 import os
-from config import CHROMADB_DATA_DIR
-from typing import List, Dict, Any
+from config import CHROMADB_DATA_DIR, EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_DIR
+from config import VERSION_WRITE_QUEUE_SIZE, VERSION_WRITE_BATCH_SIZE, VERSION_WRITE_FLUSH_SECONDS
+from config import VERSION_DELTAS_ENABLED, VERSION_KEYFRAME_INTERVAL
+from config import EMBEDDING_WORKERS, EMBEDDING_BATCH_SIZE
+from collections.abc import Mapping
+from typing import List, Dict, Any, Iterable, Tuple
 import uuid
 import datetime
 import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tracing import span, increment
+from version_deltas import encode_delta, apply_delta, TextCache
+from passages import split_passages, pool_vectors
+from embedding_pool import EmbeddingProcessPool
 
-# Initialize ChromaDB client. This will create/connect to a persistent ChromaDB instance.
-client = chromadb.PersistentClient(path=CHROMADB_DATA_DIR)
+# ChromaDB, sentence-transformers (which loads torch) and numpy are slow to import and to
+# initialize, so the client, embedding model, embedding cache and collection are created
+# on first use through the accessors below instead of at import time.
+_store_data_dir = CHROMADB_DATA_DIR
+_collection_name = "book_chapters"
+_embedding_cache_dir = EMBEDDING_CACHE_DIR
+_client = None
+_embedding_function = None
+_embedding_function_override = None
+_embedding_workers = EMBEDDING_WORKERS
+_embedding_cache = None
+_collection = None
+_passage_collection = None
+_best_version_index = None
+_init_lock = threading.RLock()
+_text_cache = TextCache() # Reconstructed texts of stored versions, by the id of the record storing them
 
-# Define an embedding function using sentence-transformers.
-# This model ('all-MiniLM-L6-v2') will be downloaded the first time it's used.
-# Ensure 'sentence-transformers' is installed via requirements.txt.
-sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+def configure_version_store(data_dir: str = CHROMADB_DATA_DIR, collection_name: str = "book_chapters", embedding_cache_dir: str = EMBEDDING_CACHE_DIR,
+                            embedding_function=None):
+    """
+    Points the store at a different ChromaDB directory / collection / embedding cache
+    (e.g. a temporary store for tests and benchmarks). Calling it with no arguments
+    restores the defaults. Takes effect on the next accessor call.
+    embedding_function (a callable from a list of texts to a list of vectors) replaces the
+    sentence-transformers model, e.g. for offline benchmarks; give it its own embedding_cache_dir,
+    since the cache is keyed by the configured model name.
+    """
+    global _store_data_dir, _collection_name, _embedding_cache_dir, _client, _embedding_cache, _collection, _best_version_index
+    global _embedding_function_override, _passage_collection
+    with _init_lock:
+        _store_data_dir, _collection_name, _embedding_cache_dir = data_dir, collection_name, embedding_cache_dir
+        _embedding_function_override = embedding_function
+        _text_cache.clear()
+        _client = _embedding_cache = _collection = _passage_collection = _best_version_index = None
+
+def get_client():
+    """
+    Returns the ChromaDB client, connecting to the persistent instance on first use.
+    """
+    global _client
+    with _init_lock:
+        if _client is None:
+            import chromadb
+            _client = chromadb.PersistentClient(path=_store_data_dir)
+        return _client
+
+def get_embedding_function():
+    """
+    Returns the sentence-transformers embedding function, loading the model on first use.
+    This model ('all-MiniLM-L6-v2') will be downloaded the first time it's used.
+    Ensure 'sentence-transformers' is installed via requirements.txt.
+    With embedding workers configured (see configure_embedding_workers), this is an
+    EmbeddingProcessPool whose workers each load the model.
+    """
+    global _embedding_function
+    with _init_lock:
+        if _embedding_function_override is not None:
+            return _embedding_function_override
+        if _embedding_function is None:
+            if _embedding_workers > 0:
+                _embedding_function = EmbeddingProcessPool(EMBEDDING_MODEL_NAME, _embedding_workers)
+            else:
+                from chromadb.utils import embedding_functions
+                _embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME)
+        return _embedding_function
+
+def configure_embedding_workers(workers: int = EMBEDDING_WORKERS):
+    """
+    Sets how many worker processes encode embeddings (0 = on the store thread) from the next
+    get_embedding_function() call on. Calling it with no arguments restores EMBEDDING_WORKERS.
+    """
+    global _embedding_workers, _embedding_function
+    with _init_lock:
+        if workers != _embedding_workers:
+            _close_embedding_pool()
+            _embedding_function = None
+            _embedding_workers = workers
+
+def _close_embedding_pool():
+    global _embedding_function
+    with _init_lock:
+        if isinstance(_embedding_function, EmbeddingProcessPool):
+            _embedding_function.close()
+            _embedding_function = None
+
+def get_embedding_cache():
+    """
+    Returns the persistent embedding cache (keyed by content hash), so a text is only ever
+    encoded once by this model, across restarts and store rebuilds.
+    """
+    global _embedding_cache
+    with _init_lock:
+        if _embedding_cache is None:
+            from embedding_cache import EmbeddingCache
+            _embedding_cache = EmbeddingCache(EMBEDDING_MODEL_NAME, cache_dir=_embedding_cache_dir)
+        return _embedding_cache
+
+def get_collection():
+    """
+    Returns the collection for book chapters, creating it if needed.
+    Embeddings are always computed through the embedding cache and passed explicitly, so
+    the collection is opened without an embedding function; opening the store therefore
+    never loads the model.
+    """
+    global _collection
+    with _init_lock:
+        if _collection is None:
+            _recover_collection_swap(_collection_name)
+            _collection = get_client().get_or_create_collection(name=_collection_name, embedding_function=None)
+        return _collection
+
+def get_passage_collection():
+    """
+    Returns the collection of passage embeddings: one record per passage of every stored text,
+    with no document (the text is sliced from its parent version) and metadata
+    {"chapter_id", "parent_id", "version_type", "passage", "start", "end"}.
+    """
+    global _passage_collection
+    with _init_lock:
+        if _passage_collection is None:
+            _recover_collection_swap(f"{_collection_name}_passages")
+            _passage_collection = get_client().get_or_create_collection(name=f"{_collection_name}_passages", embedding_function=None)
+        return _passage_collection
+
+# A collection is rebuilt by copying its records into "<name>.compact", renaming the original
+# to "<name>.old", renaming the copy to "<name>" and dropping the original, which leaves a fresh
+# vector index without the deleted records' tombstones.
+
+def _collection_names() -> set:
+    return {collection.name for collection in get_client().list_collections()}
+
+def _recover_collection_swap(name: str):
+    # Finishes a rebuild interrupted between the two renames, so the copy isn't mistaken for a missing collection
+    names = _collection_names()
+    if name not in names and f"{name}.compact" in names:
+        get_client().get_collection(f"{name}.compact").modify(name=name)
+        names.add(name)
+    if name in names and f"{name}.old" in names:
+        get_client().delete_collection(f"{name}.old")
+
+def _rebuild_collection(name: str, batch_size: int = 500) -> int:
+    """
+    Rebuilds a collection from its records (runs on the store thread). Returns the records copied.
+    Cached collection handles are dropped, since they refer to the original.
+    """
+    global _collection, _passage_collection
+    client = get_client()
+    if name not in _collection_names():
+        return 0
+    if f"{name}.compact" in _collection_names():
+        client.delete_collection(f"{name}.compact") # Left over from an interrupted copy; the original is intact
+    source = client.get_collection(name)
+    target = client.create_collection(name=f"{name}.compact", embedding_function=None)
+    copied = 0
+    while True:
+        page = source.get(limit=batch_size, offset=copied, include=['embeddings', 'documents', 'metadatas'])
+        if not page['ids']:
+            break
+        target.add(ids=page['ids'], embeddings=page['embeddings'], documents=page['documents'], metadatas=page['metadatas'])
+        copied += len(page['ids'])
+    source.modify(name=f"{name}.old")
+    target.modify(name=name)
+    client.delete_collection(f"{name}.old")
+    with _init_lock:
+        _collection = _passage_collection = None
+    return copied
+
+def _vacuum_store() -> int:
+    """
+    Returns freed space to the filesystem after deletions and rebuilds: vacuums ChromaDB's
+    SQLite file and removes vector segment directories no collection uses any more.
+    Returns the number of segment directories removed.
+    """
+    import shutil
+    import sqlite3
+    sqlite_path = os.path.join(_store_data_dir, "chroma.sqlite3")
+    if not os.path.exists(sqlite_path):
+        return 0
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        live_segments = {row[0] for row in conn.execute("SELECT id FROM segments")}
+        conn.execute("VACUUM")
+    except sqlite3.Error as e:
+        print(f"Could not vacuum {sqlite_path}: {e}")
+        return 0
+    finally:
+        conn.close()
+    removed = 0
+    for entry in os.listdir(_store_data_dir):
+        path = os.path.join(_store_data_dir, entry)
+        try:
+            uuid.UUID(entry)
+        except ValueError:
+            continue # Not a segment directory
+        if os.path.isdir(path) and entry not in live_segments:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+def review_score(metadata: Dict[str, Any]) -> float:
+    """
+    Proxy score for a reviewed version: the sum of its AI review scores.
+    """
+    return (metadata.get('fidelity_score', 0) + metadata.get('readability_score', 0) +
+            metadata.get('grammar_score', 0) + metadata.get('originality_score', 0))
+
+class BestVersionIndex:
+    """
+    Small per-chapter index, stored as JSON next to the ChromaDB data, that is updated on
+    every version write so retrieval never has to scan a chapter's versions:
+        {chapter_id: {"latest_final": {...}, "best_reviewed": {...}, "latest": {...}, "head": {...}}}
+    Each slot holds the document id plus the timestamp (and score for best_reviewed) used
+    to decide whether a newer version replaces it. "head" is the latest record that stores
+    a text (not a content_ref pointer), with its delta chain depth: the next text's parent.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.exists = os.path.exists(path) # False for stores written before the index existed
+        self._entries = {}
+        if self.exists:
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    def get(self, chapter_id: str) -> Dict[str, Any]:
+        return self._entries.get(chapter_id, {})
+
+    def chapter_ids(self) -> List[str]:
+        return list(self._entries.keys())
+
+    def update(self, doc_id: str, metadata: Dict[str, Any]):
+        entry = self._entries.setdefault(metadata["chapter_id"], {})
+        timestamp = metadata.get("timestamp", "")
+        candidate = {"id": doc_id, "timestamp": timestamp}
+
+        if timestamp >= entry.get("latest", {}).get("timestamp", ""):
+            entry["latest"] = candidate
+        if metadata.get("version_type") == "final" and timestamp >= entry.get("latest_final", {}).get("timestamp", ""):
+            entry["latest_final"] = candidate
+        if metadata.get("version_type") == "reviewed":
+            score = review_score(metadata)
+            # Strictly greater: on a tie the earlier reviewed version keeps its place
+            if "best_reviewed" not in entry or score > entry["best_reviewed"]["score"]:
+                entry["best_reviewed"] = {**candidate, "score": score}
+        if metadata.get("content_ref", doc_id) == doc_id and timestamp >= entry.get("head", {}).get("timestamp", ""):
+            entry["head"] = {**candidate, "depth": metadata.get("chain_depth", 0)}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+    def clear(self):
+        self._entries = {}
+
+def get_best_version_index() -> BestVersionIndex:
+    global _best_version_index
+    with _init_lock:
+        if _best_version_index is None:
+            os.makedirs(_store_data_dir, exist_ok=True)
+            _best_version_index = BestVersionIndex(os.path.join(_store_data_dir, f"{_collection_name}_best_versions.json"))
+        return _best_version_index
+
+def embed_documents(texts: List[str]) -> List:
+    """
+    Returns embeddings for texts, encoding only cache misses (in micro-batches).
+    """
+    embedding_cache = get_embedding_cache()
+    # A worker pool batches across its processes itself, so it gets every miss at once
+    batch_size = 0 if _embedding_workers > 0 and _embedding_function_override is None else EMBEDDING_BATCH_SIZE
+    with span("store.embed", texts=len(texts)) as embed_span:
+        misses_before = embedding_cache.misses
+        embeddings = embedding_cache.embed(texts, lambda batch: get_embedding_function()(batch), batch_size=batch_size)
+        embed_span["encoded"] = embedding_cache.misses - misses_before
+    return embeddings
+
+def embed_texts(texts: List[str]) -> Tuple[List, List[List[Dict[str, Any]]]]:
+    """
+    Embeds each text as overlapping passages (see passages.py). Returns the pooled vector of
+    each text, plus each text's passages as {"start", "end", "embedding"}. All passages go
+    through one embed_documents call, so the misses are encoded together.
+    """
+    spans = [split_passages(text) for text in texts]
+    vectors = embed_documents([text[start:end] for text, text_spans in zip(texts, spans) for start, end in text_spans])
+    pooled, passages = [], []
+    position = 0
+    for text_spans in spans:
+        text_vectors = vectors[position:position + len(text_spans)]
+        position += len(text_spans)
+        pooled.append(pool_vectors(text_vectors, [end - start for start, end in text_spans]))
+        passages.append([{"start": start, "end": end, "embedding": vector} for (start, end), vector in zip(text_spans, text_vectors)])
+    return pooled, passages
+
+def _write_passages(records: List[Dict[str, Any]], passages: List[List[Dict[str, Any]]]):
+    # Passage records for texts just stored (or re-embedded), linked to the record storing the text
+    ids, embeddings, metadatas = [], [], []
+    for record, text_passages in zip(records, passages):
+        for i, passage in enumerate(text_passages):
+            ids.append(f"{record['id']}#p{i}")
+            embeddings.append(passage["embedding"])
+            metadatas.append({
+                "chapter_id": record["metadata"]["chapter_id"],
+                "parent_id": record["id"],
+                "version_type": record["metadata"].get("version_type", ""),
+                "passage": i,
+                "start": passage["start"],
+                "end": passage["end"],
+            })
+    if ids:
+        with span("store.add", records=len(ids), passages=True):
+            get_passage_collection().upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+
+# All ChromaDB and embedding work runs on this single thread, off the event loop (see _run_in_store).
+_store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="version-store")
+
+def content_hash_for(content: str) -> str:
+    """
+    Returns the SHA-256 hex digest used to deduplicate version content.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def _find_stored_contents(content_hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Looks up already-stored versions for a set of content hashes with a single query.
+    Returns {content_hash: {"content_ref", "embedding"}} for every hash that has been stored before.
+    """
+    if not content_hashes:
+        return {}
+    with span("store.get", purpose="dedup", hashes=len(content_hashes)):
+        results = get_collection().get(
+            where={"content_hash": {"$in": list(content_hashes)}},
+            include=['metadatas', 'embeddings']
+        )
+    found = {}
+    for i, doc_id in enumerate(results['ids']):
+        meta = results['metadatas'][i]
+        if meta["content_hash"] not in found:
+            found[meta["content_hash"]] = {
+                "content_ref": meta.get("content_ref", doc_id),
+                "embedding": results['embeddings'][i],
+            }
+    return found
+
+def _encode_owner_documents(owners: List[Dict[str, Any]]) -> List[str]:
+    """
+    Returns the document to store for each record introducing a new text: the text itself
+    (a keyframe), or a compressed delta against the chapter's previous text when that is
+    smaller and the chain is shorter than VERSION_KEYFRAME_INTERVAL. The choice is recorded
+    in the metadata as "storage" ("full" or "delta"), "delta_parent" and "chain_depth".
+    """
+    best_version_index = get_best_version_index()
+    heads = {} # chapter_id -> head written earlier in this batch
+    documents = []
+    for record in owners:
+        metadata = record["metadata"]
+        head = heads.get(metadata["chapter_id"]) or best_version_index.get(metadata["chapter_id"]).get("head")
+        metadata.update(storage="full", chain_depth=0)
+        document = record["content"]
+        if VERSION_DELTAS_ENABLED and head and head["depth"] + 1 < VERSION_KEYFRAME_INTERVAL:
+            parent_text = head.get("text") or _reconstruct_texts([head["id"]]).get(head["id"])
+            if parent_text is not None:
+                delta = encode_delta(parent_text, record["content"])
+                if len(delta) < len(document):
+                    document = delta
+                    metadata.update(storage="delta", delta_parent=head["id"], chain_depth=head["depth"] + 1)
+        heads[metadata["chapter_id"]] = {"id": record["id"], "depth": metadata["chain_depth"], "text": record["content"]}
+        documents.append(document)
+    return documents
+
+def _write_versions(records: List[Dict[str, Any]]):
+    """
+    Writes a batch of queued versions to ChromaDB (runs on the store executor thread).
+
+    Storage is content-addressed: each distinct text is stored and embedded only once.
+    A version whose text was already stored (e.g. the "reviewed" copy of a "spun" version),
+    either earlier or in the same batch, is saved as a metadata-only record pointing at the
+    original through "content_ref", reusing its embedding instead of running the model again.
+    A new text is itself usually stored as a delta against the chapter's previous text
+    (see _encode_owner_documents); embeddings are always computed from the full text, as the
+    pool of its passage embeddings, and the passages are stored in the passage collection.
+    """
+    stored = _find_stored_contents({r["metadata"]["content_hash"] for r in records})
+
+    owners = [] # Records that introduce a new text
+    owner_for_hash = {}
+    pointers = [] # Records whose text is already stored (or owned earlier in this batch)
+    for record in records:
+        content_hash = record["metadata"]["content_hash"]
+        if content_hash in stored or content_hash in owner_for_hash:
+            pointers.append(record)
+        else:
+            record["metadata"]["content_ref"] = record["id"] # This record owns the document body
+            owner_for_hash[content_hash] = record
+            owners.append(record)
+
+    if owners:
+        owner_embeddings, owner_passages = embed_texts([r["content"] for r in owners]) # Cache misses are micro-batched
+        owner_documents = _encode_owner_documents(owners)
+        with span("store.add", records=len(owners), with_documents=True):
+            get_collection().add(
+                documents=owner_documents,
+                embeddings=owner_embeddings,
+                metadatas=[r["metadata"] for r in owners],
+                ids=[r["id"] for r in owners],
+            )
+        _write_passages(owners, owner_passages)
+        for record, embedding in zip(owners, owner_embeddings):
+            stored[record["metadata"]["content_hash"]] = {"content_ref": record["id"], "embedding": embedding}
+            _text_cache.put(record["id"], record["content"]) # The next version of the chapter is encoded against it
+
+    if pointers:
+        for record in pointers:
+            record["metadata"]["content_ref"] = stored[record["metadata"]["content_hash"]]["content_ref"]
+        with span("store.add", records=len(pointers), with_documents=False):
+            get_collection().add(
+                embeddings=[stored[r["metadata"]["content_hash"]]["embedding"] for r in pointers], # No document, nothing re-embedded
+                metadatas=[r["metadata"] for r in pointers],
+                ids=[r["id"] for r in pointers],
+            )
+
+    best_version_index = get_best_version_index()
+    for record in records:
+        best_version_index.update(record["id"], record["metadata"])
+        shared = "" if record["metadata"]["content_ref"] == record["id"] else f" (content shared with {record['metadata']['content_ref']})"
+        print(f"Saved version {record['id']} (Type: {record['metadata']['version_type']}) to ChromaDB{shared}.")
+        increment("versions_saved", version_type=record["metadata"]["version_type"], deduplicated=bool(shared))
+    best_version_index.save()
+
+async def _run_in_store(fn, *args, **kwargs):
+    """
+    Runs a synchronous ChromaDB / embedding call on the dedicated store thread, so model
+    inference and disk I/O never block the event loop. One worker keeps store access serialized.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context() # So store spans nest under the caller's span
+    return await loop.run_in_executor(_store_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+class VersionWriteError(Exception):
+    """
+    Raised by flush_pending_writes() and close_version_store() when queued versions could not be
+    written. `failures` lists (doc_id, error) pairs.
+    """
+
+    def __init__(self, failures: List[Tuple[str, BaseException]]):
+        self.failures = failures
+        super().__init__(f"{len(failures)} version(s) could not be saved: "
+                         + "; ".join(f"{doc_id}: {error}" for doc_id, error in failures))
+
+class VersionWriteQueue:
+    """
+    Bounded write-behind queue for chapter versions.
+    save_chapter_version() only enqueues; a background task groups queued versions and writes
+    them with batched `add` calls once batch_size versions are waiting or flush_interval seconds
+    have passed since the first one. When the queue is full, savers wait (backpressure).
+    If a batch fails, its versions are retried one by one, so one bad version doesn't take the
+    rest with it; versions that still fail are kept until reported.
+    drain() waits until everything queued so far has been attempted; flush() also raises
+    VersionWriteError for versions that failed; close() flushes and stops the writer.
+    """
+
+    def __init__(self, max_pending: int = VERSION_WRITE_QUEUE_SIZE, batch_size: int = VERSION_WRITE_BATCH_SIZE, flush_interval: float = VERSION_WRITE_FLUSH_SECONDS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._flush_requested = asyncio.Event()
+        self._flush_waiters = 0
+        self._failures: List[Tuple[Dict[str, Any], BaseException]] = [] # Not yet reported by flush()
+        # Started in an empty context: the writer serves every chapter, not the one that created the queue
+        self._writer_task = contextvars.Context().run(asyncio.create_task, self._writer())
+
+    async def put(self, record: Dict[str, Any]):
+        await self._queue.put(record)
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = [await self._queue.get()]
+        deadline = self.loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - self.loop.time()
+            if remaining <= 0 or self._flush_requested.is_set():
+                break
+            getter = asyncio.ensure_future(self._queue.get())
+            flush_waiter = asyncio.ensure_future(self._flush_requested.wait())
+            done, pending = await asyncio.wait({getter, flush_waiter}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            if getter in done:
+                batch.append(getter.result())
+        return batch
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            # _write_versions fills in storage metadata; a retry starts again from the queued records
+            attempt = [{**record, "metadata": dict(record["metadata"])} for record in batch]
+            with span("store.write_batch", versions=len(batch)):
+                await _run_in_store(_write_versions, attempt)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Error saving version {batch[0]['id']} to ChromaDB: {e}")
+                self._failures.append((batch[0], e))
+                return
+            print(f"Error saving {len(batch)} versions to ChromaDB ({e}); retrying them one by one.")
+        for record in batch: # Adding a version that the failed batch did write is a no-op
+            await self._write([record])
+
+    async def _writer(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def drain(self):
+        self._flush_waiters += 1
+        self._flush_requested.set()
+        try:
+            await self._queue.join()
+        finally:
+            self._flush_waiters -= 1
+            if self._flush_waiters == 0:
+                self._flush_requested.clear()
 
-# Create or get the collection for book chapters.
-# The embedding_function ensures that when documents are added, their embeddings
-# are automatically generated and stored, enabling similarity searches.
-chapters_collection = client.get_or_create_collection(
-    name="book_chapters",
-    embedding_function=sentence_transformer_ef
-)
+    async def flush(self, chapter_id: str = None):
+        """
+        Drains the queue, then raises VersionWriteError for the versions that failed (only those of
+        chapter_id, if given). Each failure is reported once.
+        """
+        await self.drain()
+        failed = [(record, error) for record, error in self._failures
+                  if chapter_id is None or record["metadata"]["chapter_id"] == chapter_id]
+        if failed:
+            self._failures = [failure for failure in self._failures if failure not in failed]
+            raise VersionWriteError([(record["id"], error) for record, error in failed])
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+
+_write_queue: VersionWriteQueue = None
+
+def _get_write_queue() -> VersionWriteQueue:
+    # The queue is tied to the event loop it was created on; each asyncio.run() gets a fresh one.
+    global _write_queue
+    if _write_queue is None or _write_queue.loop is not asyncio.get_running_loop():
+        _write_queue = VersionWriteQueue()
+    return _write_queue
+
+async def _drain_pending_writes():
+    # Read-your-writes for reads in this module: failed writes stay for flush_pending_writes() to report
+    if _write_queue is not None and _write_queue.loop is asyncio.get_running_loop():
+        await _write_queue.drain()
+
+async def flush_pending_writes(chapter_id: str = None):
+    """
+    Waits until every version queued by save_chapter_version() has been written to ChromaDB.
+    Raises VersionWriteError for queued versions (of chapter_id, if given) that could not be written.
+    """
+    if _write_queue is not None and _write_queue.loop is asyncio.get_running_loop():
+        await _write_queue.flush(chapter_id)
+
+async def close_version_store():
+    """
+    Flushes pending version writes and stops the background writer. Call before exiting.
+    Raises VersionWriteError, after stopping the writer, if queued versions could not be written.
+    """
+    global _write_queue
+    try:
+        if _write_queue is not None and _write_queue.loop is asyncio.get_running_loop():
+            queue, _write_queue = _write_queue, None
+            await queue.close()
+    finally:
+        await _run_in_store(_close_embedding_pool)
 
 async def save_chapter_version(
     chapter_id: str,
@@ -35,6 +620,9 @@ async def save_chapter_version(
     """
     Saves a specific version of a chapter to ChromaDB.
     Each version is stored as a document with relevant metadata.
+    The version is queued and written in the background (see VersionWriteQueue); reads through
+    this module drain the queue first, and flush_pending_writes() makes it durable explicitly
+    (raising VersionWriteError if it couldn't be written).
     """
     full_metadata = {
         "chapter_id": chapter_id,
@@ -42,26 +630,131 @@ async def save_chapter_version(
         "version_type": version_type,
         "iteration": iteration,
         "timestamp": datetime.datetime.now().isoformat(), # Record save time
+        "content_hash": content_hash_for(content),
         **(metadata if metadata else {}) # Add any additional metadata
     }
     # Create a unique document ID for ChromaDB
     doc_id = f"{chapter_id}-{version_id}-{version_type}-{iteration}"
+    await _get_write_queue().put({"id": doc_id, "content": content, "metadata": full_metadata})
 
-    try:
-        chapters_collection.add(
-            documents=[content],
-            metadatas=[full_metadata],
-            ids=[doc_id],
-            # embeddings are automatically generated by the collection's embedding_function
-        )
-        print(f"Saved version {doc_id} (Type: {version_type}) to ChromaDB.")
-    except Exception as e:
-        print(f"Error saving to ChromaDB: {e}")
+def _reconstruct_texts(doc_ids: Iterable[str], known: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    Returns {doc_id: text} for records that store a text (keyframes and deltas), replaying
+    each delta chain from its nearest keyframe or cached text; each record in the chains is
+    fetched once. Rebuilt texts go into the text cache. Ids missing from the store are left out.
+    `known` holds texts the caller already has (full documents it fetched).
+    """
+    doc_ids = list(dict.fromkeys(doc_ids))
+    texts = dict(known or {})
+    texts.update(_text_cache.get_many([doc_id for doc_id in doc_ids if doc_id not in texts]))
+    records = {}
+    wanted = {doc_id for doc_id in doc_ids if doc_id not in texts}
+    with span("store.reconstruct", texts=len(doc_ids)) as reconstruct_span:
+        while wanted:
+            page = get_collection().get(ids=list(wanted), include=['documents', 'metadatas'])
+            wanted = set()
+            for doc_id, document, meta in zip(page['ids'], page['documents'], page['metadatas']):
+                records[doc_id] = (document, meta or {})
+                parent = (meta or {}).get("delta_parent")
+                if (meta or {}).get("storage") == "delta" and parent not in texts and parent not in records:
+                    wanted.add(parent)
+            cached = _text_cache.get_many(list(wanted))
+            texts.update(cached)
+            wanted -= cached.keys()
+        reconstruct_span["fetched"] = len(records)
+
+    def rebuild(doc_id: str) -> str | None:
+        if doc_id in texts:
+            return texts[doc_id]
+        if doc_id not in records:
+            return None
+        document, meta = records[doc_id]
+        if meta.get("storage") == "delta":
+            parent_text = rebuild(meta["delta_parent"])
+            text = apply_delta(parent_text, document) if parent_text is not None else None
+        else:
+            text = document
+        if text is not None:
+            texts[doc_id] = text
+            _text_cache.put(doc_id, text)
+        return text
 
-async def get_chapter_versions(chapter_id: str = None, version_type: str = None) -> List[Dict[str, Any]]:
+    return {doc_id: text for doc_id in doc_ids if (text := rebuild(doc_id)) is not None}
+
+def _materialize(doc_ids: List[str], metadatas: List[Dict[str, Any]], documents: List[str | None] = None) -> List[str | None]:
     """
-    Retrieves chapter versions based on chapter_id and/or version_type filters.
-    Returns a list of dictionaries, each containing 'id', 'content', and 'metadata'.
+    Returns the full text of each version: deduplicated records take the text of the record
+    referenced by their "content_ref", and delta-encoded texts are rebuilt from their chain.
+    `documents`, if the caller already fetched them, saves re-reading full (keyframe) texts.
+    """
+    owners = [(meta or {}).get("content_ref", doc_id) for doc_id, meta in zip(doc_ids, metadatas)]
+    known = {}
+    for doc_id, meta, document in zip(doc_ids, metadatas, documents or [None] * len(doc_ids)):
+        if document is not None and (meta or {}).get("storage", "full") == "full":
+            known[doc_id] = document
+    texts = _reconstruct_texts(owners, known)
+    return [texts.get(owner) for owner in owners]
+
+class VersionHandle(Mapping):
+    """
+    A stored version as returned by get_chapter_versions. "id" and "metadata" are loaded up
+    front; "content" is materialized on first access (handle["content"] or handle.content), so
+    listing a long history reads no texts. Access from async code can use `await handle.load()`
+    to do the read on the store thread instead of the caller's.
+    """
+
+    def __init__(self, doc_id: str, metadata: Dict[str, Any]):
+        self.id = doc_id
+        self.metadata = metadata
+        self._content = None
+        self._loaded = False
+
+    @property
+    def content(self) -> str | None:
+        if not self._loaded:
+            self._content = _materialize([self.id], [self.metadata])[0]
+            self._loaded = True
+        return self._content
+
+    async def load(self) -> str | None:
+        if not self._loaded:
+            self._content = await _run_in_store(lambda: _materialize([self.id], [self.metadata])[0])
+            self._loaded = True
+        return self._content
+
+    def __getitem__(self, key: str):
+        if key == "id":
+            return self.id
+        if key == "metadata":
+            return self.metadata
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("id", "content", "metadata"))
+
+    def __len__(self) -> int:
+        return 3
+
+    def __repr__(self) -> str:
+        return f"VersionHandle({self.id!r}, {self.metadata.get('version_type')!r}, loaded={self._loaded})"
+
+async def load_versions(handles: List[VersionHandle]):
+    """
+    Materializes the content of many handles with one batched read on the store thread.
+    """
+    pending = [handle for handle in handles if not handle._loaded]
+    if not pending:
+        return
+    texts = await _run_in_store(_materialize, [handle.id for handle in pending], [handle.metadata for handle in pending])
+    for handle, text in zip(pending, texts):
+        handle._content = text
+        handle._loaded = True
+
+def _build_where(chapter_id: str = None, version_type: str = None) -> Dict[str, Any]:
+    """
+    Builds a ChromaDB metadata filter from optional chapter_id / version_type values.
     """
     filters = []
     if chapter_id:
@@ -75,30 +768,240 @@ async def get_chapter_versions(chapter_id: str = None, version_type: str = None)
     elif len(filters) > 1:
         query_where = {"$and": filters}
     # If filters is empty, query_where remains empty, which means no filter is applied.
+    return query_where
+
+async def get_chapter_versions(chapter_id: str = None, version_type: str = None) -> List[VersionHandle]:
+    """
+    Retrieves chapter versions based on chapter_id and/or version_type filters.
+    Returns a list of VersionHandle mappings, each with 'id', 'content', and 'metadata';
+    content is only read (and rebuilt from its delta chain) when it is accessed.
+    """
+    query_where = _build_where(chapter_id, version_type)
+
+    def query_store():
+        with span("store.get", purpose="versions"):
+            return get_collection().get(
+                where=query_where if query_where else None, # Pass None if no filters, or the structured query
+                include=['metadatas'] # Texts are materialized lazily by the handles
+            )
 
     try:
-        results = chapters_collection.get(
-            where=query_where if query_where else None, # Pass None if no filters, or the structured query
-            # Explicitly include documents and metadatas in the results
-            include=['documents', 'metadatas']
-        )
-        formatted_results = []
-        if results and results['ids']:
-            for i in range(len(results['ids'])):
-                formatted_results.append({
-                    "id": results['ids'][i],
-                    "content": results['documents'][i],
-                    "metadata": results['metadatas'][i]
-                })
-        return formatted_results
+        await _drain_pending_writes() # Read-your-writes: include versions still in the write-behind queue
+        results = await _run_in_store(query_store)
+        return [VersionHandle(doc_id, metadata) for doc_id, metadata in zip(results['ids'], results['metadatas'])]
     except Exception as e:
         print(f"Error retrieving from ChromaDB: {e}")
         return []
 
+async def search_chapter_versions(
+    query_text: str,
+    k: int = 10,
+    chapter_id: str = None,
+    version_type: str = None,
+    include_content: bool = True,
+    offset: int = 0
+) -> List[Dict[str, Any]]:
+    """
+    Semantic search over stored versions: returns the k versions nearest to query_text
+    (starting at `offset`, for pagination), using the collection's vector index.
+    Optional chapter_id / version_type filters are applied inside the index query.
+    Each result has 'id', 'distance' (lower is closer) and 'metadata'; 'content' is only
+    fetched when include_content is True, so metadata-only searches never move bodies.
+    """
+    query_where = _build_where(chapter_id, version_type)
+
+    def query_store():
+        query_embedding = embed_documents([query_text])
+        include = ['metadatas', 'distances'] + (['documents'] if include_content else [])
+        with span("store.query", k=k, offset=offset):
+            results = get_collection().query(
+                query_embeddings=query_embedding,
+                n_results=offset + k, # The index has no offset, so fetch through the requested page
+                where=query_where if query_where else None,
+                include=include
+            )
+        ids = results['ids'][0][offset:]
+        metadatas = results['metadatas'][0][offset:]
+        distances = results['distances'][0][offset:]
+        documents = None
+        if include_content:
+            documents = _materialize(ids, metadatas, results['documents'][0][offset:])
+        return ids, metadatas, distances, documents
+
+    try:
+        await _drain_pending_writes()
+        ids, metadatas, distances, documents = await _run_in_store(query_store)
+    except Exception as e:
+        print(f"Error searching ChromaDB: {e}")
+        return []
+
+    hits = []
+    for i, doc_id in enumerate(ids):
+        hit = {"id": doc_id, "distance": distances[i], "metadata": metadatas[i]}
+        if include_content:
+            hit["content"] = documents[i]
+        hits.append(hit)
+    return hits
+
+async def search_passages(
+    query_text: str,
+    k: int = 10,
+    chapter_id: str = None,
+    version_type: str = None
+) -> List[Dict[str, Any]]:
+    """
+    Semantic search over passages of the stored texts: returns the k passages nearest to
+    query_text, so a match deep inside a long chapter is found. Each result has 'id',
+    'distance', 'metadata' (with 'parent_id', the record storing the text, and the passage's
+    'start'/'end' offsets in it) and 'text'. version_type filters on the storing record's type.
+    """
+    query_where = _build_where(chapter_id, version_type)
+
+    def query_store():
+        query_embedding = embed_documents([query_text])
+        with span("store.query", k=k, passages=True):
+            results = get_passage_collection().query(
+                query_embeddings=query_embedding,
+                n_results=k,
+                where=query_where if query_where else None,
+                include=['metadatas', 'distances']
+            )
+        metadatas = results['metadatas'][0]
+        texts = _reconstruct_texts(meta["parent_id"] for meta in metadatas)
+        return results['ids'][0], metadatas, results['distances'][0], texts
+
+    try:
+        await _drain_pending_writes()
+        ids, metadatas, distances, texts = await _run_in_store(query_store)
+    except Exception as e:
+        print(f"Error searching ChromaDB: {e}")
+        return []
+    return [
+        {"id": passage_id, "distance": distance, "metadata": meta, "text": (texts.get(meta["parent_id"]) or "")[meta["start"]:meta["end"]]}
+        for passage_id, meta, distance in zip(ids, metadatas, distances)
+    ]
+
+async def reembed_collection(batch_size: int = 256) -> Dict[str, int]:
+    """
+    Recomputes and rewrites the stored embedding of every version, page by page.
+    Used after a store rebuild or an import of existing versions: texts already in the
+    embedding cache cost no model time, so re-indexing a known corpus is close to free.
+    The passage records of every stored text are rewritten as well.
+    Returns the number of records updated plus the cache hit/miss counts for this run.
+    """
+    await _drain_pending_writes()
+    embedding_cache = get_embedding_cache()
+    hits_before, misses_before = embedding_cache.hits, embedding_cache.misses
+
+    def reembed_page(offset: int) -> tuple:
+        page = get_collection().get(limit=batch_size, offset=offset, include=['documents', 'metadatas'])
+        if not page['ids']:
+            return 0, 0
+        documents = _materialize(page['ids'], page['metadatas'], page['documents'])
+        records = [{"id": doc_id, "metadata": meta or {}} for doc_id, meta, doc in zip(page['ids'], page['metadatas'], documents) if doc is not None]
+        texts = [doc for doc in documents if doc is not None]
+        if records:
+            pooled, passages = embed_texts(texts)
+            get_collection().update(ids=[r["id"] for r in records], embeddings=pooled)
+            owned = [(r, p) for r, p in zip(records, passages) if r["metadata"].get("content_ref", r["id"]) == r["id"]]
+            if owned:
+                # Drop the old passages first: the text may now split into fewer of them
+                get_passage_collection().delete(where={"parent_id": {"$in": [r["id"] for r, _ in owned]}})
+                _write_passages([r for r, _ in owned], [p for _, p in owned])
+        return len(page['ids']), len(records)
+
+    updated = 0
+    offset = 0
+    while True:
+        page_size, page_updated = await _run_in_store(reembed_page, offset)
+        if page_size == 0:
+            break
+        updated += page_updated
+        offset += page_size
+    result = {
+        "updated": updated,
+        "cache_hits": embedding_cache.hits - hits_before,
+        "cache_misses": embedding_cache.misses - misses_before,
+    }
+    print(f"Re-embedded {updated} versions ({result['cache_hits']} cache hits, {result['cache_misses']} encoded).")
+    return result
+
+def _rebuild_best_version_index(batch_size: int = 1000) -> int:
+    # Metadata-only scan of the whole collection; document bodies are never transferred.
+    best_version_index = get_best_version_index()
+    best_version_index.clear()
+    offset = 0
+    while True:
+        page = get_collection().get(limit=batch_size, offset=offset, include=['metadatas'])
+        if not page['ids']:
+            break
+        for doc_id, metadata in zip(page['ids'], page['metadatas']):
+            if metadata and metadata.get("chapter_id"):
+                best_version_index.update(doc_id, metadata)
+        offset += len(page['ids'])
+    best_version_index.save()
+    return offset
+
+async def rebuild_best_version_index() -> int:
+    """
+    Rebuilds the best-version index from the versions already in ChromaDB (e.g. for a store
+    written before the index existed, or after versions were deleted).
+    Returns the number of versions scanned.
+    """
+    await _drain_pending_writes()
+    scanned = await _run_in_store(_rebuild_best_version_index)
+    print(f"Best-version index rebuilt from {scanned} stored versions.")
+    return scanned
+
+def _preferred_version(entry: Dict[str, Any]) -> Tuple[str, str] | Tuple[None, None]:
+    # (index slot, document id) of the version retrieval prefers for a chapter's index entry
+    for slot in ("latest_final", "best_reviewed", "latest"):
+        if slot in entry:
+            return slot, entry[slot]["id"]
+    return None, None
+
+async def _ensure_best_version_index():
+    await _drain_pending_writes() # Make sure the index reflects every queued version
+    if not get_best_version_index().exists:
+        # Store predates the index: build it once from the stored metadata
+        await rebuild_best_version_index()
+
+async def get_preferred_versions(chapter_ids: List[str] = None) -> Dict[str, VersionHandle]:
+    """
+    Returns {chapter_id: VersionHandle} with the version retrieve_consistent_content_rl_search
+    would return for each chapter (every indexed chapter by default). Only metadata is read;
+    load contents with load_versions() or the handles themselves.
+    """
+    await _ensure_best_version_index()
+    index = get_best_version_index()
+    chosen = {}
+    for chapter_id in (index.chapter_ids() if chapter_ids is None else chapter_ids):
+        doc_id = _preferred_version(index.get(chapter_id))[1]
+        if doc_id:
+            chosen[doc_id] = chapter_id
+    if not chosen:
+        return {}
+
+    def query_store():
+        with span("store.get", purpose="preferred"):
+            return get_collection().get(ids=list(chosen), include=['metadatas'])
+
+    results = await _run_in_store(query_store)
+    return {chosen[doc_id]: VersionHandle(doc_id, metadata) for doc_id, metadata in zip(results['ids'], results['metadatas'])}
+
+def _fetch_version(doc_id: str) -> Dict[str, Any]:
+    # Fetches exactly one version (plus its shared body, if it is a deduplicated record).
+    with span("store.get", purpose="fetch"):
+        results = get_collection().get(ids=[doc_id], include=['documents', 'metadatas'])
+    if not results['ids']:
+        return {}
+    documents = _materialize(results['ids'], results['metadatas'], results['documents'])
+    return {"id": results['ids'][0], "content": documents[0], "metadata": results['metadatas'][0]}
+
 async def retrieve_consistent_content_rl_search(
     chapter_id: str,
     target_version_type: str = "final",
-    query_text: str = None # Could be used for semantic search in a true RL system
+    query_text: str = None # If given, the version semantically closest to this text is returned
 ) -> Dict[str, Any]:
     """
     Conceptual: Implements a "RL Search Algorithm" for intelligent and consistent retrieval.
@@ -109,55 +1012,61 @@ async def retrieve_consistent_content_rl_search(
     1. The latest 'final' version.
     2. If no 'final', the 'reviewed' version with the highest combined review scores.
     3. As a fallback, the latest available version ('spun', 'human_edited', 'raw').
+
+    The choice is read from the materialized BestVersionIndex, so retrieval is a single
+    lookup plus a fetch of exactly one document, however many versions the chapter has.
+
+    If query_text is given, the chapter's version nearest to it (preferring target_version_type)
+    is returned instead, via search_chapter_versions.
     """
     print(f"Attempting 'RL Search' for chapter {chapter_id} (target: {target_version_type})...")
 
-    # 1. Prioritize retrieving 'final' versions
-    final_versions = await get_chapter_versions(chapter_id=chapter_id, version_type="final")
-    if final_versions:
-        # If multiple 'final' versions exist, return the most recent one by timestamp
-        print(f"Found {len(final_versions)} final versions. Returning the latest one.")
-        final_versions.sort(key=lambda x: x['metadata'].get('timestamp', ''), reverse=True)
-        return final_versions[0]
-
-    # 2. If no 'final', look for 'reviewed' versions
-    reviewed_versions = await get_chapter_versions(chapter_id=chapter_id, version_type="reviewed")
-    if reviewed_versions:
-        print(f"No final version found. Checking {len(reviewed_versions)} reviewed versions.")
-        # Calculate a proxy score for reviewed versions based on AI review metadata
-        def calculate_proxy_score(version_data):
-            meta = version_data.get('metadata', {})
-            # Sum of all scores, giving a higher value to better reviews
-            return (meta.get('fidelity_score', 0) + meta.get('readability_score', 0) +
-                    meta.get('grammar_score', 0) + meta.get('originality_score', 0))
-
-        # Sort reviewed versions by the calculated proxy score in descending order
-        reviewed_versions.sort(key=calculate_proxy_score, reverse=True)
-        print(f"Returning the top-rated reviewed version.")
-        return reviewed_versions[0]
-
-    # 3. Fallback: Return the latest available version if no 'final' or 'reviewed' versions are found
-    all_versions = await get_chapter_versions(chapter_id=chapter_id)
-    if all_versions:
-        print(f"No final or reviewed version found. Falling back to the latest available version.")
-        all_versions.sort(key=lambda x: x['metadata'].get('timestamp', ''), reverse=True)
-        return all_versions[0]
-
-    print(f"No versions found for chapter {chapter_id} in ChromaDB.")
-    return {} # Return an empty dict if no versions are found
+    if query_text:
+        hits = await search_chapter_versions(query_text, k=1, chapter_id=chapter_id, version_type=target_version_type)
+        if not hits:
+            hits = await search_chapter_versions(query_text, k=1, chapter_id=chapter_id)
+        if hits:
+            print(f"Returning the {hits[0]['metadata'].get('version_type')} version closest to the query.")
+            return {"id": hits[0]["id"], "content": hits[0]["content"], "metadata": hits[0]["metadata"]}
+        print(f"No versions found for chapter {chapter_id} in ChromaDB.")
+        return {}
+
+    await _ensure_best_version_index()
+    entry = get_best_version_index().get(chapter_id)
+
+    slot, doc_id = _preferred_version(entry)
+    if slot == "latest_final":
+        print("Found a final version. Returning the latest one.")
+    elif slot == "best_reviewed":
+        print(f"No final version found. Returning the top-rated reviewed version (score {entry['best_reviewed']['score']}).")
+    elif slot == "latest":
+        print("No final or reviewed version found. Falling back to the latest available version.")
+    else:
+        print(f"No versions found for chapter {chapter_id} in ChromaDB.")
+        return {} # Return an empty dict if no versions are found
+
+    try:
+        version = await _run_in_store(_fetch_version, doc_id)
+    except Exception as e:
+        print(f"Error retrieving from ChromaDB: {e}")
+        return {}
+    if not version:
+        print(f"Indexed version {doc_id} is missing from ChromaDB; run the 'rebuild-index' command.")
+    return version
 
 # Example usage for testing this module independently
 async def main_versioning_test():
     # It's good practice to ensure a clean state for isolated tests
     try:
         # Delete the collection to ensure a fresh start for the test
-        client.delete_collection(name="book_chapters")
+        get_client().delete_collection(name="book_chapters")
         # Re-create the collection after deletion
-        global chapters_collection
-        chapters_collection = client.get_or_create_collection(
-            name="book_chapters",
-            embedding_function=sentence_transformer_ef
-        )
+        global _collection
+        _collection = None
+        get_collection()
+        # The best-version index describes the deleted collection; start it over too
+        get_best_version_index().clear()
+        get_best_version_index().save()
         print("ChromaDB collection 'book_chapters' reset for testing.")
     except Exception as e:
         print(f"Could not reset ChromaDB collection for testing (might not exist yet): {e}")
@@ -201,11 +1110,11 @@ async def main_versioning_test():
     chapter_id_no_final = "test_chapter_no_final"
     # Ensure this separate test chapter also starts clean
     try:
-        client.delete_collection(name="book_chapters_no_final_test")
+        get_client().delete_collection(name="book_chapters_no_final_test")
         global chapters_collection_no_final_test
-        chapters_collection_no_final_test = client.get_or_create_collection(
+        chapters_collection_no_final_test = get_client().get_or_create_collection(
             name="book_chapters_no_final_test",
-            embedding_function=sentence_transformer_ef
+            embedding_function=None
         )
         print("ChromaDB collection 'book_chapters_no_final_test' reset for testing.")
     except Exception as e:
@@ -226,6 +1135,8 @@ async def main_versioning_test():
     else:
         print(f"Failed to retrieve best reviewed version for {chapter_id_no_final}")
 
+    await close_version_store()
+
 
 if __name__ == "__main__":
     asyncio.run(main_versioning_test())
@@ -0,0 +1,265 @@
+# src/version_retention.py
+import os
+import statistics
+import time
+from typing import Dict, Any, List, Set, Tuple
+from config import VERSION_DELTAS_ENABLED, VERSION_KEYFRAME_INTERVAL
+from config import (
+    RETENTION_KEEP_VERSION_TYPES,
+    RETENTION_KEEP_TOP_REVIEWED,
+    RETENTION_KEEP_LATEST,
+    RETENTION_DELETE_BATCH_SIZE,
+)
+import version_manager as vm
+from version_deltas import encode_delta
+from tracing import span, increment
+from workflow_state import get_checkpoint_store
+
+# Retention and compaction for the version store.
+# Every workflow iteration stores several versions and nothing else removes them, so the
+# collection, its vector index and every chapter-filtered `get` keep growing. Compaction keeps,
+# for each chapter: every version of a type in RETENTION_KEEP_VERSION_TYPES (finals), the
+# RETENTION_KEEP_TOP_REVIEWED best reviewed versions, the RETENTION_KEEP_LATEST most recent of
+# the rest, and the versions retrieval would return; everything else is deleted.
+# Chapters whose workflow is still running (an unfinished checkpoint) are left alone.
+#
+# Deleting a record must not break the ones kept:
+# - a kept version that shares its text through "content_ref" with a deleted record takes the
+#   text over (it is promoted to store the text itself; other kept sharers point at it), and
+# - a kept text stored as a delta whose parent is deleted is re-encoded against its nearest kept
+#   ancestor (or in full, past the keyframe interval).
+# Texts are rewritten before anything is deleted. The collections are then rebuilt so the
+# vector index drops the deleted entries, and the SQLite file is vacuumed.
+
+def _store_bytes() -> int:
+    total = 0
+    for root, _dirs, files in os.walk(vm._store_data_dir):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def _scan_metadata(batch_size: int = 1000) -> Dict[str, Dict[str, Any]]:
+    metadatas = {}
+    offset = 0
+    while True:
+        page = vm.get_collection().get(limit=batch_size, offset=offset, include=['metadatas'])
+        if not page['ids']:
+            break
+        for doc_id, metadata in zip(page['ids'], page['metadatas']):
+            metadatas[doc_id] = metadata or {}
+        offset += len(page['ids'])
+    return metadatas
+
+def _measure_query_latency(samples: int = 20) -> Dict[str, float]:
+    """
+    Median milliseconds of a chapter-filtered metadata `get` and of a 10-nearest vector query,
+    over a sample of the stored chapters.
+    """
+    collection = vm.get_collection()
+    chapter_ids = vm.get_best_version_index().chapter_ids()[:samples]
+    probe = collection.get(limit=1, include=['embeddings'])
+    if not chapter_ids or not probe['ids']:
+        return {"get_ms": 0.0, "query_ms": 0.0}
+    get_times, query_times = [], []
+    for chapter_id in chapter_ids:
+        started = time.perf_counter()
+        collection.get(where={"chapter_id": chapter_id}, include=['metadatas'])
+        get_times.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        collection.query(query_embeddings=[probe['embeddings'][0]], n_results=10, where={"chapter_id": chapter_id}, include=['distances'])
+        query_times.append((time.perf_counter() - started) * 1000)
+    return {"get_ms": round(statistics.median(get_times), 3), "query_ms": round(statistics.median(query_times), 3)}
+
+def plan_retention(metadatas: Dict[str, Dict[str, Any]], skip_chapters: Set[str] = frozenset(),
+                   keep_types=RETENTION_KEEP_VERSION_TYPES, keep_top_reviewed: int = RETENTION_KEEP_TOP_REVIEWED,
+                   keep_latest: int = RETENTION_KEEP_LATEST) -> Tuple[Set[str], Set[str]]:
+    """
+    Applies the retention rules to {doc_id: metadata}. Returns (ids to keep, ids to delete).
+    """
+    index = vm.get_best_version_index()
+    by_chapter: Dict[str, List[str]] = {}
+    for doc_id, metadata in metadatas.items():
+        by_chapter.setdefault(metadata.get("chapter_id"), []).append(doc_id)
+
+    keep = set()
+    for chapter_id, doc_ids in by_chapter.items():
+        if chapter_id is None or chapter_id in skip_chapters:
+            keep.update(doc_ids)
+            continue
+        doc_ids.sort(key=lambda doc_id: metadatas[doc_id].get("timestamp", "")) # Oldest first
+        keep.update(doc_id for doc_id in doc_ids if metadatas[doc_id].get("version_type") in keep_types)
+        rest = [doc_id for doc_id in doc_ids if doc_id not in keep]
+        reviewed = [doc_id for doc_id in rest if metadatas[doc_id].get("version_type") == "reviewed"]
+        # Stable sort: on a tie the earlier reviewed version ranks higher, as in the best-version index
+        top_reviewed = sorted(reviewed, key=lambda doc_id: -vm.review_score(metadatas[doc_id]))[:keep_top_reviewed]
+        keep.update(top_reviewed)
+        others = [doc_id for doc_id in rest if doc_id not in keep]
+        keep.update(others[-keep_latest:] if keep_latest > 0 else [])
+        for slot in ("latest_final", "best_reviewed", "latest"): # What retrieval returns ("head" is only a write hint)
+            doc_id = index.get(chapter_id).get(slot, {}).get("id")
+            if doc_id in metadatas:
+                keep.add(doc_id)
+    return keep, set(metadatas) - keep
+
+def _plan_rewrites(metadatas: Dict[str, Dict[str, Any]], keep: Set[str], delete: Set[str]) -> Tuple[Dict[str, str], Set[str], Dict[str, str]]:
+    """
+    Returns the storage fixes deleting `delete` needs:
+    (deleted owner -> kept record promoted to store its text, kept records whose text must be
+    re-encoded, kept pointer -> new content_ref).
+    """
+    promoted: Dict[str, str] = {}
+    repointed: Dict[str, str] = {}
+    for doc_id in sorted(keep, key=lambda doc_id: metadatas[doc_id].get("timestamp", "")):
+        owner = metadatas[doc_id].get("content_ref", doc_id)
+        if owner == doc_id or owner not in delete:
+            continue
+        if owner not in promoted:
+            promoted[owner] = doc_id # The oldest kept sharer takes the text over
+        else:
+            repointed[doc_id] = promoted[owner]
+    rewrites = set(promoted.values())
+    for doc_id in keep:
+        metadata = metadatas[doc_id]
+        if metadata.get("content_ref", doc_id) == doc_id and metadata.get("storage") == "delta" and metadata.get("delta_parent") in delete:
+            rewrites.add(doc_id)
+    return promoted, rewrites, repointed
+
+def _rewrite_documents(metadatas: Dict[str, Dict[str, Any]], rewrites: Set[str], delete: Set[str],
+                       promoted: Dict[str, str]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    """
+    Returns {doc_id: (document, storage metadata)} for every record in `rewrites`: a delta against
+    its nearest kept ancestor when the chain stays within VERSION_KEYFRAME_INTERVAL and the delta
+    is smaller, the full text otherwise.
+    """
+    def kept_ancestor(owner: str) -> str | None:
+        metadata = metadatas[owner]
+        while metadata.get("storage") == "delta":
+            parent = metadata["delta_parent"]
+            if parent not in delete:
+                return parent
+            if parent in promoted:
+                return promoted[parent] # Holds the same text from now on
+            metadata = metadatas.get(parent, {})
+        return None
+
+    ancestors = {doc_id: kept_ancestor(metadatas[doc_id].get("content_ref", doc_id)) for doc_id in rewrites}
+    wanted = set(rewrites) | {ancestor for ancestor in ancestors.values() if ancestor}
+    texts = vm._reconstruct_texts(metadatas[doc_id].get("content_ref", doc_id) for doc_id in wanted) # Before anything is deleted
+    text_of = lambda doc_id: texts[metadatas[doc_id].get("content_ref", doc_id)]
+
+    results = {}
+    def plan(doc_id: str) -> int:
+        # Plans doc_id's new document and returns its chain depth; ancestors are planned first
+        if doc_id not in rewrites:
+            return metadatas[doc_id].get("chain_depth", 0)
+        if doc_id not in results:
+            text = text_of(doc_id)
+            document, storage = text, {"content_ref": doc_id, "storage": "full", "chain_depth": 0, "delta_parent": None}
+            ancestor = ancestors[doc_id]
+            if VERSION_DELTAS_ENABLED and ancestor:
+                depth = plan(ancestor) + 1
+                if depth < VERSION_KEYFRAME_INTERVAL:
+                    delta = encode_delta(text_of(ancestor), text)
+                    if len(delta) < len(text):
+                        document = delta
+                        storage.update(storage="delta", delta_parent=ancestor, chain_depth=depth)
+            results[doc_id] = (document, storage)
+        return results[doc_id][1]["chain_depth"]
+
+    for doc_id in rewrites:
+        plan(doc_id)
+    return results
+
+def _apply(metadatas: Dict[str, Dict[str, Any]], delete: Set[str], promoted: Dict[str, str], rewrites: Set[str],
+           repointed: Dict[str, str], batch_size: int) -> int:
+    collection = vm.get_collection()
+    passages = vm.get_passage_collection()
+    if rewrites:
+        with span("compact.rewrite", records=len(rewrites)):
+            documents = _rewrite_documents(metadatas, rewrites, delete, promoted)
+            ids = sorted(documents)
+            embeddings = collection.get(ids=ids, include=['embeddings'])
+            embedding_for = dict(zip(embeddings['ids'], embeddings['embeddings']))
+            collection.update(
+                ids=ids,
+                documents=[documents[doc_id][0] for doc_id in ids],
+                embeddings=[embedding_for[doc_id] for doc_id in ids], # Unchanged; given so nothing is re-embedded
+                metadatas=[documents[doc_id][1] for doc_id in ids],
+            )
+    if repointed:
+        ids = sorted(repointed)
+        collection.update(ids=ids, metadatas=[{"content_ref": repointed[doc_id]} for doc_id in ids])
+    for owner, new_owner in promoted.items():
+        moved = passages.get(where={"parent_id": owner}, include=[])
+        if moved['ids']:
+            passages.update(ids=moved['ids'], metadatas=[{"parent_id": new_owner}] * len(moved['ids']))
+
+    doomed = sorted(delete)
+    with span("compact.delete", records=len(doomed)):
+        for start in range(0, len(doomed), batch_size):
+            batch = doomed[start:start + batch_size]
+            passages.delete(where={"parent_id": {"$in": batch}})
+            collection.delete(ids=batch)
+    vm._text_cache.discard(doomed)
+    return len(doomed)
+
+def _compact(dry_run: bool, rebuild: bool, batch_size: int, rules: Dict[str, Any]) -> Dict[str, Any]:
+    # Runs entirely on the store thread, so no version write interleaves with it
+    unfinished = {chapter["chapter_id"] for chapter in get_checkpoint_store().unfinished()}
+    with span("compact.plan") as plan_span:
+        metadatas = _scan_metadata()
+        keep, delete = plan_retention(metadatas, unfinished, **rules)
+        promoted, rewrites, repointed = _plan_rewrites(metadatas, keep, delete)
+        plan_span.update(kept=len(keep), deleted=len(delete), rewritten=len(rewrites))
+    report = {
+        "versions": len(metadatas),
+        "kept": len(keep),
+        "deleted": len(delete),
+        "rewritten": len(rewrites),
+        "repointed": len(repointed),
+        "skipped_chapters": len(unfinished),
+    }
+    if dry_run or not delete:
+        return report
+    _apply(metadatas, delete, promoted, rewrites, repointed, batch_size)
+    if rebuild:
+        with span("compact.rebuild"):
+            vm._rebuild_collection(vm._collection_name)
+            vm._rebuild_collection(f"{vm._collection_name}_passages")
+            report["segments_removed"] = vm._vacuum_store()
+    vm._rebuild_best_version_index()
+    increment("versions_compacted", len(delete))
+    return report
+
+async def compact_version_store(dry_run: bool = False, rebuild: bool = True, batch_size: int = RETENTION_DELETE_BATCH_SIZE,
+                                **rules) -> Dict[str, Any]:
+    """
+    Applies the retention rules to every chapter and compacts the store. Rules default to the
+    RETENTION_* settings and can be overridden (keep_types, keep_top_reviewed, keep_latest).
+    With dry_run, only reports what would be deleted. With rebuild, the collections are rebuilt
+    and vacuumed afterwards so the space is actually returned.
+    Returns counts plus "bytes_before"/"bytes_after" and query latency "latency_before"/"latency_after".
+    """
+    await vm.flush_pending_writes()
+    await vm._ensure_best_version_index()
+    bytes_before = await vm._run_in_store(_store_bytes)
+    latency_before = await vm._run_in_store(_measure_query_latency)
+    with span("compact", dry_run=dry_run):
+        report = await vm._run_in_store(_compact, dry_run, rebuild, batch_size, rules)
+    report["bytes_before"] = bytes_before
+    report["latency_before"] = latency_before
+    if not dry_run and report["deleted"]:
+        report["bytes_after"] = await vm._run_in_store(_store_bytes)
+        report["latency_after"] = await vm._run_in_store(_measure_query_latency)
+    else:
+        report["bytes_after"], report["latency_after"] = bytes_before, latency_before
+
+    verb = "Would delete" if dry_run else "Deleted"
+    print(f"{verb} {report['deleted']} of {report['versions']} versions ({report['rewritten']} kept texts rewritten, "
+          f"{report['skipped_chapters']} chapters with running workflows skipped).")
+    if not dry_run:
+        print(f"Store size: {report['bytes_before']:,} -> {report['bytes_after']:,} bytes "
+              f"({report['bytes_before'] - report['bytes_after']:,} reclaimed).")
+        print(f"Chapter get: {report['latency_before']['get_ms']} -> {report['latency_after']['get_ms']} ms; "
+              f"vector query: {report['latency_before']['query_ms']} -> {report['latency_after']['query_ms']} ms (medians).")
+    return report
@@ -0,0 +1,109 @@
+# src/workflow_state.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List
+from config import WORKFLOW_STATE_PATH, ensure_dir
+
+# Durable checkpoints for main.workflow_chapter_processing.
+# The workflow is a state machine over these steps; after every completed step its whole state
+# (step, iteration, current/previous content, pending feedback, ...) is written to SQLite, and
+# each transition is appended to a log (the transitions table). A resumed workflow continues
+# from the saved step.
+#
+#   scrape -> spin -> review -> human_review -> spin ... (next iteration or re-spin)
+#                                            -> finalize -> finalized
+#                                            -> auto_finish -> auto_finished
+#                                            -> stopped
+
+TERMINAL_STEPS = ("finalized", "stopped", "auto_finished")
+WORKFLOW_STEPS = ("scrape", "spin", "review", "human_review", "finalize", "auto_finish") + TERMINAL_STEPS
+
+class WorkflowCheckpointStore:
+    """
+    SQLite-backed workflow checkpoints: the latest state per chapter, plus an append-only
+    transition log. Each save is its own committed transaction.
+    """
+
+    def __init__(self, path: str = WORKFLOW_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        ensure_dir(os.path.dirname(path) or ".")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " chapter_id TEXT PRIMARY KEY, chapter_name TEXT, chapter_url TEXT, step TEXT, state TEXT, updated REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS transitions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, chapter_id TEXT, from_step TEXT, to_step TEXT, iteration INTEGER, at REAL)"
+        )
+        self._conn.commit()
+
+    def load(self, chapter_id: str) -> Dict[str, Any] | None:
+        """
+        Returns the last checkpointed state of a chapter's workflow, or None.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM checkpoints WHERE chapter_id = ?", (chapter_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, chapter_id: str, chapter_name: str, chapter_url: str, state: Dict[str, Any], from_step: str = None):
+        """
+        Checkpoints a workflow's state; raises ValueError if state["step"] isn't one of WORKFLOW_STEPS.
+        """
+        if state["step"] not in WORKFLOW_STEPS:
+            raise ValueError(f"Unknown workflow step: {state['step']}")
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (chapter_id, chapter_name, chapter_url, step, state, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (chapter_id, chapter_name, chapter_url, state["step"], json.dumps(state), now),
+            )
+            self._conn.execute(
+                "INSERT INTO transitions (chapter_id, from_step, to_step, iteration, at) VALUES (?, ?, ?, ?, ?)",
+                (chapter_id, from_step, state["step"], state.get("iteration", 0), now),
+            )
+            self._conn.commit()
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """
+        Returns {"chapter_id", "chapter_name", "chapter_url", "step"} for every chapter whose
+        workflow hasn't reached a terminal step, oldest checkpoint first.
+        """
+        placeholders = ", ".join("?" for _ in TERMINAL_STEPS)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT chapter_id, chapter_name, chapter_url, step FROM checkpoints WHERE step NOT IN ({placeholders}) ORDER BY updated",
+                TERMINAL_STEPS,
+            ).fetchall()
+        return [{"chapter_id": r[0], "chapter_name": r[1], "chapter_url": r[2], "step": r[3]} for r in rows]
+
+    def chapter_names(self) -> Dict[str, str]:
+        """
+        Returns {chapter_id: chapter_name} for every chapter with a checkpoint.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT chapter_id, chapter_name FROM checkpoints").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_checkpoint_store: WorkflowCheckpointStore = None
+
+def get_checkpoint_store() -> WorkflowCheckpointStore:
+    global _checkpoint_store
+    if _checkpoint_store is None:
+        _checkpoint_store = WorkflowCheckpointStore()
+    return _checkpoint_store
+
+def close_checkpoint_store():
+    global _checkpoint_store
+    if _checkpoint_store is not None:
+        _checkpoint_store.close()
+        _checkpoint_store = None